@@ -1,6 +1,8 @@
 import streamlit as st
 import leafmap.foliumap as leafmap
 
+from flood.tile_proxy import proxy_layers
+
 
 def app():
     st.title("Searching Basemaps")
@@ -41,4 +43,5 @@ def app():
                 for tile in tiles:
                     m.add_xyz_service(tile)
 
+            proxy_layers(m)
             m.to_streamlit(width, height)
@@ -1,6 +1,8 @@
 import streamlit as st
 import leafmap.foliumap as leafmap
 
+from flood.tile_proxy import proxy_layers
+
 
 def app():
     st.title("Using U.S. Census Data")
@@ -32,4 +34,5 @@ def app():
         with row1_col1:
             m = leafmap.Map()
             m.add_census_data(wms, layer)
+            proxy_layers(m)
             m.to_streamlit(width, height)
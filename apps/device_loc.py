@@ -4,6 +4,8 @@ from bokeh.models import CustomJS
 from streamlit_bokeh_events import streamlit_bokeh_events
 import leafmap.foliumap as leafmap
 
+from flood.tile_proxy import proxy_layers
+
 
 def app():
 
@@ -40,4 +42,5 @@ def app():
             m.add_basemap("ROADMAP")
             popup = f"lat, lon: {lat}, {lon}"
             m.add_marker(location=(lat, lon), popup=popup)
+            proxy_layers(m)
             m.to_streamlit()
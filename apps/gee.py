@@ -2,6 +2,8 @@ import ee
 import streamlit as st
 import geemap.foliumap as geemap
 
+from flood.tile_proxy import proxy_layers
+
 
 def nlcd():
 
@@ -41,10 +43,12 @@ def nlcd():
                 legend_title="NLCD Land Cover Classification", builtin_legend="NLCD"
             )
         with row1_col1:
+            proxy_layers(Map)
             Map.to_streamlit(width=width, height=height)
 
     else:
         with row1_col1:
+            proxy_layers(Map)
             Map.to_streamlit(width=width, height=height)
 
 
@@ -104,9 +108,11 @@ def search_data():
                         st.error(f"Invalid visualization parameters: {e}")
 
             with col1:
+                proxy_layers(Map)
                 Map.to_streamlit()
         else:
             with col1:
+                proxy_layers(Map)
                 Map.to_streamlit()
 
 
@@ -2,6 +2,8 @@ import ee
 import streamlit as st
 import geemap.foliumap as geemap
 
+from flood.tile_proxy import proxy_layers
+
 WIDTH = 1060
 HEIGHT = 600
 
@@ -9,6 +11,7 @@ HEIGHT = 600
 def function():
     st.write("Not implemented yet.")
     Map = geemap.Map()
+    proxy_layers(Map)
     Map.to_streamlit(WIDTH, HEIGHT)
 
 
@@ -66,6 +69,7 @@ def lulc_mrb_floodplain():
     Map.addLayer(State_style, {}, 'State Boundaries')
     Map.addLayer(MRB_style, {}, 'MRB Boundary')
 
+    proxy_layers(Map)
     Map.to_streamlit(WIDTH, HEIGHT)
 
 
@@ -116,6 +120,7 @@ def global_mangrove_watch():
         'Global Mangrove Watch 2015',
     )
 
+    proxy_layers(Map)
     Map.to_streamlit(WIDTH, HEIGHT)
 
 
@@ -183,4 +188,5 @@ def app():
 
     else:
         Map = geemap.Map()
+        proxy_layers(Map)
         Map.to_streamlit(WIDTH, HEIGHT)
@@ -1,6 +1,8 @@
 import streamlit as st
 import leafmap.foliumap as leafmap
 
+from flood.tile_proxy import proxy_layers
+
 
 def app():
 
@@ -16,4 +18,5 @@ def app():
         name="Heat map",
         radius=20,
     )
+    proxy_layers(m)
     m.to_streamlit(width=700, height=500)
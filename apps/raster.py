@@ -3,6 +3,8 @@ import leafmap.foliumap as leafmap
 import streamlit as st
 import palettable
 
+from flood.tile_proxy import proxy_layers
+
 
 @st.cache_data
 def load_cog_list():
@@ -74,4 +76,5 @@ def app():
                     st.error("Work in progress. Try it again later.")
 
     with row1_col1:
+        proxy_layers(m)
         m.to_streamlit()
@@ -1,7 +1,6 @@
 import ee
 import os
 import datetime
-import fiona
 import geopandas as gpd
 import folium
 import streamlit as st
@@ -10,27 +9,8 @@ import geemap.foliumap as geemap
 from datetime import date
 from .rois import *
 
-
-@st.cache_data
-def uploaded_file_to_gdf(data):
-    import tempfile
-    import os
-    import uuid
-
-    _, file_extension = os.path.splitext(data.name)
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(tempfile.gettempdir(), f"{file_id}{file_extension}")
-
-    with open(file_path, "wb") as file:
-        file.write(data.getbuffer())
-
-    if file_path.lower().endswith(".kml"):
-        fiona.drvsupport.supported_drivers["KML"] = "rw"
-        gdf = gpd.read_file(file_path, driver="KML")
-    else:
-        gdf = gpd.read_file(file_path)
-
-    return gdf
+from flood.tile_proxy import proxy_layers
+from flood.uploads import read_upload
 
 
 def app():
@@ -427,10 +407,11 @@ def app():
             m.add_gdf(gdf, "ROI")
 
         elif data:
-            gdf = uploaded_file_to_gdf(data)
+            gdf = read_upload(data)
             st.session_state["roi"] = geemap.gdf_to_ee(gdf, geodesic=False)
             m.add_gdf(gdf, "ROI")
 
+        proxy_layers(m)
         m.to_streamlit(height=600)
 
     with row1_col2:
@@ -1,25 +1,9 @@
 import os
-import fiona
 import geopandas as gpd
 import streamlit as st
 
-
-def save_uploaded_file(file_content, file_name):
-    """
-    Save the uploaded file to a temporary directory
-    """
-    import tempfile
-    import os
-    import uuid
-
-    _, file_extension = os.path.splitext(file_name)
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(tempfile.gettempdir(), f"{file_id}{file_extension}")
-
-    with open(file_path, "wb") as file:
-        file.write(file_content.getbuffer())
-
-    return file_path
+from flood.tile_proxy import proxy_layers
+from flood.uploads import read_upload
 
 
 def app():
@@ -56,16 +40,14 @@ def app():
 
         if data or url:
             if data:
-                file_path = save_uploaded_file(data, data.name)
                 layer_name = os.path.splitext(data.name)[0]
             elif url:
                 file_path = url
                 layer_name = url.split("/")[-1].split(".")[0]
 
             with row1_col1:
-                if file_path.lower().endswith(".kml"):
-                    fiona.drvsupport.supported_drivers["KML"] = "rw"
-                    gdf = gpd.read_file(file_path, driver="KML")
+                if data:
+                    gdf = read_upload(data)
                 else:
                     gdf = gpd.read_file(file_path)
                 lon, lat = leafmap.gdf_centroid(gdf)
@@ -90,6 +72,7 @@ def app():
                     # m.add_vector(file_path, layer_name=layer_name)
                     if backend == "folium":
                         m.zoom_to_gdf(gdf)
+                    proxy_layers(m)
                     m.to_streamlit(width=width, height=height)
 
         else:
@@ -2,6 +2,8 @@ import ast
 import streamlit as st
 import leafmap.foliumap as leafmap
 
+from flood.tile_proxy import proxy_layers
+
 
 @st.cache_data
 def get_layers(url):
@@ -65,4 +67,5 @@ def app():
                 legend_dict = ast.literal_eval(legend_text)
                 m.add_legend(legend_dict=legend_dict)
 
+            proxy_layers(m)
             m.to_streamlit(width, height)
@@ -2,6 +2,8 @@ import leafmap.foliumap as leafmap
 import pandas as pd
 import streamlit as st
 
+from flood.tile_proxy import proxy_layers
+
 
 def app():
 
@@ -62,4 +64,5 @@ def app():
         except Exception as e:
             st.error(e)
 
+    proxy_layers(m)
     m.to_streamlit()
@@ -0,0 +1,68 @@
+"""Time the at-risk overlay over a sweep of buffer radii.
+
+Synthetic flood polygons (merged discs around Kelantan) and random incident
+points are assessed at each radius, as the Further Analysis slider does.
+
+    python benchmarks/bench_at_risk.py --incidents 50000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flood.at_risk import FloodExposure  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--incidents", type=int, default=50000)
+    parser.add_argument("--discs", type=int, default=3000)
+    parser.add_argument(
+        "--radii", type=float, nargs="+", default=[100, 500, 1000, 5000]
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres = shapely.points(
+        rng.uniform(101.8, 102.6, args.discs), rng.uniform(5.5, 6.2, args.discs)
+    )
+    flood = shapely.get_parts(
+        shapely.union_all(
+            shapely.buffer(centres, rng.uniform(0.002, 0.008, args.discs))
+        )
+    )
+    incidents = pd.DataFrame(
+        {
+            "Longitude": rng.uniform(101.5, 103.0, args.incidents),
+            "Latitude": rng.uniform(5.0, 6.5, args.incidents),
+        }
+    )
+
+    start = timeit.default_timer()
+    exposure = FloodExposure(flood)
+    print(
+        f"prepare {len(flood)} flood polygons "
+        f"({len(exposure.polygons)} pieces): "
+        f"{timeit.default_timer() - start:.3f} s"
+    )
+    for radius in args.radii:
+        seconds = min(
+            timeit.repeat(
+                lambda: exposure.assess(incidents, radius), number=1, repeat=3
+            )
+        )
+        at_risk = int(exposure.assess(incidents, radius)["At Risk"].sum())
+        print(
+            f"{radius:>6g} m, {args.incidents} incidents: {seconds:.3f} s, "
+            f"{at_risk} at risk"
+        )
+
+
+if __name__ == "__main__":
+    main()
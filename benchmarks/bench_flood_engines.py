@@ -0,0 +1,150 @@
+"""Time derive_flood_extents on the local engine and on Earth Engine.
+
+Synthetic Sentinel-1 fixture scenes (dB backscatter with a darker flooded
+patch in the 'after' scene) are written to a temporary directory and run
+through the local engine, whole and tiled. With --earthengine the same AOI
+is also run on Earth Engine against real imagery, timing the graph
+evaluation up to the vector polygons, which needs an initialised Earth
+Engine account.
+
+    python benchmarks/bench_flood_engines.py --size 2000
+    python benchmarks/bench_flood_engines.py --earthengine \
+        --aoi 102.0 5.9 102.3 6.2 --dates 2021-11-01 2021-12-01 2021-12-15 2022-01-05
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flood.extent import derive_flood_extents  # noqa: E402
+from flood.extent_local import LocalCatalog, LocalEngine  # noqa: E402
+from flood.tiling import tiled_flood_extents  # noqa: E402
+
+# ~10 m pixels near the equator
+PIXEL_DEG = 0.00009
+
+
+def write_scene(path, data, west, north):
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        height=data.shape[0],
+        width=data.shape[1],
+        count=1,
+        dtype="float32",
+        crs="EPSG:4326",
+        transform=from_origin(west, north, PIXEL_DEG, PIXEL_DEG),
+        nodata=np.nan,
+        tiled=True,
+    ) as dst:
+        dst.write(data.astype(np.float32), 1)
+
+
+def make_fixtures(directory, size, west=102.0, north=6.2, seed=0):
+    """Write a before/after scene pair and return its catalog."""
+    rng = np.random.default_rng(seed)
+    before = rng.normal(-15, 1.5, (size, size))
+    after = rng.normal(-15, 1.5, (size, size))
+    rows, cols = np.ogrid[:size, :size]
+    flooded = (rows - size / 2) ** 2 + (cols - size / 3) ** 2 < (size / 6) ** 2
+    after[flooded] -= 10
+    scenes = []
+    for name, data, date in [
+        ("before.tif", before, "2021-11-15"),
+        ("after.tif", after, "2021-12-20"),
+    ]:
+        path = os.path.join(directory, name)
+        write_scene(path, data, west, north)
+        scenes.append(
+            {
+                "path": path,
+                "date": date,
+                "polarization": "VH",
+                "pass_direction": "Ascending",
+            }
+        )
+    aoi = [
+        [west, north - size * PIXEL_DEG],
+        [west + size * PIXEL_DEG, north - size * PIXEL_DEG],
+        [west + size * PIXEL_DEG, north],
+        [west, north],
+    ]
+    return LocalCatalog(scenes), aoi
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tile-km", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--earthengine", action="store_true")
+    parser.add_argument("--aoi", type=float, nargs=4)
+    parser.add_argument(
+        "--dates",
+        nargs=4,
+        default=["2021-11-01", "2021-12-01", "2021-12-15", "2022-01-05"],
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        catalog, aoi = make_fixtures(directory, args.size)
+        engine = LocalEngine(catalog)
+
+        def run_local():
+            return derive_flood_extents(aoi, *args.dates, engine=engine)
+
+        seconds = min(timeit.repeat(run_local, number=1, repeat=args.repeat))
+        vectors, rasters, _, _ = run_local()
+        flooded = int((~np.ma.getmaskarray(rasters.data)).sum())
+        print(
+            f"local engine, {args.size}x{args.size} px: {seconds:.2f} s, "
+            f"{len(vectors['features'])} polygons, {flooded} flooded px"
+        )
+
+        start = timeit.default_timer()
+        tiled = tiled_flood_extents(
+            aoi,
+            *args.dates,
+            engine=engine,
+            tile_size_km=args.tile_km,
+            workers=args.workers,
+        )
+        seconds = timeit.default_timer() - start
+        flooded = int((~np.ma.getmaskarray(tiled.flood_raster.data)).sum())
+        print(
+            f"local engine, {args.tile_km:g} km tiles, {args.workers} workers: "
+            f"{seconds:.2f} s, {len(tiled.flood_vectors['features'])} polygons, "
+            f"{flooded} flooded px"
+        )
+
+    if args.earthengine:
+        import ee
+
+        ee.Initialize()
+        west, south, east, north = args.aoi or (
+            aoi[0][0],
+            aoi[0][1],
+            aoi[2][0],
+            aoi[2][1],
+        )
+        ring = [[west, south], [east, south], [east, north], [west, north]]
+
+        def run_ee():
+            vectors, _, _, _ = derive_flood_extents(ring, *args.dates)
+            return vectors.size().getInfo()
+
+        seconds = min(timeit.repeat(run_ee, number=1, repeat=args.repeat))
+        print(f"Earth Engine: {seconds:.2f} s, {run_ee()} polygons")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Memory footprint per 10k incidents of every incident CSV variant.
+
+Compares the frame pandas.read_csv returns (what the notebooks and pages
+hold) with the compact IncidentRecords, and with the pandas frame rebuilt
+from the records (categoricals, float32).
+
+    python benchmarks/bench_records.py
+"""
+import glob
+import os
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flood.records import IncidentRecords  # noqa: E402
+
+PATTERN = "analytics/data2/*.csv"
+
+
+def per_10k(nbytes, rows):
+    return nbytes / rows * 10_000 / 1e6
+
+
+def main():
+    print(
+        f"{'file':<48}{'rows':>7}{'csv MB':>9}{'records':>9}"
+        f"{'frame':>9}{'load s':>8}"
+    )
+    for path in sorted(glob.glob(PATTERN)):
+        raw = pd.read_csv(path)
+        start = timeit.default_timer()
+        records = IncidentRecords.read_csv(path)
+        seconds = timeit.default_timer() - start
+        frame = records.to_frame()
+        print(
+            f"{os.path.basename(path)[:47]:<48}{len(records):>7}"
+            f"{per_10k(raw.memory_usage(deep=True).sum(), len(raw)):>9.2f}"
+            f"{per_10k(records.nbytes, len(records)):>9.2f}"
+            f"{per_10k(frame.memory_usage(deep=True).sum(), len(frame)):>9.2f}"
+            f"{seconds:>8.2f}"
+        )
+    print("(MB per 10k incidents)")
+
+
+if __name__ == "__main__":
+    main()
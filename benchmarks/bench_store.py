@@ -0,0 +1,54 @@
+"""Compare the old per-rerun CSV read with the shared Arrow incident store.
+
+Run from the repository root:
+
+    python benchmarks/bench_store.py
+"""
+import os
+import sys
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flood import store  # noqa: E402
+
+REPEAT = 20
+
+
+def csv_rerun():
+    """What every page did on each rerun before the store existed."""
+    data = pd.read_csv(store.CSV_PATH)
+    return data[data["Year"] == 2021]
+
+
+def store_rerun():
+    data = store.load_incidents()
+    return data[data["Year"] == 2021]
+
+
+def main():
+    build = timeit.timeit(lambda: store.build_store(), number=1)
+    store.reset_store()
+    cold = timeit.timeit(lambda: store.get_store().frame, number=1)
+    csv_time = min(timeit.repeat(csv_rerun, number=1, repeat=REPEAT))
+    store_time = min(timeit.repeat(store_rerun, number=1, repeat=REPEAT))
+
+    csv_bytes = pd.read_csv(store.CSV_PATH).memory_usage(deep=True).sum()
+    store_bytes = store.load_incidents().memory_usage(deep=True).sum()
+
+    print(f"one-off CSV -> Arrow conversion: {build * 1e3:8.2f} ms")
+    print(f"first store open (per process):  {cold * 1e3:8.2f} ms")
+    print(f"per-rerun, CSV:                  {csv_time * 1e3:8.2f} ms")
+    print(f"per-rerun, shared store:         {store_time * 1e3:8.2f} ms")
+    print(f"frame memory, CSV:               {csv_bytes / 2**20:8.2f} MiB")
+    print(f"frame memory, store:             {store_bytes / 2**20:8.2f} MiB")
+    print(
+        "store file size:                 "
+        f"{os.path.getsize(store.store_path_for(store.CSV_PATH)) / 2**20:8.2f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
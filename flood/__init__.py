@@ -0,0 +1 @@
+"""Shared data and processing helpers for the flood incident pages."""
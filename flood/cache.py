@@ -0,0 +1,96 @@
+"""Small process-wide caches shared by every Streamlit session."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a fixed time.
+
+    Module-level instances live as long as the Streamlit server process, so
+    a value computed by one session is reused by all the others.
+
+    Inputs:
+        maxsize (int): Maximum number of entries; the least recently used
+            one is evicted first.
+        ttl (float): Seconds after which an entry is considered stale, None
+            for no expiry.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per key being computed, so identical concurrent requests
+        # wait for the first one instead of computing the value again
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value of key, computing and storing it if needed.
+
+        Exceptions raised by compute propagate and nothing is cached.
+
+        Inputs:
+            key: Hashable cache key.
+            compute (callable): Called without arguments on a miss.
+
+        Returns:
+            The cached or freshly computed value.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                value = self.get(key, _MISSING)
+                if value is _MISSING:
+                    value = compute()
+                    self.set(key, value)
+                return value
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+
+_MISSING = object()
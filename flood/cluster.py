@@ -0,0 +1,140 @@
+"""Server-side marker clustering for the incident maps.
+
+A supercluster-style hierarchy: points are projected to Web Mercator and,
+starting from the most detailed zoom level, grouped on a grid whose cell is
+`radius` screen pixels wide at that zoom. Each coarser level clusters the
+clusters of the level below it, so the whole hierarchy is built in one pass
+of vectorised NumPy operations. A query returns only the clusters of one
+zoom level that fall inside the current viewport, which keeps the map
+payload proportional to the screen instead of to the dataset.
+"""
+import numpy as np
+import pandas as pd
+
+# Web Mercator latitude limit
+_MAX_LAT = 85.05112878
+
+
+def lng_x(lng):
+    """Longitude to Mercator x in [0, 1]."""
+    return np.asarray(lng, dtype=np.float64) / 360.0 + 0.5
+
+
+def lat_y(lat):
+    """Latitude to Mercator y in [0, 1] (0 at the top)."""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -_MAX_LAT, _MAX_LAT)
+    sin = np.sin(np.radians(lat))
+    return 0.5 - 0.25 * np.log((1 + sin) / (1 - sin)) / np.pi
+
+
+def x_lng(x):
+    return (np.asarray(x) - 0.5) * 360.0
+
+
+def y_lat(y):
+    y2 = (180.0 - np.asarray(y) * 360.0) * np.pi / 180.0
+    return 360.0 * np.arctan(np.exp(y2)) / np.pi - 90.0
+
+
+class _Level:
+    """Clusters of one zoom level, sorted by x for viewport queries."""
+
+    def __init__(self, x, y, count, ids):
+        order = np.argsort(x, kind="stable")
+        self.x = x[order]
+        self.y = y[order]
+        self.count = count[order]
+        self.ids = ids[order]
+
+    def __len__(self):
+        return len(self.x)
+
+
+class ClusterIndex:
+    """
+    Hierarchical point clusters for every zoom level.
+
+    Inputs:
+        longitude (array): Point longitudes.
+        latitude (array): Point latitudes.
+        min_zoom (int): Coarsest zoom level that gets clusters.
+        max_zoom (int): Finest zoom level that still clusters; above it every
+            point is returned on its own.
+        radius (int): Cluster radius in screen pixels.
+        extent (int): Tile size in pixels.
+    """
+
+    def __init__(
+        self,
+        longitude,
+        latitude,
+        min_zoom=0,
+        max_zoom=16,
+        radius=60,
+        extent=256,
+    ):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.radius = radius
+        self.extent = extent
+
+        x, y = lng_x(longitude), lat_y(latitude)
+        count = np.ones(len(x), dtype=np.int64)
+        ids = np.arange(len(x), dtype=np.int64)
+        self._levels = {max_zoom + 1: _Level(x, y, count, ids)}
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            x, y, count, ids = self._cluster(x, y, count, ids, zoom)
+            self._levels[zoom] = _Level(x, y, count, ids)
+
+    def __len__(self):
+        return len(self._levels[self.max_zoom + 1])
+
+    def _cluster(self, x, y, count, ids, zoom):
+        """Merge the points of the level below into grid cells at `zoom`."""
+        if len(x) == 0:
+            return x, y, count, ids
+        cell = self.radius / (self.extent * 2.0**zoom)
+        gx = np.floor(x / cell).astype(np.int64)
+        gy = np.floor(y / cell).astype(np.int64)
+        keys = gx * (np.int64(1) << 32) + gy
+        _, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+        total = np.bincount(inverse, weights=count)
+        cx = np.bincount(inverse, weights=x * count) / total
+        cy = np.bincount(inverse, weights=y * count) / total
+        # A cell holding a single point keeps that point's id, others get -1
+        merged_ids = np.full(len(total), -1, dtype=np.int64)
+        merged_ids[inverse] = ids
+        merged_ids[total > 1] = -1
+        return cx, cy, total.astype(np.int64), merged_ids
+
+    def clusters(self, bbox, zoom):
+        """
+        Return the clusters visible in a viewport.
+
+        Inputs:
+            bbox (tuple): (west, south, east, north) in degrees.
+            zoom (int): Current map zoom.
+
+        Returns:
+            pd.DataFrame with longitude, latitude, count and point_id
+            columns. point_id is the position of the original point for
+            single-point clusters and -1 for real clusters.
+        """
+        zoom = int(np.clip(int(zoom), self.min_zoom, self.max_zoom + 1))
+        level = self._levels[zoom]
+        west, south, east, north = bbox
+        min_x, max_x = lng_x(west), lng_x(east)
+        min_y, max_y = lat_y(north), lat_y(south)
+        start = np.searchsorted(level.x, min_x, side="left")
+        stop = np.searchsorted(level.x, max_x, side="right")
+        y = level.y[start:stop]
+        inside = (y >= min_y) & (y <= max_y)
+        return pd.DataFrame(
+            {
+                "longitude": x_lng(level.x[start:stop][inside]),
+                "latitude": y_lat(y[inside]),
+                "count": level.count[start:stop][inside],
+                "point_id": level.ids[start:stop][inside],
+            }
+        )
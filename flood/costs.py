@@ -0,0 +1,288 @@
+"""Cost estimates and admission control of Earth Engine requests.
+
+The Timelapse, Flood Mapping and Land Cover pages used to learn that a
+request was too big only when Earth Engine failed. A CostEstimate of a
+request is now computed from its area, scale and date range before it is
+sent, and shown on the page:
+- pixels: pixels of one output image at the requested scale,
+- frames: output images (timelapse frames; 1 otherwise),
+- images: source images read to compute one output image,
+- export_bytes: approximate size of the downloaded result.
+
+Requests that read more than HEAVY_PIXELS source pixels are heavy. The
+AdmissionController of the server process lets at most MAX_HEAVY_JOBS of
+them run at a time, in arrival order, so one continental timelapse does
+not starve the flood queries of the other sessions; light requests are
+never queued. Set FLOOD_HEAVY_JOBS to change the limit. A waiting request
+reports its position in the queue, gives up after a timeout, and leaves
+the queue when it is cancelled, e.g. by a Streamlit rerun.
+"""
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+import pandas as pd
+
+from flood.roi import FREQUENCY_DAYS, thumbnail_size
+
+# Source pixels read by a request above which it is heavy
+HEAVY_PIXELS = 250e6
+MAX_HEAVY_JOBS = int(os.environ.get("FLOOD_HEAVY_JOBS", "1"))
+# Seconds a page waits for a heavy-request slot before giving up
+ADMISSION_TIMEOUT = 10 * 60
+# Seconds between two checks of a waiting request; a request that has not
+# checked for STALE_SECONDS is dropped from the queue
+POLL_SECONDS = 1
+STALE_SECONDS = 30
+# Scale of the flood extent statistics and exports, in metres
+FLOOD_SCALE = 30
+# Size in pixels of the map of a page, and of the equator at zoom 0
+VIEW_SIZE = (1024, 750)
+EQUATOR_PIXELS = 256
+EQUATOR_METRES = 40_075_016.686
+# Days between two images of a sensor over the same place
+REVISIT_DAYS = {
+    "landsat": 8,
+    "sentinel1": 12,
+    "sentinel2": 5,
+    "modis": 1,
+}
+
+
+class CostEstimate(
+    namedtuple("CostEstimate", ["pixels", "frames", "images", "export_bytes"])
+):
+    """Expected size of an Earth Engine request; see the module docstring."""
+
+    __slots__ = ()
+
+    @property
+    def source_pixels(self):
+        return self.pixels * self.frames * self.images
+
+    @property
+    def heavy(self):
+        return self.source_pixels > HEAVY_PIXELS
+
+
+def geodesic_area(geometry):
+    """Return the area in m² of a lon/lat shapely geometry."""
+    from pyproj import Geod
+
+    return abs(Geod(ellps="WGS84").geometry_area_perimeter(geometry)[0])
+
+
+def images_between(start, end, revisit_days):
+    """Return the number of images of a sensor over a date range."""
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).total_seconds() / 86400
+    return max(1, math.ceil(days / revisit_days))
+
+
+def images_per_frame(frequency, revisit_days, fraction=1.0):
+    """
+    Return the images composited into one timelapse frame.
+
+    Inputs:
+        frequency (str or float): Frame period, see flood.roi.frame_count.
+        revisit_days (float): Days between two images.
+        fraction (float): Part of the period with images, e.g. 3 / 12 for
+            yearly frames of June to August.
+    """
+    period = float(FREQUENCY_DAYS.get(frequency, frequency))
+    return max(1, round(period * fraction / revisit_days))
+
+
+def area_estimate(area_m2, scale, images=1, bytes_per_pixel=1):
+    """
+    Return the CostEstimate of an analysis of an area.
+
+    Inputs:
+        area_m2 (float): Area of the region.
+        scale (float): Pixel size in metres.
+        images (int): Source images read.
+        bytes_per_pixel (int): Size of an exported pixel.
+    """
+    pixels = math.ceil(area_m2 / scale**2)
+    return CostEstimate(pixels, 1, images, pixels * bytes_per_pixel)
+
+
+def flood_estimate(coords, before_start, before_end, after_start, after_end):
+    """
+    Return the CostEstimate of a flood extent analysis.
+
+    Inputs:
+        coords (list): Exterior ring of the AOI polygon, as [lon, lat] pairs.
+        before_start, before_end, after_start, after_end (str or date):
+            Date ranges of the reference and flooding Sentinel-1 imagery.
+    """
+    from shapely.geometry import Polygon
+
+    images = images_between(
+        before_start, before_end, REVISIT_DAYS["sentinel1"]
+    ) + images_between(after_start, after_end, REVISIT_DAYS["sentinel1"])
+    return area_estimate(geodesic_area(Polygon(coords)), FLOOD_SCALE, images)
+
+
+def view_scale(latitude, zoom):
+    """Return the size in metres of a Web Mercator pixel at a zoom level."""
+    latitude = math.radians(max(min(latitude, 85.0), -85.0))
+    return EQUATOR_METRES * math.cos(latitude) / EQUATOR_PIXELS / 2**zoom
+
+
+def view_estimate(latitude, zoom, images=1, size=VIEW_SIZE):
+    """
+    Return the CostEstimate of the map tiles of an image on a page.
+
+    Inputs:
+        latitude (float): Centre of the map.
+        zoom (int): Zoom level of the map.
+        images (int): Source images reduced into the image.
+        size (tuple): (width, height) of the map in pixels.
+    """
+    scale = view_scale(latitude, zoom)
+    # Tiles are PNG, 3 bytes per pixel before compression
+    return area_estimate(size[0] * size[1] * scale**2, scale, images, 3)
+
+
+def timelapse_estimate(bounds, dimensions, frames, images=1):
+    """
+    Return the CostEstimate of a timelapse.
+
+    Inputs:
+        bounds (tuple): (west, south, east, north) of the ROI in EPSG:4326.
+        dimensions (int): Longest side of the frames in pixels.
+        frames (int): See flood.roi.frame_count.
+        images (int): Source images per frame, see images_per_frame.
+    """
+    width, height = thumbnail_size(bounds, dimensions)
+    # A GIF frame is at most about one byte per pixel
+    return CostEstimate(width * height, frames, images, width * height * frames)
+
+
+def describe(cost):
+    """Return a one-line summary of a CostEstimate for the pages."""
+    text = f"{cost.pixels / 1e6:,.1f} million pixels"
+    if cost.frames > 1:
+        text += f" × {cost.frames:,} frames"
+    if cost.images > 1:
+        text += f", {cost.images:,} source images"
+        if cost.frames > 1:
+            text += " per frame"
+    text += f", about {cost.export_bytes / 1e6:,.0f} MB of output"
+    if cost.heavy:
+        text += " (heavy: waits for the other heavy requests to finish)"
+    return text
+
+
+class AdmissionTimeout(Exception):
+    """A heavy request waited too long for a slot."""
+
+
+class _Ticket:
+    """Place of a heavy request in the queue."""
+
+    __slots__ = ("seen",)
+
+    def __init__(self):
+        self.seen = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Process-wide cap on the heavy Earth Engine requests running at once.
+
+    Inputs:
+        slots (int): Heavy requests running at the same time.
+    """
+
+    def __init__(self, slots=MAX_HEAVY_JOBS):
+        self.slots = slots
+        self.running = 0
+        self._waiting = deque()
+        self._condition = threading.Condition()
+
+    @property
+    def waiting(self):
+        with self._condition:
+            return len(self._waiting)
+
+    @contextlib.contextmanager
+    def admit(self, cost, timeout=None, on_wait=None):
+        """
+        Run the body once a heavy-request slot is free.
+
+        Light requests (and a None cost) are admitted at once. Heavy ones
+        wait in arrival order.
+
+        Inputs:
+            cost (CostEstimate): Of the request.
+            timeout (float): Seconds to wait before AdmissionTimeout is
+                raised; None waits as long as it takes.
+            on_wait (callable): Called with the 1-based position of the
+                request in the queue about every POLL_SECONDS while it
+                waits. An exception it raises, such as the one Streamlit
+                stops a rerun script with, cancels the request.
+        """
+        if cost is None or not cost.heavy:
+            yield
+            return
+        ticket = _Ticket()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._waiting.append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    ticket.seen = time.monotonic()
+                    self._drop_stale(ticket.seen)
+                    if ticket not in self._waiting:
+                        # Dropped while on_wait ran too long: queue again
+                        self._waiting.append(ticket)
+                    if self._waiting[0] is ticket and self.running < self.slots:
+                        self._waiting.popleft()
+                        self.running += 1
+                        self._condition.notify_all()
+                        break
+                    position = self._waiting.index(ticket) + 1
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise AdmissionTimeout(
+                        f"No heavy-request slot was free after {timeout:.0f} s "
+                        f"(position {position} in the queue)."
+                    )
+                if on_wait is not None:
+                    on_wait(position)
+                with self._condition:
+                    wait = POLL_SECONDS
+                    if deadline is not None:
+                        wait = max(0, min(wait, deadline - time.monotonic()))
+                    self._condition.wait(wait)
+        except BaseException:
+            with self._condition:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                self._condition.notify_all()
+            raise
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.running -= 1
+                self._condition.notify_all()
+
+    def _drop_stale(self, now):
+        """Drop the tickets of requests that stopped waiting; hold the lock."""
+        stale = [
+            ticket
+            for ticket in self._waiting
+            if now - ticket.seen > STALE_SECONDS
+        ]
+        for ticket in stale:
+            self._waiting.remove(ticket)
+        if stale:
+            self._condition.notify_all()
+
+
+admission = AdmissionController()
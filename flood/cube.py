@@ -0,0 +1,191 @@
+"""Pre-aggregated incident counts for the statistics page.
+
+The cube holds the number of incidents for every (Year, State, Region,
+Month) combination that occurs in the data. It is a few thousand rows at
+most, is written next to the incident store and is only rebuilt when the
+store changes. New rows can be folded in with IncidentCube.append without
+going back over the full dataset.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from flood.store import (
+    CSV_PATH,
+    file_digest,
+    get_store,
+    store_path_for,
+    write_table,
+)
+
+DIMENSIONS = ["Year", "State", "Region", "Month"]
+
+
+def cube_path_for(csv_path):
+    """Return the path of the cube file that belongs to a CSV file."""
+    return os.path.splitext(csv_path)[0] + "_cube.arrow"
+
+
+def _count_cells(incidents):
+    """Group raw incidents into cube cells."""
+    month = incidents["Date"].dt.month.fillna(0).astype(np.int8)
+    cells = pd.DataFrame(
+        {
+            "Year": incidents["Year"].to_numpy(),
+            "State": incidents["State"].astype(object).fillna("").to_numpy(),
+            "Region": incidents["Region"].astype(object).fillna("").to_numpy(),
+            "Month": month.to_numpy(),
+        }
+    )
+    return cells.groupby(DIMENSIONS, sort=False).size().rename("count")
+
+
+class IncidentCube:
+    """Incident counts by Year, State, Region and Month."""
+
+    def __init__(self, counts, source=None):
+        # counts: Series indexed by DIMENSIONS
+        self.counts = counts.sort_index()
+        self.source = source
+        self._answers = {}
+
+    @classmethod
+    def from_incidents(cls, incidents, source=None):
+        """Build a cube from incident rows (Year, Date, State, Region)."""
+        return cls(_count_cells(incidents), source=source)
+
+    def append(self, incidents, source=None):
+        """
+        Return a new cube with extra incident rows added.
+
+        Only the new rows are grouped; their counts are then added onto the
+        existing cells.
+
+        Inputs:
+            incidents (pd.DataFrame): Newly ingested rows.
+            source (str): Digest of the store the result corresponds to.
+
+        Returns:
+            IncidentCube
+        """
+        counts = self.counts.add(_count_cells(incidents), fill_value=0)
+        return IncidentCube(counts.astype(np.int64), source=source)
+
+    def totals(self, by, **filters):
+        """
+        Return incident totals grouped by some dimensions.
+
+        Inputs:
+            by (list): Dimensions to keep, e.g. ['Year'] or ['State'].
+            **filters: Dimension values to restrict to, e.g. Year=2021.
+
+        Returns:
+            pd.DataFrame with the `by` columns and a 'Total Incidents' column.
+            The result is memoised and shared, so treat it as read-only.
+        """
+        key = (tuple(by), tuple(sorted(filters.items())))
+        answer = self._answers.get(key)
+        if answer is None:
+            counts = self.counts
+            for dimension, value in filters.items():
+                counts = counts[
+                    counts.index.get_level_values(dimension) == value
+                ]
+            answer = (
+                counts.groupby(level=list(by)).sum()
+                .reset_index(name="Total Incidents")
+            )
+            self._answers[key] = answer
+        return answer
+
+    def to_table(self):
+        frame = self.counts.reset_index()
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        return table.replace_schema_metadata({"source": self.source or ""})
+
+    @classmethod
+    def from_table(cls, table):
+        metadata = table.schema.metadata or {}
+        source = metadata.get(b"source", b"").decode() or None
+        counts = table.to_pandas().set_index(DIMENSIONS)["count"]
+        return cls(counts, source=source)
+
+
+def save_cube(cube, cube_path):
+    write_table(cube.to_table(), cube_path)
+
+
+def read_cube(cube_path):
+    with pa.memory_map(cube_path) as source:
+        return IncidentCube.from_table(ipc.open_file(source).read_all())
+
+
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+def get_cube(csv_path=CSV_PATH):
+    """
+    Return the process-wide cube for the incident store.
+
+    The saved cube is reused as long as it was built from the current store
+    file; otherwise it is rebuilt from the store and saved again.
+
+    Inputs:
+        csv_path (str): Geocoded incident CSV backing the store.
+
+    Returns:
+        IncidentCube
+    """
+    store = get_store(csv_path)
+    cube_path = cube_path_for(csv_path)
+    cube = _cubes.get(cube_path)
+    if cube is not None and cube.source == store.digest:
+        return cube
+    with _cubes_lock:
+        cube = _cubes.get(cube_path)
+        if cube is None or cube.source != store.digest:
+            cube = None
+            if os.path.exists(cube_path):
+                cube = read_cube(cube_path)
+            if cube is None or cube.source != store.digest:
+                cube = IncidentCube.from_incidents(
+                    store.frame, source=store.digest
+                )
+                save_cube(cube, cube_path)
+            _cubes[cube_path] = cube
+    return cube
+
+
+def append_to_cube(incidents, previous_digest, csv_path=CSV_PATH):
+    """
+    Fold newly appended incidents into the saved cube.
+
+    Called after new rows were added to the store, so the cube follows
+    without a full group-by. A saved cube that was not built from the store
+    the rows were appended to is stale; it is rebuilt through get_cube
+    instead of being relabelled as current.
+
+    Inputs:
+        incidents (pd.DataFrame): The rows that were appended.
+        previous_digest (str): Digest of the store before the append.
+        csv_path (str): Geocoded incident CSV backing the store.
+
+    Returns:
+        IncidentCube
+    """
+    cube_path = cube_path_for(csv_path)
+    if os.path.exists(cube_path):
+        store_digest = file_digest(store_path_for(csv_path))
+        with _cubes_lock:
+            cube = read_cube(cube_path)
+            if cube.source == previous_digest:
+                cube = cube.append(incidents, source=store_digest)
+                save_cube(cube, cube_path)
+                _cubes[cube_path] = cube
+                return cube
+    return get_cube(csv_path)
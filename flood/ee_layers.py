@@ -0,0 +1,66 @@
+"""Cached Earth Engine tile layers.
+
+Adding an ee.Image to a map costs a ``getMapId`` round trip to Earth
+Engine, and Streamlit reruns the whole page on every widget change. The
+resolved tile URL templates are cached per (dataset, parameters,
+visualisation), shared by all sessions, so only a change of the inputs
+that define the image reaches Earth Engine again.
+"""
+import hashlib
+import json
+
+import folium
+
+from flood.cache import TTLCache
+
+# Earth Engine map ids stay valid for several hours; refresh well before
+LAYER_TTL = 4 * 60 * 60
+
+tile_url_cache = TTLCache(maxsize=128, ttl=LAYER_TTL)
+
+
+def layer_key(dataset, vis=None, params=()):
+    """Return the cache key of a tile layer."""
+    payload = json.dumps(
+        [dataset, vis or {}, list(params)], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cached_tile_url(dataset, image, vis=None, params=()):
+    """
+    Return the tile URL template of an Earth Engine image.
+
+    Inputs:
+        dataset (str): Earth Engine asset id (or any name for the image).
+        image (callable): Returns the ee.Image; only called on a miss.
+        vis (dict): Visualisation parameters.
+        params (tuple): Other inputs the image depends on, e.g. dates.
+
+    Returns:
+        str: URL template with {z}/{x}/{y} placeholders.
+    """
+    return tile_url_cache.get_or_compute(
+        layer_key(dataset, vis, params),
+        lambda: image().getMapId(vis or {})["tile_fetcher"].url_format,
+    )
+
+
+def tile_layer(dataset, image, name, vis=None, params=(), **kwargs):
+    """
+    Return a folium tile layer of an Earth Engine image, from the cache.
+
+    Inputs:
+        dataset, image, vis, params: See cached_tile_url.
+        name (str): Name of the layer in the layer control.
+        **kwargs: Passed to folium.TileLayer.
+
+    Returns:
+        folium.TileLayer
+    """
+    kwargs.setdefault("attr", "Google Earth Engine")
+    kwargs.setdefault("overlay", True)
+    kwargs.setdefault("control", True)
+    return folium.TileLayer(
+        tiles=cached_tile_url(dataset, image, vis, params), name=name, **kwargs
+    )
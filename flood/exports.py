@@ -0,0 +1,170 @@
+"""Download and package flood-extent exports without holding them in memory.
+
+Earth Engine download URLs for a state-sized AOI return hundreds of
+megabytes. They are fetched concurrently over one pooled HTTP session and
+streamed in chunks into a spool directory; packaging (Cloud-Optimised
+GeoTIFF + FlatGeobuf in a zip) works file to file, the vectors in batches
+of features. st.download_button still reads the whole file it is given,
+so the pages only build the button of a file once it is asked for.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), "flood_exports")
+# Spooled exports are deleted this many seconds after they were written
+SPOOL_MAX_AGE = 6 * 60 * 60
+CHUNK_SIZE = 1 << 20
+# Features converted at a time by to_flatgeobuf
+VECTOR_BATCH = 10_000
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session(pool_size=8):
+    """Return the pooled requests session shared by all downloads."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=1,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                ),
+            )
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def spool_dir(directory=SPOOL_DIR, max_age=SPOOL_MAX_AGE):
+    """
+    Create a fresh directory for one export and purge old ones.
+
+    Returns:
+        str: Path of the new directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            # Removed by another session in the meantime
+            pass
+    path = os.path.join(directory, uuid.uuid4().hex)
+    os.makedirs(path)
+    return path
+
+
+def stream_to_file(url, path, chunk_size=CHUNK_SIZE, timeout=600):
+    """
+    Download url to path in chunks.
+
+    The file appears under its final name only once complete.
+
+    Returns:
+        str: path
+    """
+    partial = path + ".part"
+    with http_session().get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        with open(partial, "wb") as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+    os.replace(partial, path)
+    return path
+
+
+def fetch_all(urls, directory, workers=4):
+    """
+    Download several files concurrently.
+
+    Inputs:
+        urls (dict): File name -> URL.
+        directory (str): Destination directory.
+        workers (int): Concurrent downloads.
+
+    Returns:
+        dict: File name -> local path.
+    """
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {
+            name: pool.submit(stream_to_file, url, os.path.join(directory, name))
+            for name, url in urls.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def to_cog(path, out_path):
+    """Rewrite a GeoTIFF as a Cloud-Optimised GeoTIFF."""
+    import rasterio
+    from rasterio.shutil import copy
+
+    with rasterio.open(path) as src:
+        copy(src, out_path, driver="COG", compress="deflate")
+    return out_path
+
+
+def to_flatgeobuf(path, out_path, batch_size=VECTOR_BATCH):
+    """
+    Convert a vector file (e.g. GeoJSON) to FlatGeobuf.
+
+    Features are streamed from GDAL as Arrow batches of batch_size, so
+    Python never holds the whole layer.
+    """
+    import pyogrio
+
+    with pyogrio.open_arrow(
+        path, batch_size=batch_size, use_pyarrow=True
+    ) as (meta, reader):
+        pyogrio.write_arrow(
+            reader,
+            out_path,
+            driver="FlatGeobuf",
+            # pyogrio names an unnamed geometry column wkb_geometry
+            geometry_name=meta["geometry_name"] or "wkb_geometry",
+            geometry_type=meta["geometry_type"],
+            crs=meta["crs"],
+        )
+    return out_path
+
+
+def package(raster_path, vector_path, zip_path):
+    """
+    Zip the raster as COG and the vectors as FlatGeobuf.
+
+    Inputs:
+        raster_path (str): GeoTIFF of the flood extent.
+        vector_path (str): GeoJSON of the flood polygons.
+        zip_path (str): Archive to write.
+
+    Returns:
+        str: zip_path
+    """
+    base = os.path.splitext(zip_path)[0]
+    name = os.path.basename(base)
+    cog = to_cog(raster_path, base + ".tmp.tif")
+    fgb = to_flatgeobuf(vector_path, base + ".tmp.fgb")
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.write(cog, name + ".tif")
+        archive.write(fgb, name + ".fgb")
+    os.remove(cog)
+    os.remove(fgb)
+    return zip_path
@@ -0,0 +1,71 @@
+"""Flood extent derivation behind interchangeable engines.
+
+EarthEngine runs the Sentinel-1 change detection on Google Earth Engine
+(flood.extent_ee); flood.extent_local.LocalEngine runs the same chain on
+rasters on disk. Both expose derive_flood_extents with the same arguments
+and return (flood_vectors, flood_rasters, before_filtered, after_filtered).
+"""
+import ee
+
+from flood import extent_ee
+
+
+class EarthEngine:
+    """Run derive_flood_extents on Google Earth Engine."""
+
+    def derive_flood_extents(self, aoi, *args, **kwargs):
+        """See flood.extent_ee.derive_flood_extents.
+
+        aoi may also be a ring of [lon, lat] as drawn on the input map.
+        """
+        if isinstance(aoi, (list, tuple)):
+            aoi = ee.Geometry.Polygon(aoi)
+        return extent_ee.derive_flood_extents(aoi, *args, **kwargs)
+
+
+def derive_flood_extents(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold=1.25,
+    polarization="VH",
+    pass_direction="Ascending",
+    export=False,
+    export_filename="flood_extents",
+    engine=None,
+):
+    """
+    Derive flood extents with the chosen engine.
+
+    Inputs:
+        aoi: Analysis area, in a form the engine accepts.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        difference_threshold (float): Threshold applied on the after/before
+            ratio.
+        polarization (str): 'VH' or 'VV'.
+        pass_direction (str): 'Ascending' or 'Descending'.
+        export (bool): Export the results (Google Drive or local files).
+        export_filename (str): Prefix of the exported files.
+        engine: EarthEngine (default) or flood.extent_local.LocalEngine.
+
+    Returns:
+        flood_vectors, flood_rasters, before_filtered, after_filtered
+    """
+    engine = engine or EarthEngine()
+    return engine.derive_flood_extents(
+        aoi,
+        before_start_date,
+        before_end_date,
+        after_start_date,
+        after_end_date,
+        difference_threshold=difference_threshold,
+        polarization=polarization,
+        pass_direction=pass_direction,
+        export=export,
+        export_filename=export_filename,
+    )
@@ -0,0 +1,171 @@
+"""Memoised flood-extent results of the Flood Mapping Tool.
+
+Building the derive_flood_extents graph is cheap; what costs time is asking
+Earth Engine for map tiles, the vector polygons and statistics of the
+result. Those outputs are cached by a canonical hash of the analysis
+parameters, shared by all sessions of the server process, so a second
+analyst looking at the same flood event gets the result immediately.
+"""
+import hashlib
+import json
+from collections import namedtuple
+
+import ee
+
+from flood.cache import TTLCache
+
+# Earth Engine map ids stay valid for several hours; refresh well before
+RESULT_TTL = 4 * 60 * 60
+
+FloodExtentResult = namedtuple(
+    "FloodExtentResult",
+    [
+        "raster_tile_url",
+        "vector_tile_url",
+        "vector_geojson",
+        "flooded_area_km2",
+        "polygon_count",
+        "bounds",
+    ],
+)
+
+flood_extent_cache = TTLCache(maxsize=64, ttl=RESULT_TTL)
+
+
+def canonical_ring(coords, precision=6):
+    """
+    Normalise a polygon ring so equal shapes produce equal keys.
+
+    Coordinates are rounded, the closing vertex is dropped, the ring is
+    turned counter-clockwise and rotated to start at its smallest vertex,
+    so the same polygon drawn from a different starting point or direction
+    gets the same key.
+
+    Inputs:
+        coords (list): [[lon, lat], ...] as returned by the folium Draw plugin.
+        precision (int): Decimal places to keep (6 is ~10 cm).
+
+    Returns:
+        list of (lon, lat) tuples.
+    """
+    ring = [(round(x, precision), round(y, precision)) for x, y in coords]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring = ring[:-1]
+    # Drop consecutive duplicates left by rounding
+    ring = [p for i, p in enumerate(ring) if i == 0 or p != ring[i - 1]]
+    signed_area = sum(
+        x1 * y2 - x2 * y1
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1])
+    )
+    if signed_area < 0:
+        ring.reverse()
+    start = ring.index(min(ring))
+    return ring[start:] + ring[:start]
+
+
+def extent_key(
+    coords,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold,
+    polarization,
+    pass_direction,
+):
+    """Return the cache key of a flood-extent analysis."""
+    payload = json.dumps(
+        [
+            canonical_ring(coords),
+            str(before_start_date),
+            str(before_end_date),
+            str(after_start_date),
+            str(after_end_date),
+            round(float(difference_threshold), 6),
+            polarization,
+            pass_direction,
+        ]
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def ring_bounds(coords):
+    """Return [[south, west], [north, east]] of a ring of [lon, lat]."""
+    lons = [x for x, _ in coords]
+    lats = [y for _, y in coords]
+    return [[min(lats), min(lons)], [max(lats), max(lons)]]
+
+
+def geojson_area(geojson):
+    """Return the geodesic area in m² of the polygons of a GeoJSON dict."""
+    from shapely.geometry import shape
+
+    from flood.costs import geodesic_area
+
+    return sum(
+        geodesic_area(shape(feature["geometry"]))
+        for feature in geojson["features"]
+    )
+
+
+def raster_area(flood_rasters, aoi, scale):
+    """Return the flooded area in m² of a flood raster, or None."""
+    area = (
+        flood_rasters.multiply(ee.Image.pixelArea())
+        .reduceRegion(
+            reducer=ee.Reducer.sum(),
+            geometry=aoi,
+            scale=scale,
+            bestEffort=True,
+            maxPixels=1e10,
+        )
+        .values()
+        .get(0)
+    )
+    try:
+        return area.getInfo()
+    except ee.EEException:
+        return None
+
+
+def summarise_flood_extent(
+    flood_vectors, flood_rasters, aoi, coords, vector_vis=None, scale=30
+):
+    """
+    Evaluate a flood-extent graph on Earth Engine.
+
+    Raises ee.EEException when no imagery matches the parameters.
+
+    Inputs:
+        flood_vectors (ee.FeatureCollection): Output of derive_flood_extents.
+        flood_rasters (ee.Image): Output of derive_flood_extents.
+        aoi (ee.Geometry): Analysis area.
+        coords (list): Ring of the analysis area, for the map bounds.
+        vector_vis (dict): Visualisation of the vector tile layer.
+        scale (int): Pixel size in metres of the area statistic, when it
+            is computed from the raster because the polygons are too many
+            to fetch.
+
+    Returns:
+        FloodExtentResult
+    """
+    raster_map = flood_rasters.getMapId({})
+    vector_map = flood_vectors.getMapId(vector_vis or {"color": "0000FF"})
+    try:
+        geojson = flood_vectors.getInfo()
+    except ee.EEException:
+        # Too many polygons to return at once; the tile layer still works
+        geojson = None
+    if geojson is not None:
+        # The polygons are fetched once: the statistics come from them
+        area_m2 = geojson_area(geojson)
+    else:
+        area_m2 = raster_area(flood_rasters, aoi, scale)
+    return FloodExtentResult(
+        raster_tile_url=raster_map["tile_fetcher"].url_format,
+        vector_tile_url=vector_map["tile_fetcher"].url_format,
+        vector_geojson=geojson,
+        flooded_area_km2=None if area_m2 is None else area_m2 / 1e6,
+        polygon_count=None if geojson is None else len(geojson["features"]),
+        bounds=ring_bounds(coords),
+    )
@@ -0,0 +1,443 @@
+"""Flood extent derivation on local Sentinel-1 rasters.
+
+The same change-detection chain as flood.extent_ee, run with NumPy, SciPy
+and rasterio on GeoTIFF/COG scenes already on disk. Useful offline, for
+deterministic tests and for scenes that were exported earlier.
+
+Scenes are listed in a LocalCatalog (path, date, polarization, pass
+direction). Only the window covering the AOI is read from each scene,
+resampled onto a common grid with a WarpedVRT, so scenes do not need to be
+aligned or share a CRS.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio import features, warp
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from scipy import ndimage, signal
+from shapely.geometry import Polygon, mapping, shape
+
+# Metres per degree of latitude, used for rasters in geographic CRS
+M_PER_DEG = 111320.0
+
+
+class LocalRaster:
+    """
+    A masked 2-D array with its georeferencing.
+
+    Inputs:
+        data (np.ma.MaskedArray): Pixel values, masked where no data.
+        transform (affine.Affine): Pixel to CRS transform.
+        crs (rasterio.crs.CRS): Coordinate reference system.
+    """
+
+    def __init__(self, data, transform, crs):
+        self.data = np.ma.asarray(data)
+        self.transform = transform
+        self.crs = crs
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def pixel_size_m(self):
+        """Return the (x, y) pixel size in metres."""
+        x, y = abs(self.transform.a), abs(self.transform.e)
+        if self.crs is not None and self.crs.is_geographic:
+            rows, _ = self.shape
+            _, lat = self.transform * (0, rows / 2)
+            return x * M_PER_DEG * np.cos(np.radians(lat)), y * M_PER_DEG
+        return x, y
+
+    def with_data(self, data):
+        return LocalRaster(data, self.transform, self.crs)
+
+    def write(self, path, dtype=None):
+        """Write the raster as a tiled, compressed GeoTIFF."""
+        dtype = dtype or self.data.dtype
+        nodata = 0 if np.issubdtype(np.dtype(dtype), np.integer) else np.nan
+        with rasterio.open(
+            path,
+            "w",
+            driver="GTiff",
+            height=self.shape[0],
+            width=self.shape[1],
+            count=1,
+            dtype=dtype,
+            crs=self.crs,
+            transform=self.transform,
+            nodata=nodata,
+            tiled=True,
+            compress="deflate",
+        ) as dst:
+            dst.write(self.data.filled(nodata).astype(dtype), 1)
+
+
+class LocalCatalog:
+    """
+    Sentinel-1 scenes available on disk.
+
+    Inputs:
+        scenes (pd.DataFrame or list of dict): One row per single-band
+            scene with columns path, date (yyyy-mm-dd), polarization ('VH'
+            or 'VV') and pass_direction ('Ascending' or 'Descending').
+            Values are backscatter in dB, as in COPERNICUS/S1_GRD.
+    """
+
+    def __init__(self, scenes):
+        scenes = pd.DataFrame(scenes)
+        scenes["date"] = pd.to_datetime(scenes["date"])
+        scenes["pass_direction"] = scenes["pass_direction"].str.upper()
+        self.scenes = scenes.sort_values("date", kind="stable").reset_index(
+            drop=True
+        )
+        self._footprints = {}
+
+    @classmethod
+    def from_csv(cls, path):
+        """Read a catalog CSV; relative paths are resolved against it."""
+        scenes = pd.read_csv(path)
+        base = os.path.dirname(os.path.abspath(path))
+        scenes["path"] = [
+            p if os.path.isabs(p) else os.path.join(base, p)
+            for p in scenes["path"]
+        ]
+        return cls(scenes)
+
+    def footprint(self, path):
+        """Return the EPSG:4326 bounding box of a scene as a polygon."""
+        if path not in self._footprints:
+            with rasterio.open(path) as src:
+                bounds = warp.transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+            west, south, east, north = bounds
+            self._footprints[path] = Polygon(
+                [(west, south), (east, south), (east, north), (west, north)]
+            )
+        return self._footprints[path]
+
+
+def as_geometry(aoi):
+    """Accept a shapely geometry, GeoJSON dict or ring of [lon, lat]."""
+    if hasattr(aoi, "geom_type"):
+        return aoi
+    if isinstance(aoi, dict):
+        return shape(aoi.get("geometry", aoi))
+    return Polygon(aoi)
+
+
+def retrieve_image_collection(
+    catalog,
+    search_region,
+    start_date,
+    end_date,
+    polarization="VH",
+    pass_direction="Ascending",
+):
+    """
+    Return the paths of the catalog scenes matching the search criteria.
+
+    Inputs:
+        catalog (LocalCatalog): Available scenes.
+        search_region (shapely geometry): Area the scenes must intersect.
+        start_date (str): Date in format yyyy-mm-dd, inclusive.
+        end_date (str): Date in format yyyy-mm-dd, exclusive.
+        polarization (str): 'VH' or 'VV'.
+        pass_direction (str): 'Ascending' or 'Descending'.
+
+    Returns:
+        list of str, oldest first.
+    """
+    scenes = catalog.scenes
+    scenes = scenes[
+        (scenes["date"] >= pd.Timestamp(start_date))
+        & (scenes["date"] < pd.Timestamp(end_date))
+        & (scenes["polarization"] == polarization)
+        & (scenes["pass_direction"] == pass_direction.upper())
+    ]
+    return [
+        path
+        for path in scenes["path"]
+        if catalog.footprint(path).intersects(search_region)
+    ]
+
+
+def analysis_grid(paths, aoi):
+    """
+    Return the (transform, crs, shape) covering aoi at the first scene's
+    resolution and CRS.
+    """
+    with rasterio.open(paths[0]) as src:
+        crs = src.crs
+        res_x, res_y = src.res
+    west, south, east, north = warp.transform_bounds(
+        "EPSG:4326", crs, *aoi.bounds
+    )
+    width = max(int(np.ceil((east - west) / res_x)), 1)
+    height = max(int(np.ceil((north - south) / res_y)), 1)
+    return from_origin(west, north, res_x, res_y), crs, (height, width)
+
+
+def read_on_grid(path, transform, crs, shape, resampling=Resampling.bilinear):
+    """Read the part of a raster that falls on the given grid."""
+    height, width = shape
+    with rasterio.open(path) as src:
+        with WarpedVRT(
+            src,
+            crs=crs,
+            transform=transform,
+            width=width,
+            height=height,
+            resampling=resampling,
+        ) as vrt:
+            return vrt.read(1, masked=True).astype(np.float32)
+
+
+def mosaic(paths, transform, crs, shape):
+    """Combine scenes, later scenes on top (as ee.ImageCollection.mosaic)."""
+    data = np.ma.masked_all(shape, dtype=np.float32)
+    for path in paths:
+        scene = read_on_grid(path, transform, crs, shape)
+        valid = ~np.ma.getmaskarray(scene)
+        data[valid] = scene[valid]
+    return LocalRaster(data, transform, crs)
+
+
+def clip(image, aoi):
+    """Mask the pixels of image outside aoi (EPSG:4326 geometry)."""
+    geometry = warp.transform_geom("EPSG:4326", image.crs, mapping(aoi))
+    outside = features.geometry_mask(
+        [geometry], out_shape=image.shape, transform=image.transform
+    )
+    return image.with_data(
+        np.ma.array(image.data, mask=np.ma.getmaskarray(image.data) | outside)
+    )
+
+
+def circular_kernel(radius_px):
+    """Return a disk of ones with the given radius in pixels."""
+    r = max(int(np.floor(radius_px)), 0)
+    y, x = np.ogrid[-r : r + 1, -r : r + 1]
+    return (x * x + y * y <= radius_px * radius_px).astype(np.float32)
+
+
+def smooth(image, smoothing_radius=50):
+    """
+    Reduce the radar speckle with a circular focal mean.
+
+    Masked pixels are left out of the mean (normalised convolution).
+
+    Inputs:
+        image (LocalRaster): Input image.
+        smoothing_radius (int): Kernel radius in metres.
+
+    Returns:
+        LocalRaster
+    """
+    size_x, size_y = image.pixel_size_m()
+    kernel = circular_kernel(smoothing_radius / min(size_x, size_y))
+    valid = ~np.ma.getmaskarray(image.data)
+    values = np.where(valid, image.data.filled(0), 0).astype(np.float32)
+    total = signal.fftconvolve(values, kernel, mode="same")
+    count = signal.fftconvolve(valid.astype(np.float32), kernel, mode="same")
+    mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0.5)
+    return image.with_data(np.ma.array(mean, mask=~valid))
+
+
+def mask_permanent_water(image, water_path=None):
+    """
+    Mask non-flooded pixels and perennial water (> 10 months/yr).
+
+    Like the Earth Engine version, pixels with value 0 are masked too, so
+    only flooded pixels remain.
+
+    Inputs:
+        image (LocalRaster): Binary input image.
+        water_path (str): Local JRC Global Surface Water 'seasonality'
+            raster, None to skip the water mask.
+
+    Returns:
+        LocalRaster
+    """
+    mask = np.ma.getmaskarray(image.data) | (image.data.filled(0) == 0)
+    if water_path:
+        seasonality = read_on_grid(
+            water_path,
+            image.transform,
+            image.crs,
+            image.shape,
+            resampling=Resampling.nearest,
+        )
+        mask |= seasonality.filled(0) >= 10
+    return image.with_data(np.ma.array(image.data, mask=mask))
+
+
+def reduce_noise(image, min_pixels=8):
+    """
+    Mask groups of fewer than min_pixels connected (8-neighbour) pixels.
+
+    Inputs:
+        image (LocalRaster): Binary image.
+        min_pixels (int): Smallest group to keep.
+
+    Returns:
+        LocalRaster
+    """
+    valid = ~np.ma.getmaskarray(image.data)
+    labels, _ = ndimage.label(valid, structure=np.ones((3, 3), dtype=bool))
+    sizes = np.bincount(labels.ravel())
+    keep = sizes >= min_pixels
+    keep[0] = False
+    return image.with_data(np.ma.array(image.data, mask=~keep[labels]))
+
+
+def mask_slopes(image, dem_path=None, max_slope=5):
+    """
+    Mask out areas with more than max_slope degrees of slope.
+
+    Inputs:
+        image (LocalRaster): Input image.
+        dem_path (str): Local elevation raster in metres, None to skip.
+        max_slope (float): Slope threshold in degrees.
+
+    Returns:
+        LocalRaster
+    """
+    if not dem_path:
+        return image
+    dem = read_on_grid(dem_path, image.transform, image.crs, image.shape)
+    size_x, size_y = image.pixel_size_m()
+    dz_dy, dz_dx = np.gradient(dem.filled(np.nan), size_y, size_x)
+    slope = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+    steep = ~(slope < max_slope)
+    return image.with_data(
+        np.ma.array(image.data, mask=np.ma.getmaskarray(image.data) | steep)
+    )
+
+
+def reduce_to_vectors(image):
+    """
+    Polygonise the unmasked pixels (4-connected, like eightConnected=False).
+
+    Returns:
+        dict: GeoJSON FeatureCollection in EPSG:4326 with a 'label' property.
+    """
+    valid = ~np.ma.getmaskarray(image.data)
+    values = image.data.filled(0).astype(np.uint8)
+    polygons = []
+    for geometry, value in features.shapes(
+        values, mask=valid, connectivity=4, transform=image.transform
+    ):
+        if image.crs is not None and image.crs.to_epsg() != 4326:
+            geometry = warp.transform_geom(image.crs, "EPSG:4326", geometry)
+        polygons.append(
+            {
+                "type": "Feature",
+                "geometry": geometry,
+                "properties": {"label": int(value)},
+            }
+        )
+    return {"type": "FeatureCollection", "features": polygons}
+
+
+class LocalEngine:
+    """
+    Run derive_flood_extents on local rasters.
+
+    Inputs:
+        catalog (LocalCatalog): Sentinel-1 scenes on disk.
+        water_path (str): Optional JRC surface water seasonality raster.
+        dem_path (str): Optional elevation raster.
+        smoothing_radius (int): Focal mean radius in metres.
+    """
+
+    def __init__(
+        self, catalog, water_path=None, dem_path=None, smoothing_radius=50
+    ):
+        self.catalog = catalog
+        self.water_path = water_path
+        self.dem_path = dem_path
+        self.smoothing_radius = smoothing_radius
+
+    def derive_flood_extents(
+        self,
+        aoi,
+        before_start_date,
+        before_end_date,
+        after_start_date,
+        after_end_date,
+        difference_threshold=1.25,
+        polarization="VH",
+        pass_direction="Ascending",
+        export=False,
+        export_filename="flood_extents",
+    ):
+        """
+        Local counterpart of flood.extent_ee.derive_flood_extents.
+
+        aoi may be a shapely geometry, a GeoJSON dict or a ring of
+        [lon, lat]. Raises ValueError when no scene matches a period.
+
+        Returns:
+            flood_vectors (dict): GeoJSON FeatureCollection.
+            flood_rasters (LocalRaster): Binary flood raster.
+            before_filtered (LocalRaster): Smoothed 'before' mosaic.
+            after_filtered (LocalRaster): Smoothed 'after' mosaic.
+        """
+        aoi = as_geometry(aoi)
+        before_paths = retrieve_image_collection(
+            self.catalog,
+            aoi,
+            before_start_date,
+            before_end_date,
+            polarization,
+            pass_direction,
+        )
+        after_paths = retrieve_image_collection(
+            self.catalog,
+            aoi,
+            after_start_date,
+            after_end_date,
+            polarization,
+            pass_direction,
+        )
+        if not before_paths or not after_paths:
+            raise ValueError("No local scene found for the selected dates.")
+        transform, crs, shape_ = analysis_grid(before_paths, aoi)
+
+        before_mosaic = clip(mosaic(before_paths, transform, crs, shape_), aoi)
+        after_mosaic = clip(mosaic(after_paths, transform, crs, shape_), aoi)
+
+        before_filtered = smooth(before_mosaic, self.smoothing_radius)
+        after_filtered = smooth(after_mosaic, self.smoothing_radius)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            difference = after_filtered.data / before_filtered.data
+        difference_binary = before_filtered.with_data(
+            (np.ma.masked_invalid(difference) > difference_threshold).astype(
+                np.uint8
+            )
+        )
+        difference_binary_masked = mask_permanent_water(
+            difference_binary, self.water_path
+        )
+        difference_binary_masked_reduced_noise = reduce_noise(
+            difference_binary_masked
+        )
+        flood_rasters = mask_slopes(
+            difference_binary_masked_reduced_noise, self.dem_path
+        )
+        flood_vectors = reduce_to_vectors(flood_rasters)
+
+        if export:
+            flood_rasters.write(f"{export_filename}_raster.tif", "uint8")
+            before_filtered.write(f"{export_filename}_s1_before.tif")
+            after_filtered.write(f"{export_filename}_s1_after.tif")
+            with open(f"{export_filename}_polygons.geojson", "w") as f:
+                json.dump(flood_vectors, f)
+
+        return flood_vectors, flood_rasters, before_filtered, after_filtered
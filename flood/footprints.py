@@ -0,0 +1,366 @@
+"""Building-footprint collections of the Global Building Footprints page.
+
+The country and US state lists are vendored in REGIONS_PATH with the
+centroid and bounds of each region, instead of being downloaded from
+GitHub when the page starts. Where the map centres on a collection (its
+first building) is asked from Earth Engine once per collection and kept in
+a small on-disk index, so reruns do not wait for a round trip.
+
+For Malaysia an optional local FlatGeobuf extract of the footprints can be
+read by bounding box through its spatial index, so the buildings near
+flood incidents are drawn without asking Earth Engine at all.
+
+Usage:
+    python -m flood.footprints regions countries.geojson us_states.json
+    python -m flood.footprints extract Malaysia.geojsonl
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+REGIONS_PATH = "data/footprint_regions.json"
+INDEX_PATH = "analytics/data2/footprint_index.json"
+EXTRACT_PATH = "analytics/data2/footprints_malaysia.fgb"
+ASSET_ROOT = "projects/sat-io/open-datasets/MSBuildings"
+# lon/lat bounds of Malaysia, used to cut the extract
+MALAYSIA_BBOX = (99.6, 0.7, 119.3, 7.4)
+# Footprints read from the extract at most, to bound the page memory
+MAX_FEATURES = 200_000
+# Incidents are grouped into cells of this many degrees, one bbox read each
+CELL_DEG = 0.05
+METRES_PER_DEGREE = 111_320
+
+
+def asset_name(name):
+    """Return the MSBuildings asset name of a country name."""
+    if name == "United States of America":
+        return "USA"
+    return name.replace(".", "").replace(" ", "_")
+
+
+def collection_id(country, state=None):
+    """Return the Earth Engine asset id of a footprint collection."""
+    if country == "USA":
+        return f"{ASSET_ROOT}/US/{state}"
+    return f"{ASSET_ROOT}/{country}"
+
+
+def region_entries(gdf, name_column, rename=None):
+    """
+    Return the vendored entries of a countries or states GeoDataFrame.
+
+    Inputs:
+        gdf (gpd.GeoDataFrame): Regions in EPSG:4326.
+        name_column (str): Column with the region names.
+        rename (callable): Maps a name to the one used in asset ids.
+
+    Returns:
+        list of dict: name, centroid [lon, lat] and bounds [west, south,
+        east, north], sorted by name.
+    """
+    entries = []
+    for name, geometry in zip(gdf[name_column], gdf.geometry.values):
+        # Inside the largest part, so islands do not pull it into the sea
+        largest = max(shapely.get_parts(geometry), key=lambda part: part.area)
+        point = largest.representative_point()
+        entries.append(
+            {
+                "name": rename(name) if rename else name,
+                "centroid": [round(point.x, 4), round(point.y, 4)],
+                "bounds": [round(value, 4) for value in geometry.bounds],
+            }
+        )
+    return sorted(entries, key=lambda entry: entry["name"])
+
+
+_regions = None
+_regions_lock = threading.Lock()
+
+
+def load_regions(path=REGIONS_PATH):
+    """
+    Return the vendored regions.
+
+    Returns:
+        dict: "countries" and "states" -> list of region entries (see
+        region_entries).
+    """
+    global _regions
+    with _regions_lock:
+        if _regions is None:
+            with open(path) as f:
+                _regions = json.load(f)
+        return _regions
+
+
+def region(kind, name):
+    """Return the vendored entry of a country or state, or None."""
+    for entry in load_regions()[kind]:
+        if entry["name"] == name:
+            return entry
+    return None
+
+
+def bounds_zoom(bounds, width_px=1000):
+    """Return the web map zoom showing bounds across about width_px."""
+    west, south, east, north = bounds
+    span = max(east - west, (north - south) * 1.5, 1e-6)
+    return int(np.clip(np.floor(np.log2(360 * width_px / 256 / span)), 2, 18))
+
+
+class FootprintIndex:
+    """
+    Map centre of each footprint collection, persisted as JSON.
+
+    Inputs:
+        path (str): JSON file, created on the first write.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+        # One lock per collection being resolved, so concurrent sessions
+        # ask Earth Engine once
+        self._inflight = {}
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, asset):
+        with self._lock:
+            return self._load().get(asset)
+
+    def set(self, asset, center):
+        with self._lock:
+            entries = self._load()
+            entries[asset] = {"center": list(center), "updated": time.time()}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            partial = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(partial, "w") as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(partial, self.path)
+
+    def center(self, asset, compute):
+        """
+        Return the [lon, lat] centre of a collection, computing it once.
+
+        Exceptions raised by compute propagate and nothing is stored.
+        """
+        entry = self.get(asset)
+        if entry is not None:
+            return entry["center"]
+        with self._lock:
+            asset_lock = self._inflight.setdefault(asset, threading.Lock())
+        with asset_lock:
+            try:
+                entry = self.get(asset)
+                if entry is not None:
+                    return entry["center"]
+                center = [round(value, 6) for value in compute()]
+                self.set(asset, center)
+                return center
+            finally:
+                with self._lock:
+                    self._inflight.pop(asset, None)
+
+
+footprint_index = FootprintIndex()
+
+
+def collection_center(asset):
+    """
+    Return the [lon, lat] of the first building of a collection.
+
+    Raises ee.EEException when the collection does not exist.
+    """
+    import ee
+
+    return footprint_index.center(
+        asset,
+        lambda: ee.FeatureCollection(asset)
+        .first()
+        .geometry()
+        .centroid(1)
+        .coordinates()
+        .getInfo(),
+    )
+
+
+def has_extract(path=EXTRACT_PATH):
+    return os.path.exists(path)
+
+
+def build_extract(source, path=EXTRACT_PATH, bbox=MALAYSIA_BBOX):
+    """
+    Write the footprints of source inside bbox to a FlatGeobuf file.
+
+    The file gets a spatial index, so read_footprints only reads the
+    features of the requested boxes.
+
+    Inputs:
+        source (str): Any file GDAL reads, e.g. the MSBuildings .geojsonl
+            of a country.
+        path (str): Output .fgb file.
+        bbox (tuple): (west, south, east, north) in EPSG:4326.
+
+    Returns:
+        int: Number of footprints written.
+    """
+    import geopandas as gpd
+
+    footprints = gpd.read_file(source, bbox=bbox).to_crs(epsg=4326)
+    footprints = footprints[["geometry"]]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    partial = f"{os.path.splitext(path)[0]}.tmp.fgb"
+    footprints.to_file(partial, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+    os.replace(partial, path)
+    return len(footprints)
+
+
+def incident_cells(longitude, latitude, radius_m, cell_deg=CELL_DEG):
+    """
+    Group incident points into grid cells.
+
+    Returns:
+        list of (west, south, east, north): One box per occupied cell,
+        padded by radius_m, to read from the extract.
+    """
+    longitude = np.asarray(longitude, dtype=np.float64)
+    latitude = np.asarray(latitude, dtype=np.float64)
+    valid = np.isfinite(longitude) & np.isfinite(latitude)
+    cells = np.unique(
+        np.floor(
+            np.column_stack([longitude[valid], latitude[valid]]) / cell_deg
+        ).astype(np.int64),
+        axis=0,
+    )
+    pad_lat = radius_m / METRES_PER_DEGREE
+    boxes = []
+    for i, j in cells:
+        south, north = j * cell_deg, (j + 1) * cell_deg
+        pad_lon = pad_lat / np.cos(np.radians(max(abs(south), abs(north))))
+        boxes.append(
+            (
+                i * cell_deg - pad_lon,
+                south - pad_lat,
+                (i + 1) * cell_deg + pad_lon,
+                north + pad_lat,
+            )
+        )
+    return boxes
+
+
+def read_footprints(bbox, path=EXTRACT_PATH, max_features=MAX_FEATURES):
+    """Read the footprints of the extract intersecting a lon/lat box."""
+    import geopandas as gpd
+
+    return gpd.read_file(path, bbox=tuple(bbox), rows=max_features)
+
+
+def footprints_near(
+    longitude, latitude, radius_m, path=EXTRACT_PATH, max_features=MAX_FEATURES
+):
+    """
+    Return the footprints of the extract within radius_m of any incident.
+
+    Inputs:
+        longitude, latitude (array-like): Incident coordinates.
+        radius_m (float): Distance in metres.
+        path (str): FlatGeobuf extract.
+        max_features (int): Stop reading once this many were read.
+
+    Returns:
+        gpd.GeoDataFrame in EPSG:4326.
+    """
+    import geopandas as gpd
+
+    parts = []
+    remaining = max_features
+    for box in incident_cells(longitude, latitude, radius_m):
+        if remaining <= 0:
+            break
+        part = read_footprints(box, path, remaining)
+        parts.append(part)
+        remaining -= len(part)
+    if not parts:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    footprints = pd.concat(parts, ignore_index=True)
+    # Boxes of neighbouring cells overlap by the padding
+    footprints = footprints[
+        ~pd.Series(shapely.to_wkb(footprints.geometry.values)).duplicated()
+    ]
+    crs = footprints.estimate_utm_crs()
+    points = gpd.GeoSeries(
+        gpd.points_from_xy(longitude, latitude), crs="EPSG:4326"
+    ).to_crs(crs)
+    points = points[~points.is_empty & points.is_valid]
+    projected = footprints.to_crs(crs)
+    _, hits = projected.sindex.query(
+        points.values, predicate="dwithin", distance=radius_m
+    )
+    return footprints.iloc[np.unique(hits)].reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    regions = commands.add_parser(
+        "regions", help="Vendor the country and US state lists"
+    )
+    regions.add_argument("countries", help="Countries file (NAME or name)")
+    regions.add_argument("states", help="US states file (NAME or name)")
+    regions.add_argument("--output", default=REGIONS_PATH)
+    extract = commands.add_parser(
+        "extract", help="Cut a FlatGeobuf extract of Malaysian footprints"
+    )
+    extract.add_argument("source")
+    extract.add_argument("--output", default=EXTRACT_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "extract":
+        count = build_extract(args.source, args.output)
+        print(f"{count} footprints written to {args.output}")
+        return
+
+    import geopandas as gpd
+
+    def name_column(gdf):
+        return "NAME" if "NAME" in gdf.columns else "name"
+
+    countries = gpd.read_file(args.countries).to_crs(epsg=4326)
+    states = gpd.read_file(args.states).to_crs(epsg=4326)
+    payload = {
+        "countries": region_entries(
+            countries, name_column(countries), asset_name
+        ),
+        "states": region_entries(states, name_column(states)),
+    }
+    partial = f"{args.output}.tmp"
+    with open(partial, "w") as f:
+        json.dump(payload, f, indent=1)
+    os.replace(partial, args.output)
+    print(
+        f"{len(payload['countries'])} countries and "
+        f"{len(payload['states'])} states written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
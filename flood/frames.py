@@ -0,0 +1,616 @@
+"""Single-pass encoder of timelapse GIF and MP4 files.
+
+geemap's timelapse functions download the Earth Engine video as a GIF and
+then rewrite it once per post-processing step: the title, the dates and
+the progress bar (each reopening every frame with PIL and keeping all of
+them in memory), the colorbar, reduce_gif_size and the fading through
+ffmpeg, and a last ffmpeg pass for the MP4.
+
+Here those steps are only recorded while the geemap function runs (see
+streamed) and then applied in one pass: the frames, fetched concurrently
+by flood.thumbnails, are decoded one at a time, overlays are blended into
+the frame array with NumPy, and each frame goes to an optimized GIF writer
+and to an ffmpeg process writing the MP4 at the same time. Only the current and the previous frame are in
+memory, whatever the length of the series.
+
+Both ends rely on internals tested with the versions pinned in
+requirements.txt: the module globals of geemap's timelapse functions, and
+the frame writer of Pillow's GIF plugin. When a geemap release no longer
+has the recorded names, its own post-processing runs; when Pillow has no
+frame writer, the GIF is saved with Image.save, holding every frame.
+"""
+import contextlib
+import os
+import shutil
+import subprocess
+
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageColor, ImageFont, ImageSequence
+
+# Colours of a GIF frame; the last palette entry is kept for transparency
+GIF_COLORS = 255
+TRANSPARENT = 255
+MP4_CRF = 25
+# geemap's post-processing functions recorded by streamed
+STEPS = (
+    "download_ee_video",
+    "add_text_to_gif",
+    "add_image_to_gif",
+    "reduce_gif_size",
+    "gif_fading",
+    "gif_to_mp4",
+)
+# Writes one GIF frame to a file; private to Pillow
+_write_frame_data = getattr(GifImagePlugin, "_write_frame_data", None)
+
+
+def parse_color(color):
+    """Return the (r, g, b) of a colour name, hex code or tuple."""
+    if isinstance(color, str):
+        return ImageColor.getrgb(color)[:3]
+    return tuple(int(value) for value in color[:3])
+
+
+def parse_xy(xy, size, default):
+    """
+    Return the pixel position of (10, 10) or ("10%", "5%") in a frame.
+
+    Inputs:
+        xy (tuple): Position, or None for default.
+        size (tuple): (width, height) of the frame.
+        default (tuple): Pixel position used when xy is None.
+    """
+    if xy is None:
+        return default
+    width, height = size
+    x, y = xy
+    if isinstance(x, str):
+        x = int(float(x.replace("%", "")) / 100.0 * width)
+    if isinstance(y, str):
+        y = int(float(y.replace("%", "")) / 100.0 * height)
+    return int(x), int(y)
+
+
+def load_font(font_type, font_size):
+    """Return a font of geemap, of the system, or the default one."""
+    try:
+        import geemap
+
+        fonts = os.path.join(os.path.dirname(geemap.__file__), "data", "fonts")
+        if os.path.exists(os.path.join(fonts, font_type)):
+            return ImageFont.truetype(os.path.join(fonts, font_type), font_size)
+    except ImportError:
+        pass
+    try:
+        return ImageFont.truetype(font_type, font_size)
+    except OSError:
+        return ImageFont.load_default(font_size)
+
+
+def frame_texts(text_sequence, count):
+    """
+    Return the text drawn on each frame, as geemap's add_text_to_gif.
+
+    Returns:
+        list of str, or None when a list does not match the frame count.
+    """
+    if text_sequence is None:
+        return [str(x) for x in range(1, count + 1)]
+    if isinstance(text_sequence, str):
+        try:
+            text_sequence = int(text_sequence)
+        except ValueError:
+            return [text_sequence] * count
+    if isinstance(text_sequence, int):
+        return [str(x) for x in range(text_sequence, text_sequence + count)]
+    if len(text_sequence) != count:
+        return None
+    return [str(x) for x in text_sequence]
+
+
+def blend(frame, x, y, alpha, color):
+    """
+    Blend a colour into frame through an alpha mask, in place.
+
+    Inputs:
+        frame (np.ndarray): (height, width, 3) uint8 frame.
+        x, y (int): Position of the top left corner of the mask.
+        alpha (np.ndarray): (h, w) uint8 mask.
+        color (np.ndarray): (3,) colour, or (h, w, 3) image.
+    """
+    height, width = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1 = min(x + alpha.shape[1], width)
+    y1 = min(y + alpha.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    a = alpha[y0 - y : y1 - y, x0 - x : x1 - x, None].astype(np.uint32)
+    if color.ndim == 3:
+        color = color[y0 - y : y1 - y, x0 - x : x1 - x]
+    region = frame[y0:y1, x0:x1]
+    region[:] = (region * (255 - a) + color * a + 127) // 255
+
+
+class TextLayer:
+    """
+    Text drawn on every frame: a fixed title or one date per frame.
+
+    Inputs: See geemap's add_text_to_gif.
+    """
+
+    def __init__(self, text_sequence, xy, font_type, font_size, font_color):
+        self.text_sequence = text_sequence
+        self.xy = xy
+        self.font = load_font(font_type, font_size)
+        self.color = np.array(parse_color(font_color), dtype=np.uint16)
+        self._texts = None
+        # Mask of the last text drawn, reused while the text is the same
+        self._mask = (None, None, None)
+
+    def start(self, size, count):
+        self._texts = frame_texts(self.text_sequence, count)
+        width, height = size
+        self._position = parse_xy(
+            self.xy, size, (int(0.05 * width), int(0.05 * height))
+        )
+
+    def apply(self, frame, index, count):
+        if self._texts is None:
+            return
+        text = self._texts[index]
+        if self._mask[0] != text:
+            mask, offset = self.font.getmask2(text, mode="L")
+            alpha = np.asarray(mask, dtype=np.uint8).reshape(
+                mask.size[1], mask.size[0]
+            )
+            self._mask = (text, alpha, offset)
+        _, alpha, offset = self._mask
+        x, y = self._position
+        blend(frame, x + offset[0], y + offset[1], alpha, self.color)
+
+
+class ProgressBar:
+    """Bar along the bottom of the frames growing to the last frame."""
+
+    def __init__(self, color, height):
+        self.color = np.array(parse_color(color), dtype=np.uint8)
+        self.height = int(height)
+
+    def start(self, size, count):
+        pass
+
+    def apply(self, frame, index, count):
+        width = frame.shape[1]
+        right = int((index + 1) / count * width)
+        frame[frame.shape[0] - self.height :, : right + 1] = self.color
+
+
+class ImageLayer:
+    """
+    Image, e.g. a colorbar, pasted on every frame.
+
+    Inputs: See geemap's add_image_to_gif.
+    """
+
+    def __init__(self, path, xy=None, image_size=(80, 80), circle_mask=False):
+        self.path = path
+        self.xy = xy
+        self.image_size = image_size
+        self.circle_mask = circle_mask
+
+    def start(self, size, count):
+        with Image.open(self.path) as image:
+            image = image.convert("RGBA")
+            image.thumbnail(
+                (
+                    min(image.width, self.image_size[0]),
+                    min(image.height, self.image_size[1]),
+                ),
+                Image.LANCZOS,
+            )
+            pixels = np.asarray(image)
+        self._rgb = pixels[..., :3].astype(np.uint16)
+        self._alpha = pixels[..., 3].copy()
+        if self.circle_mask:
+            rows, columns = np.ogrid[: self._alpha.shape[0], : self._alpha.shape[1]]
+            ry, rx = self._alpha.shape[0] / 2, self._alpha.shape[1] / 2
+            outside = ((rows + 0.5 - ry) / ry) ** 2 + ((columns + 0.5 - rx) / rx) ** 2
+            self._alpha[outside > 1] = 0
+        width, height = size
+        self._position = parse_xy(
+            self.xy,
+            size,
+            (width - self._alpha.shape[1] - 10, height - self._alpha.shape[0] - 10),
+        )
+
+    def apply(self, frame, index, count):
+        blend(frame, *self._position, self._alpha, self._rgb)
+
+
+def gif_frames(path):
+    """
+    Decode a GIF one frame at a time.
+
+    Returns:
+        (int, tuple, generator): Frame count, (width, height) and the
+        frames as (height, width, 3) uint8 arrays with the duration of each
+        in milliseconds.
+    """
+    image = Image.open(path)
+    count, size = image.n_frames, image.size
+
+    def frames():
+        with image:
+            for frame in ImageSequence.Iterator(image):
+                duration = frame.info.get("duration", 100)
+                yield np.array(frame.convert("RGB")), duration
+
+    return count, size, frames()
+
+
+def image_frames(paths, duration):
+    """
+    Decode frame images one at a time, as gif_frames.
+
+    Frames are resized to the size of the first one.
+    """
+    with Image.open(paths[0]) as first:
+        size = first.size
+
+    def frames():
+        for path in paths:
+            with Image.open(path) as image:
+                image = image.convert("RGB")
+                if image.size != size:
+                    image = image.resize(size)
+                yield np.array(image), duration
+
+    return len(paths), size, frames()
+
+
+class GifWriter:
+    """
+    Write an optimized animated GIF frame by frame.
+
+    Each frame gets its own palette, only the box of pixels that changed
+    since the previous frame is written, unchanged pixels inside it are
+    transparent, and identical frames are merged into one longer frame.
+    Without Pillow's frame writer, the whole frames are kept and saved at
+    close instead.
+    """
+
+    def __init__(self, path, size, loop=0):
+        self._file = open(path, "wb")
+        self.loop = loop
+        self._previous = None
+        self._pending = None
+        self._frames = None if _write_frame_data else []
+        if self._frames is not None:
+            return
+        width, height = size
+        header = b"GIF89a" + _o16(width) + _o16(height) + b"\x00\x00\x00"
+        if loop is not None:
+            header += (
+                b"!\xff\x0bNETSCAPE2.0\x03\x01" + _o16(int(loop)) + b"\x00"
+            )
+        self._file.write(header)
+
+    def write(self, frame, duration):
+        image = Image.fromarray(frame).quantize(
+            GIF_COLORS, method=Image.Quantize.FASTOCTREE
+        )
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        colors = np.array(image.getpalette()[: 3 * GIF_COLORS], dtype=np.uint8)
+        palette[: len(colors) // 3] = colors.reshape(-1, 3)
+        indices = np.asarray(image)
+        shown = palette[indices]
+        if self._previous is None:
+            changed = None
+            box = (0, 0, frame.shape[1], frame.shape[0])
+        else:
+            changed = np.any(shown != self._previous, axis=2)
+            rows = np.flatnonzero(changed.any(axis=1))
+            if rows.size == 0:
+                if self._frames is not None:
+                    self._frames[-1][1] += duration
+                else:
+                    self._pending[2] += duration
+                return
+            columns = np.flatnonzero(changed.any(axis=0))
+            box = (columns[0], rows[0], columns[-1] + 1, rows[-1] + 1)
+        self._previous = shown
+        if self._frames is not None:
+            self._frames.append([image, duration])
+            return
+        self._flush()
+        left, top, right, bottom = box
+        indices = indices[top:bottom, left:right]
+        if changed is not None:
+            indices = np.where(changed[top:bottom, left:right], indices, TRANSPARENT)
+        self._pending = [indices.astype(np.uint8), palette, duration, (left, top)]
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        indices, palette, duration, offset = self._pending
+        image = Image.fromarray(indices, "L")
+        image.putpalette(palette.tobytes())
+        params = {"duration": duration, "disposal": 1, "include_color_table": True}
+        if offset != (0, 0) or (indices == TRANSPARENT).any():
+            params["transparency"] = TRANSPARENT
+        # getdata would collect the frame in a class attribute, only freed
+        # by the garbage collector
+        _write_frame_data(self._file, image, offset, params)
+        self._pending = None
+
+    def close(self):
+        if self._frames is not None:
+            self._save()
+        else:
+            self._flush()
+            self._file.write(b";")
+        self._file.close()
+
+    def _save(self):
+        if not self._frames:
+            return
+        images = [image for image, _ in self._frames]
+        params = {"loop": self.loop} if self.loop is not None else {}
+        images[0].save(
+            self._file,
+            format="GIF",
+            save_all=True,
+            append_images=images[1:],
+            duration=[duration for _, duration in self._frames],
+            optimize=True,
+            **params,
+        )
+
+
+def _o16(value):
+    return int(value).to_bytes(2, "little")
+
+
+def ffmpeg_exe():
+    """Return the path of ffmpeg, or None when it is not installed."""
+    exe = shutil.which("ffmpeg")
+    if exe is not None:
+        return exe
+    try:
+        import imageio_ffmpeg
+
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return None
+
+
+class Mp4Writer:
+    """Pipe raw frames to an ffmpeg process encoding an H.264 MP4."""
+
+    def __init__(self, path, size, fps, exe):
+        width, height = size
+        self.path = path
+        self._process = subprocess.Popen(
+            [
+                exe,
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                f"{fps:g}",
+                "-i",
+                "-",
+                # libx264 needs even dimensions
+                "-vf",
+                "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                "-vcodec",
+                "libx264",
+                "-crf",
+                str(MP4_CRF),
+                "-pix_fmt",
+                "yuv420p",
+                path,
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        self._broken = False
+
+    def write(self, frame):
+        if self._broken:
+            return
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).tobytes())
+        except OSError:
+            # ffmpeg exited; close reports its error
+            self._broken = True
+
+    def close(self):
+        """Wait for ffmpeg; raises RuntimeError if it failed."""
+        _, error = self._process.communicate()
+        if self._process.returncode != 0 or self._broken:
+            raise RuntimeError(
+                f"ffmpeg failed (exit code {self._process.returncode}): "
+                f"{error.decode(errors='replace').strip()}"
+            )
+
+
+class FramePipeline:
+    """
+    The post-processing of one timelapse, applied in a single pass.
+
+    The methods named after geemap's post-processing functions take the
+    same arguments and only record the step; run applies them all.
+    """
+
+    def __init__(self):
+        self.source = None
+        self.target = None
+        self.frames = None
+        self.layers = []
+        self.progress_bar = None
+        self.duration = None
+        self.loop = 0
+        self.fading = 0
+        self.mp4 = None
+        # Why the MP4 asked for was not written, once run
+        self.mp4_error = None
+
+    def _record(self, in_gif, out_gif=None):
+        if self.source is None:
+            self.source = os.path.abspath(in_gif)
+        self.target = os.path.abspath(out_gif or in_gif)
+
+    def download_ee_video(
+        self, collection, video_args, out_gif, timeout=300, proxies=None
+    ):
+        from flood.thumbnails import frame_cache, thumbnail_params
+
+        self.frames = frame_cache.fetch_collection(
+            collection, thumbnail_params(video_args)
+        )
+        if not self.frames:
+            return
+        self.duration = self.duration or 1000 / video_args.get("framesPerSecond", 10)
+        # geemap checks that the GIF exists before the next steps; it holds
+        # the first frame until run writes the timelapse
+        with Image.open(self.frames[0]) as image:
+            image.convert("RGB").save(out_gif)
+        self._record(out_gif)
+
+    def add_text_to_gif(
+        self,
+        in_gif,
+        out_gif,
+        xy=None,
+        text_sequence=None,
+        font_type="arial.ttf",
+        font_size=20,
+        font_color="#000000",
+        add_progress_bar=True,
+        progress_bar_color="white",
+        progress_bar_height=5,
+        duration=100,
+        loop=0,
+    ):
+        self._record(in_gif, out_gif)
+        self.layers.append(
+            TextLayer(text_sequence, xy, font_type, font_size, font_color)
+        )
+        if add_progress_bar:
+            self.progress_bar = ProgressBar(progress_bar_color, progress_bar_height)
+        self.duration = duration
+        self.loop = loop
+
+    def add_image_to_gif(
+        self, in_gif, out_gif, in_image, xy=None, image_size=(80, 80), circle_mask=False
+    ):
+        self._record(in_gif, out_gif)
+        self.layers.append(ImageLayer(in_image, xy, image_size, circle_mask))
+
+    def reduce_gif_size(self, in_gif, out_gif=None):
+        # Frames are always written optimized
+        self._record(in_gif, out_gif)
+
+    def gif_fading(self, in_gif, out_gif, duration=1, verbose=True):
+        self._record(in_gif, out_gif)
+        self.fading = duration
+
+    def gif_to_mp4(self, in_gif, out_mp4):
+        self._record(in_gif)
+        self.mp4 = os.path.abspath(out_mp4)
+
+    def run(self):
+        """
+        Write the timelapse GIF, and the MP4 if one was asked for.
+
+        Nothing is done when no step was recorded. The MP4 is skipped when
+        ffmpeg is not installed; when ffmpeg fails, the GIF is still written
+        and the error is left in mp4_error.
+        """
+        if self.source is None or not os.path.exists(self.source):
+            return
+        if self.frames:
+            count, size, frames = image_frames(self.frames, self.duration)
+        else:
+            count, size, frames = gif_frames(self.source)
+        for layer in self.layers:
+            layer.start(size, count)
+        overlays = list(self.layers)
+        if self.progress_bar is not None:
+            overlays.append(self.progress_bar)
+        partial = f"{os.path.splitext(self.target)[0]}.encoding.gif"
+        gif = GifWriter(partial, size, self.loop)
+        mp4 = None
+        exe = ffmpeg_exe() if self.mp4 else None
+        try:
+            previous = None
+            for index, (frame, duration) in enumerate(frames):
+                duration = self.duration or duration
+                if mp4 is None and exe is not None:
+                    mp4 = Mp4Writer(self.mp4, size, 1000 / duration, exe)
+                for overlay in overlays:
+                    overlay.apply(frame, index, count)
+                if previous is not None and self.fading > 0:
+                    # Cross-fade from the previous frame at the same rate
+                    steps = max(1, round(self.fading * 1000 / duration))
+                    for step in range(1, steps + 1):
+                        weight = step / (steps + 1)
+                        faded = (previous * (1 - weight) + frame * weight).astype(
+                            np.uint8
+                        )
+                        gif.write(faded, duration)
+                        if mp4 is not None:
+                            mp4.write(faded)
+                gif.write(frame, duration)
+                if mp4 is not None:
+                    mp4.write(frame)
+                previous = frame
+        finally:
+            gif.close()
+            if mp4 is not None:
+                try:
+                    mp4.close()
+                except RuntimeError as error:
+                    self.mp4_error = str(error)
+                    if os.path.exists(self.mp4):
+                        os.remove(self.mp4)
+        os.replace(partial, self.target)
+
+
+@contextlib.contextmanager
+def streamed(function):
+    """
+    Record geemap's GIF post-processing instead of running it.
+
+    While the context is active, the post-processing functions that the
+    module of function calls are replaced by the methods of a
+    FramePipeline; call its run method afterwards. When that module lacks
+    any of them, nothing is replaced and the pipeline records nothing.
+
+    Inputs:
+        function (callable): A geemap timelapse function.
+
+    Yields:
+        FramePipeline
+    """
+    pipeline = FramePipeline()
+    namespace = getattr(function, "__globals__", {})
+    if not all(callable(namespace.get(name)) for name in STEPS):
+        # Not the geemap this was written for: recording only some steps
+        # would post-process a placeholder GIF, so geemap runs them all
+        yield pipeline
+        return
+    saved = {name: namespace[name] for name in STEPS}
+    namespace.update({name: getattr(pipeline, name) for name in saved})
+    try:
+        yield pipeline
+    finally:
+        namespace.update(saved)
@@ -0,0 +1,375 @@
+"""Batch geocoding of flood incident place names.
+
+Replaces the row-by-row ``data.apply(my_geocoder)`` of
+``analytics/geolocate.ipynb``. Place names are de-duplicated, looked up in a
+SQLite cache, and only the names that were never resolved are sent to the
+geocoding backend through a small pool of asyncio workers sharing one rate
+limiter. Results are committed to the cache every few lookups, so an
+interrupted run resumes where it stopped and a re-run after adding a new
+year only geocodes the new names.
+
+Usage:
+    python -m flood.geocode analytics/data2/all_states_all_years_v2.xlsx out.csv
+"""
+import argparse
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+CACHE_PATH = "analytics/data2/geocode_cache.sqlite"
+
+FOUND = "found"
+NOT_FOUND = "not_found"
+
+
+class GeocoderError(Exception):
+    """A transient backend failure (timeout, HTTP 429/5xx); worth a retry."""
+
+
+class NominatimBackend:
+    """
+    Geocode through OpenStreetMap Nominatim (via geopy).
+
+    Inputs:
+        user_agent (str): Identifies the application, required by the
+            Nominatim usage policy.
+        country_codes (str): Restrict results to these countries.
+        timeout (int): Request timeout in seconds.
+    """
+
+    # Nominatim's usage policy allows one request per second
+    max_rate = 1.0
+
+    def __init__(self, user_agent, country_codes="my", timeout=10):
+        from geopy.exc import GeopyError
+        from geopy.geocoders import Nominatim
+
+        self._geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+        self._errors = GeopyError
+        self.country_codes = country_codes
+
+    def geocode(self, query):
+        try:
+            location = self._geolocator.geocode(
+                query, country_codes=self.country_codes
+            )
+        except self._errors as error:
+            raise GeocoderError(str(error)) from error
+        if location is None:
+            return None
+        return location.latitude, location.longitude
+
+
+class GazetteerBackend:
+    """
+    Geocode from a local table of known places.
+
+    Used offline and in tests in place of Nominatim.
+
+    Inputs:
+        places (dict or pd.DataFrame): Mapping of query string to
+            (latitude, longitude), or a frame with Name, Latitude and
+            Longitude columns (e.g. a previously geocoded CSV).
+    """
+
+    max_rate = None
+
+    def __init__(self, places):
+        if isinstance(places, pd.DataFrame):
+            places = places.dropna(subset=["Latitude", "Longitude"])
+            places = dict(
+                zip(
+                    places["Name"],
+                    zip(places["Latitude"], places["Longitude"]),
+                )
+            )
+        self.places = dict(places)
+
+    def geocode(self, query):
+        return self.places.get(query)
+
+
+class GeocodeCache:
+    """Resolved and unresolvable place names, stored in SQLite."""
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS places (
+                query TEXT PRIMARY KEY,
+                latitude REAL,
+                longitude REAL,
+                status TEXT NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self._connection.commit()
+
+    def lookup(self, queries):
+        """
+        Return the cached entries of the given queries.
+
+        Returns:
+            dict of query -> (latitude, longitude), None for names the
+            backend could not resolve. Unknown queries are absent.
+        """
+        found = {}
+        queries = list(queries)
+        with self._lock:
+            for start in range(0, len(queries), 500):
+                batch = queries[start : start + 500]
+                rows = self._connection.execute(
+                    "SELECT query, latitude, longitude, status FROM places "
+                    f"WHERE query IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for query, latitude, longitude, status in rows:
+                    found[query] = (
+                        (latitude, longitude) if status == FOUND else None
+                    )
+        return found
+
+    def store(self, results):
+        """Save a dict of query -> (latitude, longitude) or None."""
+        now = time.time()
+        rows = [
+            (query, *(point or (None, None)), FOUND if point else NOT_FOUND, now)
+            for query, point in results.items()
+        ]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._connection.commit()
+
+    def forget_missing(self):
+        """Drop the unresolved names so the next run retries them."""
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM places WHERE status = ?", (NOT_FOUND,)
+            )
+            self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class RateLimiter:
+    """Spaces out calls shared by several asyncio workers."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def _geocode_async(
+    queries, backend, cache, workers, rate, retries, checkpoint_every, verbose
+):
+    queue = asyncio.Queue()
+    for query in queries:
+        queue.put_nowait(query)
+    limiter = RateLimiter(rate)
+    pending = {}
+    done = 0
+
+    def checkpoint():
+        if pending:
+            cache.store(dict(pending))
+            pending.clear()
+
+    async def worker():
+        nonlocal done
+        while True:
+            try:
+                query = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            point = None
+            for attempt in range(retries + 1):
+                await limiter.wait()
+                try:
+                    point = await asyncio.to_thread(backend.geocode, query)
+                    break
+                except GeocoderError as error:
+                    if attempt == retries:
+                        # Leave it out of the cache so the next run retries
+                        if verbose:
+                            print(f"Giving up on {query!r}: {error}")
+                        point = False
+                        break
+                    await asyncio.sleep(2**attempt)
+            if point is not False:
+                pending[query] = point
+            done += 1
+            if len(pending) >= checkpoint_every:
+                checkpoint()
+            if verbose and done % 100 == 0:
+                print(f"Geocoded {done}/{len(queries)} names")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    finally:
+        checkpoint()
+
+
+def geocode_names(
+    names,
+    backend,
+    cache,
+    workers=4,
+    rate=None,
+    retries=3,
+    checkpoint_every=50,
+    verbose=False,
+):
+    """
+    Geocode unique place names, using and filling the cache.
+
+    Inputs:
+        names (iterable): Query strings, duplicates allowed.
+        backend: Object with a geocode(query) method returning
+            (latitude, longitude) or None, raising GeocoderError on transient
+            failures.
+        cache (GeocodeCache): Persistent cache, also the resume checkpoint.
+        workers (int): Concurrent lookups.
+        rate (float): Maximum lookups per second across all workers.
+            Defaults to the backend's max_rate.
+        retries (int): Retries per name on GeocoderError, with exponential
+            backoff.
+        checkpoint_every (int): Commit to the cache after this many results.
+        verbose (bool): Print progress.
+
+    Returns:
+        dict of name -> (latitude, longitude) or None.
+    """
+    unique = list(dict.fromkeys(name for name in names if isinstance(name, str)))
+    results = cache.lookup(unique)
+    missing = [name for name in unique if name not in results]
+    if verbose:
+        print(
+            f"{len(unique)} unique names, {len(results)} cached, "
+            f"{len(missing)} to geocode"
+        )
+    if missing:
+        if rate is None:
+            rate = getattr(backend, "max_rate", None)
+        asyncio.run(
+            _geocode_async(
+                missing,
+                backend,
+                cache,
+                workers,
+                rate,
+                retries,
+                checkpoint_every,
+                verbose,
+            )
+        )
+        results.update(cache.lookup(missing))
+    return results
+
+
+def place_names(data):
+    """Build the 'Place, Region, State' query of every incident row."""
+    parts = data[["Place", "Region", "State"]].astype("string")
+    return (
+        parts["Place"].str.strip()
+        + ", "
+        + parts["Region"].str.strip()
+        + ", "
+        + parts["State"].str.strip()
+    )
+
+
+def geocode_frame(data, backend, cache, column="Name", **kwargs):
+    """
+    Add Latitude and Longitude columns to incident rows.
+
+    Inputs:
+        data (pd.DataFrame): Incidents. If `column` is missing it is built
+            with place_names.
+        backend: See geocode_names.
+        cache (GeocodeCache): See geocode_names.
+        column (str): Column holding the query strings.
+        **kwargs: Passed to geocode_names.
+
+    Returns:
+        pd.DataFrame: A copy of data with Latitude and Longitude (NaN where
+        the name could not be geocoded).
+    """
+    data = data.copy()
+    if column not in data:
+        data[column] = place_names(data)
+    results = geocode_names(data[column], backend, cache, **kwargs)
+    found = {name: point for name, point in results.items() if point}
+    data["Latitude"] = data[column].map(
+        {name: point[0] for name, point in found.items()}
+    ).astype(float)
+    data["Longitude"] = data[column].map(
+        {name: point[1] for name, point in found.items()}
+    ).astype(float)
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("input", help="Excel or CSV file of incidents")
+    parser.add_argument("output", help="CSV file to write")
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--user-agent", default="streamlit_floodv2")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--gazetteer",
+        help="Geocoded CSV (Name, Latitude, Longitude) to use instead of "
+        "Nominatim",
+    )
+    parser.add_argument(
+        "--retry-missing",
+        action="store_true",
+        help="Retry names that previously could not be geocoded",
+    )
+    args = parser.parse_args(argv)
+
+    if args.input.endswith((".xlsx", ".xls")):
+        data = pd.read_excel(args.input)
+    else:
+        data = pd.read_csv(args.input)
+    if args.gazetteer:
+        backend = GazetteerBackend(pd.read_csv(args.gazetteer))
+    else:
+        backend = NominatimBackend(args.user_agent)
+    cache = GeocodeCache(args.cache)
+    if args.retry_missing:
+        cache.forget_missing()
+    try:
+        data = geocode_frame(
+            data, backend, cache, workers=args.workers, verbose=True
+        )
+    finally:
+        cache.close()
+    print(
+        f"{data['Latitude'].notna().mean() * 100:.1f}% of rows were geocoded"
+    )
+    data.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Server-side heatmap rasterisation of flood incidents.
+
+Incidents are binned onto a fixed grid over Malaysia and blurred with a
+Gaussian kernel. The kernel is separable, so the blur is two 1-D FFT
+convolutions (one per axis) rather than a 2-D one. The result is coloured
+and encoded as a PNG that the maps add as a single image overlay, and every
+PNG is cached in memory and on disk by (store, year, radius, weight). PNGs
+of an older store are deleted once the store changes.
+"""
+import io
+import os
+import threading
+
+import numpy as np
+import pyarrow as pa
+from PIL import Image
+
+# west, south, east, north in degrees
+MALAYSIA_BOUNDS = (99.5, 0.5, 119.5, 7.6)
+# Grid cell size in degrees (~2.2 km at the equator)
+CELL_DEG = 0.02
+KM_PER_DEG = 111.32
+
+CACHE_DIR = "analytics/data2/heatmap_cache"
+
+# Numeric store columns that are not incident measures
+# Measures that can weight the density; None counts incidents. Other
+# numeric columns of the store (years, coordinates, identifiers such as
+# postcodes added by flood.store.add_columns) are not measures
+WEIGHTS = {
+    "Incident count": None,
+    "Affected population": "Affected",
+    "Duration (days)": "Duration",
+}
+
+# Blue -> cyan -> lime -> yellow -> red, the leaflet.heat default gradient
+_GRADIENT = np.array(
+    [
+        [0.00, 0, 0, 255],
+        [0.40, 0, 0, 255],
+        [0.60, 0, 255, 255],
+        [0.70, 0, 255, 0],
+        [0.80, 255, 255, 0],
+        [1.00, 255, 0, 0],
+    ],
+    dtype=np.float64,
+)
+
+
+def grid_shape(bounds=MALAYSIA_BOUNDS, cell=CELL_DEG):
+    west, south, east, north = bounds
+    return (
+        int(np.ceil((north - south) / cell)),
+        int(np.ceil((east - west) / cell)),
+    )
+
+
+def gaussian_kernel(sigma):
+    """Return a normalised 1-D Gaussian kernel truncated at 3 sigma."""
+    half = max(int(np.ceil(3 * sigma)), 1)
+    offsets = np.arange(-half, half + 1, dtype=np.float64)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def _convolve_axis(grid, kernel, axis):
+    """Linear ('same' size) convolution of every line of grid along axis."""
+    n = grid.shape[axis]
+    size = n + len(kernel) - 1
+    fft_size = 1 << (size - 1).bit_length()
+    spectrum = np.fft.rfft(grid, fft_size, axis=axis)
+    shape = [1, 1]
+    shape[axis] = -1
+    spectrum *= np.fft.rfft(kernel, fft_size).reshape(shape)
+    full = np.fft.irfft(spectrum, fft_size, axis=axis)
+    start = len(kernel) // 2
+    return np.take(full, np.arange(start, start + n), axis=axis)
+
+
+def density_grid(
+    longitude,
+    latitude,
+    weights=None,
+    radius_km=20,
+    bounds=MALAYSIA_BOUNDS,
+    cell=CELL_DEG,
+):
+    """
+    Compute a kernel density surface of points on a regular grid.
+
+    Inputs:
+        longitude (array): Point longitudes.
+        latitude (array): Point latitudes.
+        weights (array): Optional weight of each point (defaults to 1).
+        radius_km (float): Gaussian kernel standard deviation in kilometres.
+        bounds (tuple): (west, south, east, north) of the grid.
+        cell (float): Cell size in degrees.
+
+    Returns:
+        np.ndarray (rows, cols) float32 density, row 0 is the northern edge.
+    """
+    west, south, east, north = bounds
+    rows, cols = grid_shape(bounds, cell)
+    counts, _, _ = np.histogram2d(
+        np.asarray(latitude, dtype=np.float64),
+        np.asarray(longitude, dtype=np.float64),
+        bins=(rows, cols),
+        range=((south, south + rows * cell), (west, west + cols * cell)),
+        weights=None if weights is None else np.nan_to_num(weights),
+    )
+    counts = counts[::-1]
+    sigma = max(radius_km / (KM_PER_DEG * cell), 0.5)
+    kernel = gaussian_kernel(sigma)
+    density = _convolve_axis(_convolve_axis(counts, kernel, 0), kernel, 1)
+    return np.clip(density, 0, None).astype(np.float32)
+
+
+def colorize(density, max_opacity=0.8, min_fraction=0.02):
+    """
+    Map a density grid to RGBA pixels.
+
+    Inputs:
+        density (np.ndarray): Output of density_grid.
+        max_opacity (float): Alpha of the densest cells.
+        min_fraction (float): Cells below this fraction of the maximum are
+            left transparent.
+
+    Returns:
+        np.ndarray (rows, cols, 4) uint8.
+    """
+    peak = density.max()
+    scaled = density / peak if peak > 0 else density
+    rgba = np.empty(density.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(
+            scaled, _GRADIENT[:, 0], _GRADIENT[:, channel + 1]
+        )
+    alpha = np.sqrt(scaled) * max_opacity * 255
+    alpha[scaled < min_fraction] = 0
+    rgba[..., 3] = alpha
+    return rgba
+
+
+def encode_png(rgba):
+    """Encode an RGBA uint8 array as PNG bytes."""
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buffer, format="PNG", compress_level=6)
+    return buffer.getvalue()
+
+
+def weight_columns(store):
+    """
+    Return the WEIGHTS the store has as numeric columns.
+
+    Returns:
+        dict: Label -> column name, None to count incidents.
+    """
+    schema = store.table.schema
+    return {
+        label: column
+        for label, column in WEIGHTS.items()
+        if column is None
+        or (
+            column in schema.names
+            and (
+                pa.types.is_integer(schema.field(column).type)
+                or pa.types.is_floating(schema.field(column).type)
+            )
+        )
+    }
+
+
+def image_bounds(bounds=MALAYSIA_BOUNDS, cell=CELL_DEG):
+    """Return the [[south, west], [north, east]] extent of the grid image.
+
+    The grid is regular in degrees and is overlaid without reprojection;
+    between 0.5 and 7.6 degrees north the Mercator stretch is under 1 %.
+    """
+    west, south, _, _ = bounds
+    rows, cols = grid_shape(bounds, cell)
+    return [[south, west], [south + rows * cell, west + cols * cell]]
+
+
+class HeatmapCache:
+    """
+    PNG heatmaps cached in memory and as files in a directory.
+
+    The first part of a key is the version of the data (the store digest).
+    When a PNG of a new version is stored, those of every other version are
+    dropped from memory and deleted from the directory.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_items=64):
+        self.directory = directory
+        self.max_items = max_items
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        name = "_".join(str(part) for part in key)
+        return os.path.join(self.directory, f"{name}.png")
+
+    def get(self, key, render):
+        """
+        Return the cached PNG for key, rendering and storing it if missing.
+
+        Inputs:
+            key (tuple): Hashable, filename-safe cache key; key[0] is the
+                version of the data.
+            render (callable): Returns PNG bytes on a cache miss.
+
+        Returns:
+            bytes
+        """
+        png = self._items.get(key)
+        if png is not None:
+            return png
+        path = self._path(key)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                png = f.read()
+        else:
+            png = render()
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+            self._purge(key[0])
+        with self._lock:
+            for old in [item for item in self._items if item[0] != key[0]]:
+                del self._items[old]
+            if len(self._items) >= self.max_items:
+                self._items.pop(next(iter(self._items)))
+            self._items[key] = png
+        return png
+
+    def _purge(self, version):
+        """Delete the PNGs of every other version of the data."""
+        prefix = f"{version}_"
+        for name in os.listdir(self.directory):
+            if name.endswith(".png") and not name.startswith(prefix):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+_cache = HeatmapCache()
+
+
+def year_heatmap_png(store, years, radius_km=20, weight=None):
+    """
+    Return the heatmap PNG of one or more years of the incident store.
+
+    Inputs:
+        store (IncidentStore): Shared incident store.
+        years (tuple): (first, last) inclusive year range.
+        radius_km (float): Kernel radius in kilometres.
+        weight (str): Column used as weight, None to count incidents.
+
+    Returns:
+        bytes
+    """
+    first, last = years
+    key = (store.digest[:16], first, last, radius_km, weight or "count")
+
+    def render():
+        data = store.year_index.select_range(first, last)
+        weights = None if weight is None else data[weight].to_numpy()
+        density = density_grid(
+            data["Longitude"].to_numpy(),
+            data["Latitude"].to_numpy(),
+            weights=weights,
+            radius_km=radius_km,
+        )
+        return encode_png(colorize(density))
+
+    return _cache.get(key, render)
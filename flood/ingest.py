@@ -0,0 +1,311 @@
+"""Incremental ingestion of the yearly JPS flood reports.
+
+Instead of re-running the geocoding notebooks over the whole workbook and
+writing yet another CSV variant, a new workbook is streamed sheet by sheet,
+its ``Date_Temp`` values are normalised, rows already in the store are
+skipped (matching dates with day and month in either order, as the reports
+mix both), and only place names the store and the geocode cache have never
+seen are sent to the geocoder. The new rows are appended to the store as a
+partition recorded in a manifest with content hashes, and the statistics
+cube is updated with just those rows.
+
+Rows whose place could not be geocoded are reported and left out. A
+workbook is only skipped by later runs once all its rows were located, so
+a re-run (e.g. with a --gazetteer of the missing places) retries exactly
+the rows that are still missing from the store.
+
+Usage:
+    python -m flood.ingest analytics/data2/all_states_all_years_v2.xlsx
+    python -m flood.ingest new_year.xlsx --gazetteer known_places.csv
+    python -m flood.ingest new_year.xlsx --unlocated unlocated.csv
+"""
+import argparse
+import os
+
+import pandas as pd
+
+from flood.cube import append_to_cube
+from flood.geocode import (
+    CACHE_PATH,
+    GazetteerBackend,
+    GeocodeCache,
+    NominatimBackend,
+    geocode_frame,
+    place_names,
+)
+from flood.store import (
+    CSV_PATH,
+    append_partition,
+    date_key,
+    file_digest,
+    frame_to_table,
+    get_store,
+    parse_report_dates,
+    partition_dir_for,
+    read_manifest,
+)
+
+REPORT_COLUMNS = ["Year", "Date_Temp", "State", "Region", "Place"]
+# Columns identifying an incident when checking for rows already ingested;
+# DateKey is the date_key of its Date
+KEY_COLUMNS = ["Year", "DateKey", "State", "Region", "Place"]
+
+
+def read_reports(path, chunk_size=5000):
+    """
+    Stream the rows of every sheet of a report workbook.
+
+    Formula columns (Name, Line Check) are ignored; the Name is rebuilt
+    from Place, Region and State.
+
+    Inputs:
+        path (str): .xlsx workbook.
+        chunk_size (int): Rows per yielded frame.
+
+    Yields:
+        pd.DataFrame with REPORT_COLUMNS.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None or not set(REPORT_COLUMNS) <= set(header):
+                continue
+            positions = [header.index(column) for column in REPORT_COLUMNS]
+            chunk = []
+            for row in rows:
+                if row[positions[0]] is None:
+                    continue
+                chunk.append([row[i] for i in positions])
+                if len(chunk) == chunk_size:
+                    yield pd.DataFrame(chunk, columns=REPORT_COLUMNS)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame(chunk, columns=REPORT_COLUMNS)
+    finally:
+        workbook.close()
+
+
+def normalise(reports):
+    """
+    Clean report rows and parse their dates.
+
+    Returns:
+        pd.DataFrame: Rows with an integer Year, a Date (NaT when the
+        Date_Temp cannot be parsed) and its DateKey, stripped strings and
+        the Name query.
+    """
+    data = reports.dropna(subset=["Year", "Place"]).copy()
+    data["Year"] = pd.to_numeric(data["Year"], errors="coerce")
+    data = data.dropna(subset=["Year"])
+    data["Year"] = data["Year"].astype(int)
+    for column in ["State", "Region", "Place"]:
+        data[column] = data[column].astype("string").str.strip()
+    data["Date_Temp"] = data["Date_Temp"].astype(str)
+    data["Date"] = parse_report_dates(data["Date_Temp"], data["Year"])
+    data["DateKey"] = date_key(data["Date"])
+    data["Name"] = place_names(data)
+    return data.drop_duplicates(subset=KEY_COLUMNS)
+
+
+def new_rows(data, store):
+    """Return the rows of data that are not in the store yet."""
+    frame = store.frame
+    existing = frame[["Year"]].astype(int)
+    # Stripped as in normalise
+    for column in ["State", "Region", "Place"]:
+        existing[column] = frame[column].astype("string").str.strip()
+    existing["DateKey"] = date_key(frame["Date"])
+    merged = data.merge(
+        existing[KEY_COLUMNS].drop_duplicates(),
+        on=KEY_COLUMNS,
+        how="left",
+        indicator=True,
+    )
+    return data[(merged["_merge"] == "left_only").to_numpy()]
+
+
+def locate(data, store, backend, cache, **kwargs):
+    """
+    Add Latitude/Longitude, geocoding only names the store does not have.
+
+    Inputs:
+        data (pd.DataFrame): New rows with a Name column.
+        store (IncidentStore): Coordinates of names already ingested are
+            reused from it.
+        backend, cache, **kwargs: See flood.geocode.geocode_names.
+
+    Returns:
+        pd.DataFrame
+    """
+    known = (
+        store.frame[["Name", "Latitude", "Longitude"]]
+        .astype({"Name": "string"})
+        .drop_duplicates("Name")
+        .set_index("Name")
+    )
+    data = data.copy()
+    data["Latitude"] = data["Name"].map(known["Latitude"]).astype(float)
+    data["Longitude"] = data["Name"].map(known["Longitude"]).astype(float)
+    unknown = data["Latitude"].isna()
+    if unknown.any():
+        located = geocode_frame(
+            data.loc[unknown, REPORT_COLUMNS + ["Name"]],
+            backend,
+            cache,
+            **kwargs,
+        )
+        data.loc[unknown, ["Latitude", "Longitude"]] = located[
+            ["Latitude", "Longitude"]
+        ].to_numpy()
+    return data
+
+
+def ingested_sources(csv_path=CSV_PATH):
+    """
+    Return the digests of the workbooks whose rows were all ingested.
+
+    A partition recorded with unlocated rows does not count, so the
+    workbook is read again by the next run.
+    """
+    manifest = read_manifest(partition_dir_for(csv_path))
+    return {
+        entry["source_sha256"]
+        for entry in manifest["partitions"]
+        if not entry.get("unlocated")
+    }
+
+
+def ingest(path, backend, cache, csv_path=CSV_PATH, dry_run=False, **kwargs):
+    """
+    Ingest a report workbook into the incident store.
+
+    Inputs:
+        path (str): .xlsx workbook of yearly reports.
+        backend: Geocoding backend (see flood.geocode).
+        cache (GeocodeCache): Geocode cache shared with flood.geocode.
+        csv_path (str): Geocoded incident CSV backing the store.
+        dry_run (bool): Report what would be ingested without writing.
+        **kwargs: Passed to flood.geocode.geocode_names.
+
+    Returns:
+        dict: Counts of read, new, located, unlocated and appended rows,
+        the 'unlocated_rows' (pd.DataFrame with REPORT_COLUMNS and Name,
+        None if there are none) and the manifest entry of the partition
+        (None if nothing was appended).
+    """
+    source_sha256 = file_digest(path)
+    summary = {
+        "read": 0,
+        "new": 0,
+        "located": 0,
+        "unlocated": 0,
+        "appended": 0,
+        "unlocated_rows": None,
+        "partition": None,
+    }
+    if source_sha256 in ingested_sources(csv_path):
+        return summary
+    store = get_store(csv_path)
+    chunks = []
+    for reports in read_reports(path):
+        data = normalise(reports)
+        summary["read"] += len(data)
+        chunks.append(new_rows(data, store))
+    data = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    data = data.drop_duplicates(subset=KEY_COLUMNS) if len(data) else data
+    summary["new"] = len(data)
+    if dry_run or data.empty:
+        return summary
+    data = locate(data, store, backend, cache, **kwargs)
+    unlocated = data["Latitude"].isna() | data["Longitude"].isna()
+    summary["located"] = int((~unlocated).sum())
+    summary["unlocated"] = int(unlocated.sum())
+    if unlocated.any():
+        summary["unlocated_rows"] = data.loc[
+            unlocated, REPORT_COLUMNS + ["Name"]
+        ].reset_index(drop=True)
+    # frame_to_table drops the unlocated rows; they are not in the store, so
+    # new_rows picks them up again on the next run
+    table = frame_to_table(data)
+    if table.num_rows == 0:
+        return summary
+    previous_digest = store.digest
+    entry, store = append_partition(
+        table,
+        os.path.basename(path),
+        source_sha256,
+        csv_path,
+        unlocated=summary["unlocated"],
+    )
+    # Fold the new rows into the statistics cube instead of rebuilding it
+    append_to_cube(
+        table.to_pandas(date_as_object=False), previous_digest, csv_path
+    )
+    summary["appended"] = table.num_rows
+    summary["partition"] = entry
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("workbook", help="Excel workbook of yearly reports")
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--user-agent", default="streamlit_floodv2")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--gazetteer",
+        help="Geocoded CSV (Name, Latitude, Longitude) to use instead of "
+        "Nominatim",
+    )
+    parser.add_argument(
+        "--unlocated", help="CSV to write the rows that could not be geocoded to"
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.gazetteer:
+        backend = GazetteerBackend(pd.read_csv(args.gazetteer))
+    else:
+        backend = NominatimBackend(args.user_agent)
+    cache = GeocodeCache(args.cache)
+    try:
+        summary = ingest(
+            args.workbook,
+            backend,
+            cache,
+            csv_path=args.csv,
+            dry_run=args.dry_run,
+            workers=args.workers,
+            verbose=True,
+        )
+    finally:
+        cache.close()
+    print(
+        f"{summary['read']} rows read, {summary['new']} new, "
+        f"{summary['located']} located, {summary['unlocated']} unlocated, "
+        f"{summary['appended']} appended"
+    )
+    if summary["partition"]:
+        print(f"partition {summary['partition']['file']}")
+    unlocated = summary["unlocated_rows"]
+    if unlocated is not None:
+        names = unlocated["Name"].value_counts()
+        print(
+            f"{len(unlocated)} rows ({len(names)} places) could not be "
+            "geocoded and were not ingested; run again to retry them"
+        )
+        if args.unlocated:
+            unlocated.to_csv(args.unlocated, index=False)
+            print(f"unlocated rows written to {args.unlocated}")
+        else:
+            for name, count in names.head(10).items():
+                print(f"  {name} ({count} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""Compact, NumPy-backed incident records.
+
+Every variant of the incident CSV in ``analytics/data2`` carries columns
+that only restate others: ``Name`` is Place/Region(/State) joined,
+``geometry`` is the coordinates as WKT, ``Date`` is a mangled copy of
+``Date_Temp``, ``Line Check`` is a constant and ``Location Returned Split``
+is ``Location Returned`` as a stringified list. IncidentRecords keeps one
+canonical set of columns instead:
+
+    year            int16
+    date            int32 days since 1970-01-01 (NAT_DAYS when unknown)
+    state, region,
+    place           integer codes into per-column category arrays
+    latitude,
+    longitude       float32 (NaN when not geocoded)
+    postal_code     int32 (0 when unknown)
+    location        integer codes of the reverse-geocoded address
+
+and rebuilds the redundant columns on demand.
+
+Usage:
+    python -m flood.records analytics/data2/Postal\\ Code.csv out.arrow
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from flood.store import parse_report_dates, write_table
+
+NAT_DAYS = np.iinfo(np.int32).min
+
+# Canonical columns of every CSV variant; the others are derived
+SOURCE_COLUMNS = [
+    "Year",
+    "Date_Temp",
+    "State",
+    "Region",
+    "Place",
+    "Latitude",
+    "Longitude",
+    "Postal Code",
+    "Location Returned",
+]
+
+def _encode(values):
+    """Return (codes, categories) with the smallest integer code type."""
+    codes, categories = pd.factorize(pd.Series(values), sort=True)
+    for dtype in (np.int8, np.int16, np.int32):
+        if len(categories) < np.iinfo(dtype).max:
+            break
+    return codes.astype(dtype), np.asarray(categories, dtype=object)
+
+
+class Incident:
+    """One incident, as returned when indexing IncidentRecords."""
+
+    __slots__ = (
+        "year",
+        "date",
+        "state",
+        "region",
+        "place",
+        "latitude",
+        "longitude",
+        "postal_code",
+        "location",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @property
+    def name(self):
+        return ", ".join(
+            part for part in (self.place, self.region, self.state) if part
+        )
+
+    def __repr__(self):
+        return (
+            f"Incident({self.name!r}, {self.date}, "
+            f"{self.latitude}, {self.longitude})"
+        )
+
+
+class IncidentRecords:
+    """
+    Incidents as parallel NumPy columns.
+
+    Build with from_frame or read_csv rather than directly.
+
+    Inputs:
+        year, date, latitude, longitude, postal_code (np.ndarray): Columns.
+        codes (dict): state/region/place/location -> integer codes (-1 for
+            missing).
+        categories (dict): Same keys -> object array of the strings.
+    """
+
+    __slots__ = (
+        "year",
+        "date",
+        "latitude",
+        "longitude",
+        "postal_code",
+        "codes",
+        "categories",
+    )
+
+    def __init__(
+        self, year, date, latitude, longitude, postal_code, codes, categories
+    ):
+        self.year = year
+        self.date = date
+        self.latitude = latitude
+        self.longitude = longitude
+        self.postal_code = postal_code
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    def from_frame(cls, data):
+        """
+        Convert any incident frame variant.
+
+        Inputs:
+            data (pd.DataFrame): Incidents with at least Year, Date_Temp,
+                State, Region and Place. Latitude/Longitude, Postal Code and
+                Location Returned are used when present.
+
+        Returns:
+            IncidentRecords
+        """
+        n = len(data)
+        year = data["Year"].astype(int)
+        dates = parse_report_dates(data["Date_Temp"], year)
+        days = dates.to_numpy("datetime64[D]").astype(np.int64)
+        days[dates.isna().to_numpy()] = NAT_DAYS
+
+        def column(name, dtype, fill):
+            if name not in data:
+                return np.full(n, fill, dtype=dtype)
+            return data[name].fillna(fill).to_numpy().astype(dtype)
+
+        codes, categories = {}, {}
+        sources = {
+            "state": "State",
+            "region": "Region",
+            "place": "Place",
+            "location": "Location Returned",
+        }
+        for key, name in sources.items():
+            values = data[name] if name in data else pd.Series([None] * n)
+            codes[key], categories[key] = _encode(values.to_numpy())
+        return cls(
+            year=year.to_numpy().astype(np.int16),
+            date=days.astype(np.int32),
+            latitude=column("Latitude", np.float32, np.nan),
+            longitude=column("Longitude", np.float32, np.nan),
+            postal_code=column("Postal Code", np.int32, 0),
+            codes=codes,
+            categories=categories,
+        )
+
+    @classmethod
+    def read_csv(cls, path):
+        """Read only the canonical columns of any CSV variant."""
+        data = pd.read_csv(
+            path,
+            usecols=lambda name: name in SOURCE_COLUMNS,
+            dtype={
+                "State": "category",
+                "Region": "category",
+                "Place": "category",
+                "Location Returned": "category",
+            },
+        )
+        return cls.from_frame(data.dropna(subset=["Year"]))
+
+    def __len__(self):
+        return len(self.year)
+
+    @property
+    def nbytes(self):
+        """Memory held by the columns and their categories."""
+        arrays = [
+            self.year,
+            self.date,
+            self.latitude,
+            self.longitude,
+            self.postal_code,
+        ] + list(self.codes.values())
+        strings = sum(
+            len(value.encode())
+            for values in self.categories.values()
+            for value in values
+        )
+        return sum(a.nbytes for a in arrays) + strings
+
+    def strings(self, key):
+        """Decode a categorical column to an object array (None if missing)."""
+        codes = self.codes[key]
+        values = np.append(self.categories[key], None)
+        return values[np.where(codes < 0, len(values) - 1, codes)]
+
+    def dates(self):
+        """Return the dates as datetime64[D] (NaT when unknown)."""
+        days = self.date.astype("datetime64[D]")
+        days[self.date == NAT_DAYS] = np.datetime64("NaT")
+        return days
+
+    def names(self):
+        """Rebuild the 'Place, Region, State' Name column."""
+        return (
+            pd.Series(self.strings("place"), dtype="string")
+            .str.cat(
+                [
+                    pd.Series(self.strings("region"), dtype="string"),
+                    pd.Series(self.strings("state"), dtype="string"),
+                ],
+                sep=", ",
+                na_rep="",
+            )
+            .str.replace(r"(, )+$", "", regex=True)
+            .to_numpy(dtype=object)
+        )
+
+    def __getitem__(self, i):
+        def category(key):
+            code = self.codes[key][i]
+            return None if code < 0 else self.categories[key][code]
+
+        return Incident(
+            year=int(self.year[i]),
+            date=(
+                None
+                if self.date[i] == NAT_DAYS
+                else np.datetime64(int(self.date[i]), "D").item()
+            ),
+            state=category("state"),
+            region=category("region"),
+            place=category("place"),
+            latitude=float(self.latitude[i]),
+            longitude=float(self.longitude[i]),
+            postal_code=int(self.postal_code[i]) or None,
+            location=category("location"),
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _categorical(self, key):
+        return pd.Categorical.from_codes(self.codes[key], self.categories[key])
+
+    def to_frame(self):
+        """
+        Return a pandas frame with the column names of the CSV files.
+        """
+        return pd.DataFrame(
+            {
+                "Year": self.year,
+                "Date": self.dates(),
+                "State": self._categorical("state"),
+                "Region": self._categorical("region"),
+                "Place": self._categorical("place"),
+                "Latitude": self.latitude,
+                "Longitude": self.longitude,
+                "Postal Code": self.postal_code,
+                "Location Returned": self._categorical("location"),
+            }
+        )
+
+    def to_table(self):
+        """Return an Arrow table with dictionary-encoded strings."""
+
+        def dictionary(key):
+            codes = self.codes[key]
+            return pa.DictionaryArray.from_arrays(
+                pa.array(codes, mask=codes < 0),
+                pa.array(self.categories[key], type=pa.string()),
+            )
+
+        return pa.table(
+            {
+                "Year": self.year,
+                "Date": pa.array(self.date, mask=self.date == NAT_DAYS).cast(
+                    pa.date32()
+                ),
+                "State": dictionary("state"),
+                "Region": dictionary("region"),
+                "Place": dictionary("place"),
+                "Latitude": self.latitude,
+                "Longitude": self.longitude,
+                "Postal Code": self.postal_code,
+                "Location Returned": dictionary("location"),
+            }
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert an incident CSV variant to a compact Arrow file."
+    )
+    parser.add_argument("csv")
+    parser.add_argument("output")
+    args = parser.parse_args()
+    records = IncidentRecords.read_csv(args.csv)
+    write_table(records.to_table(), args.output)
+    print(f"{len(records)} incidents, {records.nbytes / 1e6:.2f} MB in memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""Background render jobs of the Timelapse page.
+
+geemap's timelapse functions download every frame and encode the GIF (and
+MP4) in the calling thread, which used to be the Streamlit script thread:
+a long Landsat series blocked the session, and submitting the same form
+twice rendered everything again into a fresh temporary file.
+
+Renders now run on a small pool of worker processes. Each job is keyed by
+a hash of its canonical parameters (function, arguments, ROI GeoJSON,
+post-processing), its outputs are stored under that key, and identical
+jobs share one render whether it is queued, running or done. The page only
+submits a job and polls its status.
+
+The GIF post-processing of geemap (texts, progress bar, colorbar, size
+reduction, fading and MP4) is applied by flood.frames in a single
+streaming pass once the frames are downloaded.
+
+Heavy renders (see flood.costs) wait for an admission slot in a thread of
+the server before they reach the pool, so they are reported as queued and
+cannot take every worker from the lighter renders.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flood.costs import admission
+from flood.frames import streamed
+
+RENDER_DIR = os.path.join(tempfile.gettempdir(), "flood_timelapse")
+RENDER_WORKERS = 2
+# Rendered files are deleted, oldest first, above this total size
+RENDER_CACHE_BYTES = 2 * 1024**3
+TOKEN_NAME = "EARTHENGINE_TOKEN"
+# Failed jobs are reported for this long, then forgotten
+JOB_TTL = 60 * 60
+
+# Placeholders replaced in the worker by the ee.FeatureCollection of the
+# ROI and by the output path
+ROI = "__roi__"
+OUT_GIF = "__out_gif__"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+RenderStatus = namedtuple(
+    "RenderStatus", ["state", "gif", "mp4", "error", "elapsed", "notice"]
+)
+# Notice of a render asked for an MP4 that was not written
+NO_MP4 = "The MP4 could not be created: ffmpeg is not installed on the server."
+
+
+class RenderError(Exception):
+    """A render finished without writing a timelapse."""
+
+
+def roi_geojson(gdf):
+    """Return the geometries of an ROI GeoDataFrame as a GeoJSON dict."""
+    return json.loads(gdf.geometry.to_crs(epsg=4326).to_json())
+
+
+def render_key(function, args=(), kwargs=None, roi=None, reduce=False):
+    """Return the hash of the canonical parameters of a render."""
+    payload = json.dumps(
+        [function, list(args), kwargs or {}, roi, reduce],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _init_worker(token_name):
+    import geemap.foliumap as geemap
+
+    geemap.ee_initialize(token_name=token_name)
+
+
+def _render(function, args, kwargs, roi, reduce, directory, key):
+    """Run one geemap timelapse function in a worker process."""
+    import geemap.foliumap as geemap
+
+    region = None if roi is None else geemap.geojson_to_ee(roi, geodesic=False)
+    partial = os.path.join(directory, f"{key}.{os.getpid()}.part.gif")
+
+    def substitute(value):
+        if isinstance(value, str):
+            if value == ROI:
+                return region
+            if value == OUT_GIF:
+                return partial
+        return value
+
+    function = getattr(geemap, function)
+    with streamed(function) as pipeline:
+        function(
+            *[substitute(value) for value in args],
+            **{name: substitute(value) for name, value in kwargs.items()},
+        )
+    if not os.path.exists(partial):
+        raise RenderError("No images matched the timelapse parameters.")
+    if reduce:
+        pipeline.reduce_gif_size(partial)
+    pipeline.run()
+    partial_mp4 = partial.replace(".gif", ".mp4")
+    if os.path.exists(partial_mp4):
+        os.replace(partial_mp4, os.path.join(directory, f"{key}.mp4"))
+    elif kwargs.get("mp4"):
+        with open(os.path.join(directory, f"{key}.txt"), "w") as file:
+            if pipeline.mp4_error is None:
+                file.write(NO_MP4)
+            else:
+                file.write(f"The MP4 could not be created: {pipeline.mp4_error}")
+    # The GIF is moved last: its presence marks a complete render
+    os.replace(partial, os.path.join(directory, f"{key}.gif"))
+
+
+class RenderQueue:
+    """
+    Content-addressed timelapse renders on a pool of worker processes.
+
+    Inputs:
+        directory (str): Where rendered GIF/MP4 files are kept.
+        workers (int): Renders running at the same time; more are queued.
+        max_bytes (int): Size of the rendered files above which the least
+            recently used ones are deleted.
+        token_name (str): Environment variable with the Earth Engine token
+            the workers initialise with.
+    """
+
+    def __init__(
+        self,
+        directory=RENDER_DIR,
+        workers=RENDER_WORKERS,
+        max_bytes=RENDER_CACHE_BYTES,
+        token_name=TOKEN_NAME,
+    ):
+        self.directory = directory
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.token_name = token_name
+        self._pool = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            # Workers are spawned: forking the threaded Streamlit server is
+            # not safe
+            self._pool = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.token_name,),
+            )
+        return self._pool
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def submit(
+        self, function, args=(), kwargs=None, roi=None, reduce=False, cost=None
+    ):
+        """
+        Queue a render unless the same one is cached, queued or running.
+
+        Inputs:
+            function (str): Name of a geemap timelapse function.
+            args (list), kwargs (dict): Its arguments, JSON-serialisable;
+                use ROI and OUT_GIF where the ROI and the output path go.
+            roi (dict): ROI GeoJSON (see roi_geojson), or None.
+            reduce (bool): Optimize the GIF even when function adds no
+                overlay to it.
+            cost (CostEstimate): Of the render; heavy renders wait for
+                flood.costs.admission.
+
+        Returns:
+            str: Key of the job, to pass to status.
+        """
+        kwargs = kwargs or {}
+        key = render_key(function, args, kwargs, roi, reduce)
+        if os.path.exists(self.path(key, "gif")):
+            return key
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not (
+                job[0].done() and job[0].exception() is not None
+            ):
+                return key
+            os.makedirs(self.directory, exist_ok=True)
+            self._forget()
+            self._purge()
+            arguments = (
+                _render,
+                function,
+                list(args),
+                kwargs,
+                roi,
+                reduce,
+                self.directory,
+                key,
+            )
+            if cost is not None and cost.heavy:
+                future = Future()
+                threading.Thread(
+                    target=self._admit, args=(future, arguments, cost), daemon=True
+                ).start()
+            else:
+                future = self._submit(arguments)
+            self._jobs[key] = (future, time.monotonic())
+        return key
+
+    def _submit(self, arguments):
+        """Submit a render to the pool; call with the lock held."""
+        try:
+            return self._executor().submit(*arguments)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a new pool
+            self._pool = None
+            return self._executor().submit(*arguments)
+
+    def _admit(self, future, arguments, cost):
+        """Run a heavy render once admitted, reporting it through future."""
+        with admission.admit(cost):
+            future.set_running_or_notify_cancel()
+            try:
+                with self._lock:
+                    job = self._submit(arguments)
+                future.set_result(job.result())
+            except BaseException as error:
+                future.set_exception(error)
+
+    def status(self, key):
+        """
+        Return the RenderStatus of a job, or None for an unknown key.
+        """
+        gif = self.path(key, "gif")
+        if os.path.exists(gif):
+            # Rendered files are evicted least recently used first
+            os.utime(gif)
+            mp4 = self.path(key, "mp4")
+            return RenderStatus(
+                DONE,
+                gif,
+                mp4 if os.path.exists(mp4) else None,
+                None,
+                0.0,
+                self._notice(key),
+            )
+        with self._lock:
+            job = self._jobs.get(key)
+        if job is None:
+            return None
+        future, submitted = job
+        elapsed = time.monotonic() - submitted
+        if not future.done():
+            state = RUNNING if future.running() else QUEUED
+            return RenderStatus(state, None, None, None, elapsed, None)
+        error = future.exception()
+        if error is None:
+            # Finished but the files were purged in the meantime
+            return None
+        return RenderStatus(FAILED, None, None, str(error), elapsed, None)
+
+    def _notice(self, key):
+        """Return the notice a worker left about a render, or None."""
+        try:
+            with open(self.path(key, "txt")) as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def _forget(self):
+        """Drop finished jobs: their files, or their error once old."""
+        now = time.monotonic()
+        for key, (future, submitted) in list(self._jobs.items()):
+            if future.done() and (
+                future.exception() is None or now - submitted > JOB_TTL
+            ):
+                del self._jobs[key]
+
+    def _purge(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if ".part." in path:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+render_queue = RenderQueue()
@@ -0,0 +1,175 @@
+"""Offline reverse geocoding of incidents against local boundary polygons.
+
+Replaces the per-row ``geocoder.osm(..., method='reverse')`` calls of
+``analytics/reverse_geocode.ipynb`` and the address-string splitting of
+``Postal Code.ipynb``. A polygon layer (postcode, mukim or district
+boundaries) is loaded once into a shapely STRtree and all incident points
+are matched against it in one vectorised query. The attributes of the
+matching polygons are written back as columns of the incident store.
+
+Usage:
+    python -m flood.reverse_geocode postcodes.gpkg --field postcode:Postal_Code
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+from flood.store import CSV_PATH, add_columns, get_store
+
+
+class AdminLayer:
+    """
+    Boundary polygons with an STRtree for point lookups.
+
+    Inputs:
+        polygons (gpd.GeoDataFrame): Boundaries in any CRS; they are
+            reprojected to EPSG:4326.
+        fields (list): Attribute columns to return for matching points.
+    """
+
+    def __init__(self, polygons, fields):
+        if polygons.crs is not None and polygons.crs.to_epsg() != 4326:
+            polygons = polygons.to_crs(epsg=4326)
+        missing = [field for field in fields if field not in polygons]
+        if missing:
+            raise KeyError(f"fields not in the boundary layer: {missing}")
+        self.fields = list(fields)
+        self.attributes = polygons[self.fields].reset_index(drop=True)
+        self.geometries = np.asarray(polygons.geometry.values)
+        self.areas = shapely.area(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+    @classmethod
+    def read(cls, path, fields, **kwargs):
+        """Load a boundary layer from any file geopandas can read."""
+        import geopandas as gpd
+
+        return cls(gpd.read_file(path, **kwargs), fields)
+
+    def match(self, longitude, latitude, max_distance=None):
+        """
+        Return the index of the polygon containing each point.
+
+        Points on shared borders or in overlapping polygons go to the
+        smallest polygon. Points outside every polygon (e.g. geocoded just
+        offshore) go to the nearest polygon within max_distance degrees, or
+        get -1.
+
+        Inputs:
+            longitude (array): Point longitudes.
+            latitude (array): Point latitudes.
+            max_distance (float): Nearest-polygon fallback distance in
+                degrees, None to disable.
+
+        Returns:
+            np.ndarray of polygon positions, -1 where unmatched.
+        """
+        points = shapely.points(
+            np.asarray(longitude, dtype=np.float64),
+            np.asarray(latitude, dtype=np.float64),
+        )
+        matched = np.full(len(points), -1, dtype=np.int64)
+        point_idx, polygon_idx = self.tree.query(points, predicate="intersects")
+        if len(point_idx):
+            # Smallest polygon first, then keep the first hit of each point
+            order = np.lexsort((self.areas[polygon_idx], point_idx))
+            point_idx, polygon_idx = point_idx[order], polygon_idx[order]
+            first = np.unique(point_idx, return_index=True)[1]
+            matched[point_idx[first]] = polygon_idx[first]
+        if max_distance:
+            unmatched = np.flatnonzero(matched < 0)
+            if len(unmatched):
+                point_idx, polygon_idx = self.tree.query_nearest(
+                    points[unmatched], max_distance=max_distance
+                )
+                first = np.unique(point_idx, return_index=True)[1]
+                matched[unmatched[point_idx[first]]] = polygon_idx[first]
+        return matched
+
+    def assign(self, longitude, latitude, max_distance=None):
+        """
+        Return the layer attributes for each point.
+
+        Inputs:
+            longitude (array): Point longitudes.
+            latitude (array): Point latitudes.
+            max_distance (float): See match.
+
+        Returns:
+            pd.DataFrame with one row per point and one column per field
+            (missing values where no polygon matched).
+        """
+        matched = self.match(longitude, latitude, max_distance)
+        found = matched >= 0
+        result = pd.DataFrame(
+            index=pd.RangeIndex(len(matched)), columns=self.fields, dtype=object
+        )
+        result.loc[found, self.fields] = (
+            self.attributes.iloc[matched[found]].to_numpy()
+        )
+        return result
+
+
+def enrich_store(layer, columns=None, max_distance=0.01, csv_path=CSV_PATH):
+    """
+    Reverse geocode every incident and save the result in the store.
+
+    Inputs:
+        layer (AdminLayer): Boundary polygons.
+        columns (dict): Layer field -> store column name. Defaults to the
+            layer field names.
+        max_distance (float): See AdminLayer.match.
+        csv_path (str): Geocoded incident CSV backing the store.
+
+    Returns:
+        IncidentStore: The updated store.
+    """
+    columns = columns or {field: field for field in layer.fields}
+    frame = get_store(csv_path).frame
+    assigned = layer.assign(
+        frame["Longitude"], frame["Latitude"], max_distance=max_distance
+    )
+    return add_columns(
+        {
+            name: assigned[field].astype("string").to_numpy(
+                dtype=object, na_value=None
+            )
+            for field, name in columns.items()
+        },
+        csv_path=csv_path,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("boundaries", help="Boundary polygon file")
+    parser.add_argument(
+        "--field",
+        action="append",
+        required=True,
+        help="Layer field to copy, optionally renamed as FIELD:COLUMN",
+    )
+    parser.add_argument(
+        "--max-distance",
+        type=float,
+        default=0.01,
+        help="Nearest polygon fallback in degrees (0 to disable)",
+    )
+    args = parser.parse_args(argv)
+
+    columns = dict(
+        field.split(":", 1) if ":" in field else (field, field)
+        for field in args.field
+    )
+    layer = AdminLayer.read(args.boundaries, list(columns))
+    store = enrich_store(layer, columns, max_distance=args.max_distance)
+    for name in columns.values():
+        share = store.frame[name].notna().mean() * 100
+        print(f"{name}: {share:.1f}% of incidents assigned")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Preparation of timelapse ROIs before they are sent to Earth Engine.
+
+An uploaded administrative boundary can carry hundreds of thousands of
+vertices. They were all embedded in every Earth Engine request by
+geemap.gdf_to_ee, slowing down the server-side clipping of every frame,
+and a render that asked for too many pixels only failed at the end with
+"you probably requested too much data".
+
+prepare_roi repairs invalid geometries and simplifies the ROI with a
+tolerance of half an output pixel, so the timelapse looks the same. The
+cost of a render (pixels per frame times frames) is estimated before it is
+submitted; fit_dimensions shrinks the output size of renders above
+MAX_PIXEL_FRAMES, and refuses those that would still be above it at
+MIN_DIMENSIONS.
+"""
+import math
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# Vertices sent to Earth Engine at most; the tolerance is doubled until the
+# simplified ROI is below
+MAX_VERTICES = 5_000
+MAX_SIMPLIFY_STEPS = 6
+# Pixels of all the frames of a render above which Earth Engine times out
+MAX_PIXEL_FRAMES = 768 * 768 * 150
+MIN_DIMENSIONS = 256
+# Length of a frame period in days
+FREQUENCY_DAYS = {
+    "year": 365.25,
+    "quarter": 365.25 / 4,
+    "month": 365.25 / 12,
+    "week": 7,
+    "day": 1,
+}
+
+RoiReport = namedtuple(
+    "RoiReport", ["vertices", "simplified_vertices", "repaired", "tolerance"]
+)
+
+
+def vertex_count(geometries):
+    """Return the number of vertices of an array of geometries."""
+    return int(shapely.get_num_coordinates(np.asarray(geometries)).sum())
+
+
+def prepare_roi(gdf, dimensions=768, max_vertices=MAX_VERTICES):
+    """
+    Repair and simplify an ROI for Earth Engine.
+
+    Inputs:
+        gdf (gpd.GeoDataFrame): ROI, in any CRS.
+        dimensions (int): Longest side of the timelapse in pixels; the
+            simplification tolerance is half a pixel at this size.
+        max_vertices (int): Vertices above which the tolerance is doubled.
+
+    Returns:
+        (gpd.GeoDataFrame, RoiReport): ROI in EPSG:4326, and what was done.
+    """
+    gdf = gdf.to_crs(epsg=4326)
+    geometries = np.asarray(gdf.geometry.values)
+    vertices = vertex_count(geometries)
+    invalid = ~shapely.is_valid(geometries)
+    if invalid.any():
+        # make_valid can leave slivers as lines next to the polygons
+        geometries[invalid] = shapely.buffer(
+            shapely.make_valid(geometries[invalid]), 0
+        )
+    west, south, east, north = shapely.total_bounds(geometries)
+    tolerance = float(max(east - west, north - south)) / dimensions / 2
+    simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    for _ in range(MAX_SIMPLIFY_STEPS):
+        if vertex_count(simplified) <= max_vertices:
+            break
+        tolerance *= 2
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    gdf = gdf.set_geometry(simplified, crs="EPSG:4326")
+    gdf = gdf[~gdf.geometry.is_empty]
+    return gdf, RoiReport(
+        vertices, vertex_count(simplified), int(invalid.sum()), tolerance
+    )
+
+
+def thumbnail_size(bounds, dimensions=768):
+    """
+    Return the (width, height) in pixels of a Web Mercator thumbnail.
+
+    Inputs:
+        bounds (tuple): (west, south, east, north) in EPSG:4326.
+        dimensions (int): Longest side in pixels.
+    """
+    west, south, east, north = bounds
+
+    def mercator_y(latitude):
+        latitude = math.radians(max(min(latitude, 85.0), -85.0))
+        return math.log(math.tan(math.pi / 4 + latitude / 2))
+
+    width = math.radians(east - west)
+    height = mercator_y(north) - mercator_y(south)
+    if width <= 0 or height <= 0:
+        return dimensions, dimensions
+    scale = dimensions / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def frame_count(start, end, frequency="year"):
+    """
+    Return the number of frames between two dates.
+
+    Inputs:
+        start, end (str or datetime): Date range.
+        frequency (str or float): "year", "quarter", "month", "week", "day",
+            or the length of a frame period in days.
+    """
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).total_seconds() / 86400
+    period = FREQUENCY_DAYS.get(frequency, frequency)
+    return max(1, math.floor(days / float(period)) + 1)
+
+
+def fit_dimensions(
+    bounds,
+    frames,
+    dimensions=768,
+    max_pixel_frames=MAX_PIXEL_FRAMES,
+    min_dimensions=MIN_DIMENSIONS,
+):
+    """
+    Return the largest output size up to dimensions a render can afford.
+
+    Returns:
+        int, or None when even min_dimensions is too expensive.
+    """
+    width, height = thumbnail_size(bounds, dimensions)
+    cost = width * height * frames
+    if cost <= max_pixel_frames:
+        return dimensions
+    fitted = int(dimensions * math.sqrt(max_pixel_frames / cost))
+    if fitted < min_dimensions:
+        return None
+    return fitted
@@ -0,0 +1,531 @@
+"""Columnar store for the geocoded flood incidents.
+
+The pages used to call ``pd.read_csv`` on the geocoded CSV on every rerun.
+This module converts the CSV once into an uncompressed Arrow IPC file with
+compact column types, memory-maps it and hands every page the same
+process-wide handle.
+
+Years ingested later (see flood.ingest) are kept as partitions next to the
+CSV, listed with their content hashes in a manifest; the store is the CSV
+plus every partition.
+"""
+import datetime as dt
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from flood.year_index import YearIndex
+
+CSV_PATH = "analytics/data2/all_states_all_years_geocoded.csv"
+MANIFEST = "manifest.json"
+
+# Bump when the columns or their types change so old stores get rebuilt
+SCHEMA_VERSION = "2"
+
+SCHEMA = pa.schema(
+    [
+        ("Year", pa.int16()),
+        ("Date", pa.date32()),
+        ("State", pa.dictionary(pa.int8(), pa.string())),
+        ("Region", pa.dictionary(pa.int16(), pa.string())),
+        ("Place", pa.dictionary(pa.int16(), pa.string())),
+        ("Name", pa.dictionary(pa.int16(), pa.string())),
+        ("Latitude", pa.float32()),
+        ("Longitude", pa.float32()),
+    ],
+    metadata={"schema_version": SCHEMA_VERSION},
+)
+
+_MONTHS = {
+    name: number
+    for number, name in enumerate(
+        [
+            "jan",
+            "feb",
+            "mar",
+            "apr",
+            "may",
+            "jun",
+            "jul",
+            "aug",
+            "sep",
+            "oct",
+            "nov",
+            "dec",
+        ],
+        start=1,
+    )
+}
+# Excel day serials count from 1899-12-30
+_EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+
+def store_path_for(csv_path):
+    """Return the path of the Arrow store that mirrors a CSV file."""
+    return os.path.splitext(csv_path)[0] + ".arrow"
+
+
+def partition_dir_for(csv_path):
+    """Return the directory of the partitions ingested next to a CSV file."""
+    return os.path.join(os.path.dirname(csv_path), "partitions")
+
+
+PARTITION_DIR = partition_dir_for(CSV_PATH)
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _parse_one_date(text, year):
+    """
+    Parse a single report date string.
+
+    Inputs:
+        text (str): Day and month as typed in the yearly report, e.g. '22/9',
+            '1-Mar', '27.2', '3-7/01' (a range, the first day is kept),
+            '26 /1' or an Excel serial such as '43477/'. Numeric values are
+            read day first unless the second number cannot be a month
+            ('3/24' is a '24-Mar' Excel turned into month/day).
+        year (int): Year of the report.
+
+    Returns:
+        pd.Timestamp, or pd.NaT if the string cannot be understood.
+    """
+    text = str(text).strip().replace(" ", "")
+    match = re.fullmatch(r"(\d{5})/?", text)
+    if match:
+        return _EXCEL_EPOCH + pd.Timedelta(days=int(match.group(1)))
+    match = re.fullmatch(r"(\d{1,2})-([A-Za-z]{3})[A-Za-z]*", text)
+    if match:
+        day, month = int(match.group(1)), _MONTHS.get(match.group(2).lower())
+    else:
+        match = re.fullmatch(r"(\d{1,2})(?:-\d{1,2})?[/.](\d{1,2})", text)
+        if not match:
+            return pd.NaT
+        day, month = int(match.group(1)), int(match.group(2))
+        if month > 12 >= day:
+            day, month = month, day
+    try:
+        return pd.Timestamp(year=int(year), month=month, day=day)
+    except (TypeError, ValueError):
+        return pd.NaT
+
+
+def parse_report_dates(date_temp, year):
+    """
+    Normalise the mixed ``Date_Temp`` formats into proper dates.
+
+    Neither column is consistent: depending on how Excel mangled the cell,
+    ``Date`` is month/day/year or day/month/year, and a numeric
+    ``Date_Temp`` is day/month ('24/1') or month/day (a '1-Mar' saved as
+    '3/1'). Dates are rebuilt from ``Date_Temp`` day first, which is right
+    for most rows but swaps day and month of the month/day ones where both
+    are 12 or less; compare dates with date_key when that matters. Each
+    distinct (text, year) pair is parsed only once.
+
+    Inputs:
+        date_temp (pd.Series): Raw ``Date_Temp`` values.
+        year (pd.Series): Report year of each row.
+
+    Returns:
+        pd.Series of datetime64 values (NaT where unparseable).
+    """
+    keys = pd.MultiIndex.from_arrays(
+        [date_temp.astype(str).to_numpy(), year.astype(int).to_numpy()]
+    )
+    unique = keys.unique()
+    parsed = pd.Series(
+        [_parse_one_date(text, yr) for text, yr in unique], index=unique
+    )
+    return pd.Series(
+        pd.to_datetime(parsed.reindex(keys).to_numpy()), index=date_temp.index
+    )
+
+
+def date_key(dates):
+    """
+    Return the day and month of dates as a key ignoring their order.
+
+    The same incident can be parsed as 1 March from '1-Mar' and as 3 January
+    from '3/1' (see parse_report_dates); both give the key 103.
+
+    Inputs:
+        dates (pd.Series): Dates or datetime64 values.
+
+    Returns:
+        pd.Series of int, -1 where the date is missing.
+    """
+    dates = pd.to_datetime(dates)
+    day, month = dates.dt.day, dates.dt.month
+    key = np.minimum(day, month) * 100 + np.maximum(day, month)
+    return key.fillna(-1).astype(int)
+
+
+def frame_to_table(data):
+    """
+    Convert a raw incident frame (as read from the CSV) to an Arrow table.
+
+    Inputs:
+        data (pd.DataFrame): Incidents with at least Year, Date_Temp, State,
+            Region, Place, Name, Latitude and Longitude columns.
+
+    Returns:
+        pa.Table following SCHEMA, sorted by Year (see YearIndex).
+    """
+    data = data.dropna(subset=["Year", "Latitude", "Longitude"])
+    data = data.sort_values("Year", kind="stable")
+    year = data["Year"].astype(int)
+    columns = {
+        "Year": year.astype(np.int16),
+        "Date": parse_report_dates(data["Date_Temp"], year).dt.date,
+        "State": data["State"].astype("category"),
+        "Region": data["Region"].astype("category"),
+        "Place": data["Place"].astype("category"),
+        "Name": data["Name"].astype("category"),
+        "Latitude": data["Latitude"].astype(np.float32),
+        "Longitude": data["Longitude"].astype(np.float32),
+    }
+    frame = pd.DataFrame(columns).reset_index(drop=True)
+    return pa.Table.from_pandas(frame, schema=SCHEMA, preserve_index=False)
+
+
+def write_table(table, store_path):
+    """Write an Arrow table to an IPC file atomically."""
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, store_path)
+
+
+def concat_by_year(tables):
+    """
+    Concatenate tables and stable-sort the rows by Year, as YearIndex
+    expects. Dictionaries are unified, since an IPC file holds a single
+    dictionary per column.
+    """
+    table = pa.concat_tables(tables, promote_options="default")
+    table = table.unify_dictionaries().combine_chunks()
+    table = table.take(pc.sort_indices(table, [("Year", "ascending")]))
+    return table.replace_schema_metadata(tables[0].schema.metadata)
+
+
+def read_manifest(partition_dir=PARTITION_DIR):
+    """Return the partition manifest ({'partitions': [...]})."""
+    path = os.path.join(partition_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {"partitions": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest, partition_dir):
+    path = os.path.join(partition_dir, MANIFEST)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_partitions(partition_dir=PARTITION_DIR):
+    """
+    Read every partition listed in the manifest.
+
+    Raises ValueError if a partition file does not match its recorded hash.
+
+    Returns:
+        list of pa.Table
+    """
+    tables = []
+    for entry in read_manifest(partition_dir)["partitions"]:
+        path = os.path.join(partition_dir, entry["file"])
+        if file_digest(path) != entry["sha256"]:
+            raise ValueError(f"partition {path} does not match its manifest")
+        with pa.memory_map(path) as source:
+            tables.append(ipc.open_file(source).read_all())
+    return tables
+
+
+def write_partition(
+    table, source, source_sha256, partition_dir=PARTITION_DIR, **details
+):
+    """
+    Add a partition of new incidents.
+
+    The partition file is written first and the manifest replaced
+    atomically afterwards, so a crash leaves at most an unlisted file.
+
+    Inputs:
+        table (pa.Table): Incidents following SCHEMA.
+        source (str): Name of the file the incidents came from.
+        source_sha256 (str): Digest of that file.
+        partition_dir (str): Partition directory.
+        **details: Extra fields of the manifest entry.
+
+    Returns:
+        dict: The manifest entry of the partition.
+    """
+    os.makedirs(partition_dir, exist_ok=True)
+    table = concat_by_year([table.cast(SCHEMA)])
+    tmp_path = os.path.join(partition_dir, f"partition.{os.getpid()}.tmp")
+    write_table(table, tmp_path)
+    digest = file_digest(tmp_path)
+    name = f"part-{digest[:16]}.arrow"
+    os.replace(tmp_path, os.path.join(partition_dir, name))
+    entry = {
+        "file": name,
+        "sha256": digest,
+        "rows": table.num_rows,
+        "years": sorted(set(table.column("Year").to_pylist())),
+        "source": source,
+        "source_sha256": source_sha256,
+        "created": dt.datetime.now().isoformat(timespec="seconds"),
+        **details,
+    }
+    manifest = read_manifest(partition_dir)
+    manifest["partitions"].append(entry)
+    _write_manifest(manifest, partition_dir)
+    return entry
+
+
+def build_store(csv_path=CSV_PATH, store_path=None, partition_dir=None):
+    """
+    Convert the incident CSV and the ingested partitions into the Arrow store.
+
+    Inputs:
+        csv_path (str): Geocoded incident CSV.
+        store_path (str): Output file, defaults to the CSV path with an
+            '.arrow' suffix.
+        partition_dir (str): Partitions added by flood.ingest, defaults to
+            the one next to the CSV (see partition_dir_for).
+
+    Returns:
+        str: Path of the written store.
+    """
+    store_path = store_path or store_path_for(csv_path)
+    partition_dir = partition_dir or partition_dir_for(csv_path)
+    data = pd.read_csv(
+        csv_path,
+        usecols=[
+            "Year",
+            "Date_Temp",
+            "State",
+            "Region",
+            "Place",
+            "Name",
+            "Latitude",
+            "Longitude",
+        ],
+    )
+    table = frame_to_table(data)
+    partitions = read_partitions(partition_dir)
+    if partitions:
+        table = concat_by_year([table] + partitions)
+    write_table(table, store_path)
+    return store_path
+
+
+def _is_stale(csv_path, store_path):
+    if not os.path.exists(store_path):
+        return True
+    partition_dir = partition_dir_for(csv_path)
+    store_mtime = os.path.getmtime(store_path)
+    for path in (csv_path, os.path.join(partition_dir, MANIFEST)):
+        if os.path.exists(path) and os.path.getmtime(path) > store_mtime:
+            return True
+    with pa.memory_map(store_path) as source:
+        metadata = ipc.open_file(source).schema.metadata or {}
+    return metadata.get(b"schema_version") != SCHEMA_VERSION.encode()
+
+
+class IncidentStore:
+    """Read-only, memory-mapped view of the incident store.
+
+    The Arrow table points straight into the mapped file. The pandas frame is
+    materialised once on first use and then shared by every session, so
+    callers must treat it as read-only (select or copy before modifying).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.digest = file_digest(path)
+        self._source = pa.memory_map(path)
+        self.table = ipc.open_file(self._source).read_all()
+        self._frame = None
+        self._year_index = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def frame(self):
+        """Return the shared pandas view of the store."""
+        if self._frame is None:
+            with self._lock:
+                if self._frame is None:
+                    self._frame = self.table.to_pandas(date_as_object=False)
+        return self._frame
+
+    @property
+    def year_index(self):
+        """Return the shared YearIndex over the frame."""
+        if self._year_index is None:
+            frame = self.frame
+            with self._lock:
+                if self._year_index is None:
+                    self._year_index = YearIndex(frame)
+        return self._year_index
+
+    def years(self):
+        """Return the sorted distinct years in the store."""
+        return self.year_index.years.tolist()
+
+    def close(self):
+        self._source.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(csv_path=CSV_PATH, store_path=None):
+    """
+    Return the process-wide store for a CSV file, building it if needed.
+
+    The store is (re)built when it is missing, older than the CSV or was
+    written with a different SCHEMA_VERSION.
+
+    Inputs:
+        csv_path (str): Geocoded incident CSV.
+        store_path (str): Arrow store location, see build_store.
+
+    Returns:
+        IncidentStore
+    """
+    store_path = store_path or store_path_for(csv_path)
+    store = _stores.get(store_path)
+    if store is not None:
+        return store
+    with _stores_lock:
+        store = _stores.get(store_path)
+        if store is None:
+            if _is_stale(csv_path, store_path):
+                build_store(csv_path, store_path)
+            store = IncidentStore(store_path)
+            _stores[store_path] = store
+    return store
+
+
+def reset_store(csv_path=CSV_PATH, store_path=None):
+    """Drop the cached handle so the next get_store call reopens the file.
+
+    The old handle is not closed: frames and slices handed out to running
+    sessions may still point into its mapping.
+    """
+    store_path = store_path or store_path_for(csv_path)
+    with _stores_lock:
+        _stores.pop(store_path, None)
+
+
+def add_columns(columns, csv_path=CSV_PATH):
+    """
+    Add (or replace) derived columns of the incident store.
+
+    Used by enrichment steps such as reverse geocoding. String columns are
+    dictionary-encoded. The columns are lost if the store is rebuilt from
+    a newer CSV, so the enrichment has to be re-run in that case.
+
+    Inputs:
+        columns (dict): Column name -> values, one per store row in store
+            order.
+        csv_path (str): Geocoded incident CSV backing the store.
+
+    Returns:
+        IncidentStore: The reopened store.
+    """
+    store = get_store(csv_path)
+    table = store.table
+    for name, values in columns.items():
+        array = pa.array(values)
+        if pa.types.is_string(array.type) or pa.types.is_large_string(
+            array.type
+        ):
+            array = array.dictionary_encode()
+        if len(array) != table.num_rows:
+            raise ValueError(
+                f"column '{name}' has {len(array)} values, "
+                f"the store has {table.num_rows} rows"
+            )
+        if name in table.column_names:
+            table = table.set_column(
+                table.column_names.index(name), name, array
+            )
+        else:
+            table = table.append_column(name, array)
+    write_table(table, store.path)
+    reset_store(csv_path, store.path)
+    return get_store(csv_path, store.path)
+
+
+def append_partition(table, source, source_sha256, csv_path=CSV_PATH, **details):
+    """
+    Append new incidents to the store as a partition.
+
+    The partition is recorded in the manifest, then its rows are appended
+    to the existing store file rather than rebuilding it from the CSV.
+    Columns added with add_columns are left empty for the new rows.
+
+    Inputs:
+        table (pa.Table): Incidents following SCHEMA.
+        source (str): Name of the file the incidents came from.
+        source_sha256 (str): Digest of that file.
+        csv_path (str): Geocoded incident CSV backing the store; the
+            partition goes next to it (see partition_dir_for).
+        **details: Extra fields of the manifest entry.
+
+    Returns:
+        (dict, IncidentStore): The manifest entry and the reopened store.
+    """
+    store = get_store(csv_path)
+    entry = write_partition(
+        table, source, source_sha256, partition_dir_for(csv_path), **details
+    )
+    write_table(concat_by_year([store.table, table.cast(SCHEMA)]), store.path)
+    reset_store(csv_path, store.path)
+    return entry, get_store(csv_path, store.path)
+
+
+def load_year_index():
+    """Return the shared YearIndex of the incident store."""
+    return get_store().year_index
+
+
+def load_incidents(columns=None):
+    """
+    Return the shared incident frame.
+
+    Inputs:
+        columns (list): Optional subset of columns.
+
+    Returns:
+        pd.DataFrame: Read-only incidents (copy before modifying).
+    """
+    frame = get_store().frame
+    if columns is not None:
+        return frame[columns]
+    return frame
@@ -0,0 +1,233 @@
+"""Background monitoring of Earth Engine export tasks.
+
+Exports to Google Drive can take up to an hour. Instead of polling each
+task from the Streamlit script thread, a TaskMonitor asks for the status
+of all its tasks in one call per tick, backs off exponentially while
+nothing changes, and runs on an asyncio loop in a background thread.
+Progress is reported through a callback, typically one that writes into a
+dict kept in st.session_state, which the page reads on its next rerun.
+A status request that fails transiently is retried with the same backoff,
+and its error is reported through the callback too.
+"""
+import asyncio
+import threading
+import time
+
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class EarthEngineTaskService:
+    """Task statuses from ee.data.getTaskStatus."""
+
+    @property
+    def transient_errors(self):
+        """Exception types of a status request that is worth retrying."""
+        import ee
+
+        # requests and socket errors are OSErrors
+        return (ee.EEException, OSError)
+
+    def statuses(self, task_ids):
+        """
+        Return the status of several tasks with a single request.
+
+        Inputs:
+            task_ids (list): Earth Engine task ids.
+
+        Returns:
+            dict: task id -> status dict with at least 'state'.
+        """
+        import ee
+
+        return {
+            status["id"]: status for status in ee.data.getTaskStatus(task_ids)
+        }
+
+
+class FakeTaskService:
+    """
+    Scripted task statuses, for tests and for running the page offline.
+
+    Inputs:
+        script (dict): task id -> list of states; each call to statuses
+            moves every task one state forward and stays on the last one.
+    """
+
+    transient_errors = (OSError,)
+
+    def __init__(self, script):
+        self.script = {task_id: list(states) for task_id, states in script.items()}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def statuses(self, task_ids):
+        with self._lock:
+            self.calls.append(list(task_ids))
+            tick = len(self.calls) - 1
+        result = {}
+        for task_id in task_ids:
+            states = self.script.get(task_id, ["UNKNOWN"])
+            status = {"id": task_id, "state": states[min(tick, len(states) - 1)]}
+            if status["state"] == FAILED:
+                status["error_message"] = f"Task {task_id} failed"
+            result[task_id] = status
+        return result
+
+
+class TaskMonitor:
+    """
+    Wait for a set of tasks to complete, fail, or time out.
+
+    Tasks are not cancelled after the timeout and may continue to run.
+
+    Inputs:
+        task_ids (list): Task ids to follow.
+        service: Object with a statuses(task_ids) method and the
+            transient_errors it raises, by default EarthEngineTaskService.
+        on_progress (callable): Called as on_progress(statuses, finished,
+            error) after every tick, statuses being task id -> status dict
+            and error the message of a failed status request (else None).
+        interval (float): Seconds before the first status query, and after
+            any state change.
+        max_interval (float): Upper bound of the backed-off interval.
+        backoff (float): Factor applied to the interval while no task
+            changes state.
+        timeout (float): Seconds before giving up, 0 for no timeout.
+    """
+
+    def __init__(
+        self,
+        task_ids,
+        service=None,
+        on_progress=None,
+        interval=2,
+        max_interval=60,
+        backoff=2,
+        timeout=3600,
+    ):
+        self.task_ids = list(task_ids)
+        self.service = service or EarthEngineTaskService()
+        self.on_progress = on_progress
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.statuses = {}
+
+    @property
+    def finished(self):
+        return len(self.statuses) == len(self.task_ids) and all(
+            status["state"] in FINISHED_STATES for status in self.statuses.values()
+        )
+
+    async def wait(self):
+        """
+        Poll until every task is finished or the timeout passes.
+
+        Returns:
+            bool: True if all tasks finished (successfully or not).
+        """
+        start = time.monotonic()
+        interval = self.interval
+        while True:
+            pending = [
+                task_id
+                for task_id in self.task_ids
+                if self.statuses.get(task_id, {}).get("state")
+                not in FINISHED_STATES
+            ]
+            error = None
+            try:
+                # The status request is blocking network I/O
+                fresh = await asyncio.to_thread(self.service.statuses, pending)
+            except self.service.transient_errors as failure:
+                # Retried on the next tick, backing off
+                error = str(failure) or type(failure).__name__
+                fresh = {}
+            except Exception as failure:
+                # Not worth a retry: report it before the monitor stops
+                if self.on_progress is not None:
+                    self.on_progress(
+                        dict(self.statuses), self.finished, str(failure)
+                    )
+                raise
+            changed = any(
+                fresh[task_id].get("state")
+                != self.statuses.get(task_id, {}).get("state")
+                for task_id in fresh
+            )
+            self.statuses.update(fresh)
+            if self.on_progress is not None:
+                self.on_progress(dict(self.statuses), self.finished, error)
+            if self.finished:
+                return True
+            if self.timeout and time.monotonic() - start >= self.timeout:
+                return False
+            interval = (
+                self.interval
+                if changed
+                else min(interval * self.backoff, self.max_interval)
+            )
+            await asyncio.sleep(interval)
+
+    def start(self):
+        """
+        Run the monitor on the background loop.
+
+        Returns:
+            concurrent.futures.Future resolving to the result of wait.
+        """
+        return asyncio.run_coroutine_threadsafe(self.wait(), _background_loop())
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    """Return the event loop shared by all monitors, starting it if needed."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="task-monitor", daemon=True
+            ).start()
+        return _loop
+
+
+def progress_recorder(progress):
+    """
+    Return an on_progress callback that records into a dict.
+
+    Keep the dict in st.session_state: the monitor thread has no script
+    context and cannot set session state keys itself, but it can update a
+    dict the session already holds.
+
+    Inputs:
+        progress (dict): Receives 'states' (task id -> state), 'errors'
+            (task id -> message), 'finished' (bool), 'error' (message of the
+            last failed status request, None once one succeeds) and
+            'updated' (epoch seconds).
+
+    Returns:
+        callable
+    """
+
+    def record(statuses, finished, error=None):
+        progress["states"] = {
+            task_id: status["state"] for task_id, status in statuses.items()
+        }
+        progress["errors"] = {
+            task_id: status["error_message"]
+            for task_id, status in statuses.items()
+            if "error_message" in status
+        }
+        progress["finished"] = finished
+        progress["error"] = error
+        progress["updated"] = time.time()
+
+    return record
@@ -0,0 +1,184 @@
+"""Concurrent, cached download of timelapse frames from Earth Engine.
+
+geemap asks Earth Engine for a whole timelapse as one video GIF, rendered
+and sent in a single response, and downloads it again whenever any
+parameter changes, even only the title or the frame rate.
+
+Frames are fetched here one thumbnail per image instead: the thumbnail
+URLs are requested and downloaded concurrently by a bounded thread pool
+over the pooled session of flood.exports, failed frames are retried, and
+the frames are returned in collection order. Each frame is stored under a
+hash of its Earth Engine expression and thumbnail parameters, so a render
+that only changes the overlays, the frame rate or the fading reuses the
+frames already downloaded.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from flood.exports import CHUNK_SIZE, http_session
+
+FRAME_DIR = os.path.join(tempfile.gettempdir(), "flood_frames")
+FETCH_WORKERS = 8
+# Attempts per frame, on top of the retries of the HTTP session
+FRAME_RETRIES = 3
+# Cached frames are deleted, least recently used first, above this size
+FRAME_CACHE_BYTES = 2 * 1024**3
+# Partial downloads older than this were abandoned by a dead worker
+PART_MAX_AGE = 60 * 60
+# Video parameters that do not apply to a thumbnail
+VIDEO_ONLY = ("framesPerSecond",)
+
+
+def thumbnail_params(video_args):
+    """
+    Return the thumbnail parameters of each frame of a video.
+
+    Inputs:
+        video_args (dict): Parameters of getVideoThumbURL.
+    """
+    import ee
+
+    params = {
+        name: value for name, value in video_args.items() if name not in VIDEO_ONLY
+    }
+    region = params.get("region")
+    if region is not None and not isinstance(region, ee.Geometry):
+        params["region"] = region.geometry()
+    params["format"] = "png"
+    return params
+
+
+def frame_key(image, params):
+    """Return the hash of the expression and thumbnail parameters of a frame."""
+    import ee
+
+    payload = json.dumps(
+        [
+            image.serialize(),
+            {
+                name: value.serialize()
+                if isinstance(value, ee.ComputedObject)
+                else value
+                for name, value in params.items()
+            },
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class FrameCache:
+    """
+    Timelapse frames stored on disk by frame_key.
+
+    Inputs:
+        directory (str): Where the frames are kept.
+        workers (int): Frames fetched at the same time.
+        max_bytes (int): Size of the frames above which the least recently
+            used ones are deleted.
+        timeout (float): Seconds to wait for one thumbnail.
+    """
+
+    def __init__(
+        self,
+        directory=FRAME_DIR,
+        workers=FETCH_WORKERS,
+        max_bytes=FRAME_CACHE_BYTES,
+        timeout=300,
+    ):
+        self.directory = directory
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def fetch(self, image, params):
+        """
+        Return the path of the thumbnail of an image, downloading it once.
+
+        Raises the last error once FRAME_RETRIES attempts failed.
+        """
+        import ee
+
+        path = self.path(frame_key(image, params))
+        if os.path.exists(path):
+            # Frames are evicted least recently used first
+            os.utime(path)
+            return path
+        for attempt in range(FRAME_RETRIES):
+            try:
+                url = image.getThumbURL(params)
+                partial = f"{path}.{os.getpid()}.{id(image)}.part"
+                with http_session(self.workers).get(
+                    url, stream=True, timeout=self.timeout
+                ) as response:
+                    response.raise_for_status()
+                    with open(partial, "wb") as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                os.replace(partial, path)
+                return path
+            except (ee.EEException, requests.RequestException):
+                if attempt == FRAME_RETRIES - 1:
+                    raise
+                time.sleep(2**attempt)
+
+    def fetch_collection(self, collection, params):
+        """
+        Download the thumbnails of every image of a collection.
+
+        Inputs:
+            collection (ee.ImageCollection): Frames, in order.
+            params (dict): Thumbnail parameters (see thumbnail_params).
+
+        Returns:
+            list of str: Paths of the frames, in collection order.
+        """
+        import ee
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._purge()
+        count = collection.size().getInfo()
+        if not count:
+            return []
+        images = collection.toList(count)
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(
+                pool.map(
+                    lambda index: self.fetch(ee.Image(images.get(index)), params),
+                    range(count),
+                )
+            )
+
+    def _purge(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path.endswith(".part") and time.time() - mtime < PART_MAX_AGE:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+frame_cache = FrameCache()
@@ -0,0 +1,409 @@
+"""Persistent local proxy for basemap, WMS and Earth Engine tiles.
+
+Every rerun of a page makes the browser fetch the same basemap and Earth
+Engine tiles from their upstream servers again. The proxy serves them from
+the tile endpoint of flood.vector_tiles instead: tiles are kept in a SQLite
+file bounded in size (least recently used tiles are evicted first),
+revalidated with If-None-Match / If-Modified-Since once they are older than
+MAX_AGE, served stale when the upstream is unreachable, and identical
+concurrent fetches wait for one upstream request. Responses the upstream
+marks Cache-Control: no-store or private are passed through, not stored.
+
+Maps are routed through the proxy by calling proxy_layers on them just
+before they are rendered. The proxy is opt-in: tile URLs are only
+rewritten when the endpoint has a fixed FLOOD_TILE_PORT and a public
+FLOOD_TILE_URL the browsers can reach (see flood.vector_tiles); otherwise
+the maps load tiles from their upstream servers. Set FLOOD_TILE_PROXY=0 to
+turn it off even then.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from flood.cache import TTLCache
+from flood.vector_tiles import add_route, endpoint_url, public_endpoint
+
+CACHE_PATH = "analytics/data2/tile_cache.sqlite"
+MAX_BYTES = 512 * 1024 * 1024
+# Tiles older than this are revalidated with the upstream server
+MAX_AGE = 7 * 24 * 60 * 60
+# Accessed times are only written back this often, so a cache hit is
+# normally a read
+TOUCH_INTERVAL = 60
+USER_AGENT = "streamlit_floodv2 tile proxy"
+# Upstream URLs registered at once; every analysis adds an Earth Engine map
+# id, so the least recently registered are dropped, and all after SOURCE_TTL
+# (Earth Engine map ids expire within hours anyway)
+MAX_SOURCES = 256
+SOURCE_TTL = 12 * 60 * 60
+
+_PLACEHOLDER = re.compile(r"\{(-?y|x|z|s|r)\}")
+# Cache-Control directives of responses that must not be stored
+_NOT_STORED = {"no-store", "private"}
+
+
+class TileStore:
+    """
+    Tiles keyed by upstream URL, stored in SQLite.
+
+    Inputs:
+        path (str): SQLite file.
+        max_bytes (int): Size of the tile data above which the least
+            recently used tiles are evicted, down to 90% of it.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tiles (
+                url TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched REAL NOT NULL,
+                accessed REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)"
+        )
+        self._connection.commit()
+        self.size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM tiles"
+        ).fetchone()[0]
+
+    def get(self, url):
+        """
+        Return the cached tile of url as a dict, or None.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data, content_type, etag, last_modified, fetched, "
+                "accessed FROM tiles WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[5] > TOUCH_INTERVAL:
+                self._connection.execute(
+                    "UPDATE tiles SET accessed = ? WHERE url = ?", (now, url)
+                )
+                self._connection.commit()
+        data, content_type, etag, last_modified, fetched, _ = row
+        return {
+            "data": data,
+            "content_type": content_type,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched": fetched,
+        }
+
+    def put(self, url, data, content_type, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock:
+            previous = self._connection.execute(
+                "SELECT size FROM tiles WHERE url = ?", (url,)
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    data,
+                    content_type,
+                    etag,
+                    last_modified,
+                    now,
+                    now,
+                    len(data),
+                ),
+            )
+            self.size += len(data) - (previous[0] if previous else 0)
+            if self.size > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._connection.commit()
+
+    def revalidated(self, url):
+        """Mark the tile of url as confirmed fresh by the upstream server."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "UPDATE tiles SET fetched = ?, accessed = ? WHERE url = ?",
+                (now, now, url),
+            )
+            self._connection.commit()
+
+    def _evict(self, target):
+        rows = self._connection.execute(
+            "SELECT url, size FROM tiles ORDER BY accessed"
+        )
+        evicted = []
+        for url, size in rows:
+            if self.size <= target:
+                break
+            evicted.append((url,))
+            self.size -= size
+        self._connection.executemany("DELETE FROM tiles WHERE url = ?", evicted)
+
+    def close(self):
+        self._connection.close()
+
+
+class TileProxy:
+    """
+    Fetch upstream tiles through a TileStore.
+
+    Inputs:
+        store (TileStore): Persistent cache.
+        max_age (float): Seconds after which a cached tile is revalidated.
+        timeout (float): Upstream request timeout in seconds.
+        max_sources (int): Upstream URLs registered at once.
+        source_ttl (float): Seconds a registered URL is kept after it was
+            last registered; maps register theirs on every render.
+    """
+
+    def __init__(
+        self,
+        store,
+        max_age=MAX_AGE,
+        timeout=20,
+        max_sources=MAX_SOURCES,
+        source_ttl=SOURCE_TTL,
+    ):
+        self.store = store
+        self.max_age = max_age
+        self.timeout = timeout
+        self.sources = TTLCache(maxsize=max_sources, ttl=source_ttl)
+        self._lock = threading.Lock()
+        # One lock per URL being fetched, so identical concurrent requests
+        # wait for the first one instead of all reaching the upstream
+        self._inflight = {}
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.2,
+                status_forcelist=(429, 500, 502, 503, 504),
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def register(self, url, subdomains="abc"):
+        """
+        Register an upstream XYZ template or WMS base URL.
+
+        Returns:
+            str: Key of the source in proxy URLs.
+        """
+        key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        # Set again on every render, which restarts its TTL
+        self.sources.set(key, (url, list(subdomains or "a")))
+        return key
+
+    def xyz_url(self, key, z, x, y):
+        """Return the upstream URL of one tile, or None for an unknown key."""
+        source = self.sources.get(key)
+        if source is None:
+            return None
+        template, subdomains = source
+        values = {
+            "z": str(z),
+            "x": str(x),
+            "y": str(y),
+            "-y": str(2**z - 1 - y),
+            "s": subdomains[(x + y) % len(subdomains)],
+            "r": "",
+        }
+        return _PLACEHOLDER.sub(lambda m: values[m.group(1)], template)
+
+    def wms_url(self, key, query):
+        """Return the upstream URL of a WMS request, or None."""
+        source = self.sources.get(key)
+        if source is None:
+            return None
+        base = source[0]
+        return f"{base}{'&' if '?' in base else '?'}{query}"
+
+    def fetch(self, url):
+        """
+        Return (bytes, content type) of url, from the cache when fresh.
+
+        Returns None when the upstream has no such tile.
+        """
+        cached = self.store.get(url)
+        if cached is not None and time.time() - cached["fetched"] < self.max_age:
+            return cached["data"], cached["content_type"]
+        with self._lock:
+            url_lock = self._inflight.setdefault(url, threading.Lock())
+        with url_lock:
+            try:
+                cached = self.store.get(url)
+                if (
+                    cached is not None
+                    and time.time() - cached["fetched"] < self.max_age
+                ):
+                    return cached["data"], cached["content_type"]
+                return self._fetch_upstream(url, cached)
+            finally:
+                with self._lock:
+                    self._inflight.pop(url, None)
+
+    def _fetch_upstream(self, url, cached):
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            if cached is None:
+                raise
+            # Better an old tile than a hole in the map
+            return cached["data"], cached["content_type"]
+        if response.status_code == 304 and cached is not None:
+            self.store.revalidated(url)
+            return cached["data"], cached["content_type"]
+        if response.status_code != 200:
+            if cached is not None and response.status_code >= 500:
+                return cached["data"], cached["content_type"]
+            return None
+        content_type = response.headers.get(
+            "Content-Type", "application/octet-stream"
+        )
+        if not storable(response.headers.get("Cache-Control")):
+            return response.content, content_type
+        self.store.put(
+            url,
+            response.content,
+            content_type,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        return response.content, content_type
+
+
+def storable(cache_control):
+    """Return whether a response with this Cache-Control may be cached."""
+    if not cache_control:
+        return True
+    directives = {
+        directive.split("=")[0].strip().lower()
+        for directive in cache_control.split(",")
+    }
+    return not directives & _NOT_STORED
+
+
+_proxy = None
+_proxy_lock = threading.Lock()
+
+
+def tile_proxy():
+    """Return the proxy of this process, creating it if needed."""
+    global _proxy
+    with _proxy_lock:
+        if _proxy is None:
+            _proxy = TileProxy(TileStore())
+            add_route(
+                r"^/xyz/(\w+)/(\d+)/(\d+)/(\d+)$",
+                lambda match, query: _serve_xyz(_proxy, *match.groups()),
+            )
+            add_route(
+                r"^/wms/(\w+)$",
+                lambda match, query: _serve_wms(_proxy, match.group(1), query),
+            )
+        return _proxy
+
+
+def _serve_xyz(proxy, key, z, x, y):
+    url = proxy.xyz_url(key, int(z), int(x), int(y))
+    return None if url is None else proxy.fetch(url)
+
+
+def _serve_wms(proxy, key, query):
+    url = proxy.wms_url(key, query)
+    return None if url is None else proxy.fetch(url)
+
+
+def enabled():
+    """Return whether maps are routed through the proxy."""
+    return public_endpoint() and os.environ.get("FLOOD_TILE_PROXY", "1") != "0"
+
+
+def proxied_url(url, subdomains="abc"):
+    """
+    Return the proxy URL template of an upstream XYZ template.
+
+    URLs that are not http(s), or already point at the tile endpoint, are
+    returned unchanged.
+    """
+    base = endpoint_url()
+    if urlparse(url).scheme not in ("http", "https") or url.startswith(base):
+        return url
+    key = tile_proxy().register(url, subdomains)
+    return f"{base}/xyz/{key}/{{z}}/{{x}}/{{y}}"
+
+
+def proxied_wms_url(url):
+    """Return the proxy URL of an upstream WMS endpoint."""
+    base = endpoint_url()
+    if urlparse(url).scheme not in ("http", "https") or url.startswith(base):
+        return url
+    key = tile_proxy().register(url)
+    return f"{base}/wms/{key}"
+
+
+def proxy_layers(m):
+    """
+    Route the tile and WMS layers of a folium map through the proxy.
+
+    Call it just before the map is rendered, once every layer is added.
+
+    Inputs:
+        m (folium.Map): Includes leafmap and geemap maps.
+
+    Returns:
+        The same map.
+    """
+    from folium.raster_layers import TileLayer, WmsTileLayer
+
+    if not enabled():
+        return m
+    pending = [m]
+    while pending:
+        element = pending.pop()
+        pending.extend(element._children.values())
+        # MiniMap keeps its tile layer outside of its children
+        if isinstance(getattr(element, "tile_layer", None), TileLayer):
+            pending.append(element.tile_layer)
+        if isinstance(element, WmsTileLayer):
+            element.url = proxied_wms_url(element.url)
+        elif isinstance(element, TileLayer) and isinstance(element.tiles, str):
+            element.tiles = proxied_url(
+                element.tiles, element.options.get("subdomains", "abc")
+            )
+    return m
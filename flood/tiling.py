@@ -0,0 +1,424 @@
+"""Tiled flood-extent processing for large areas of interest.
+
+Earth Engine refuses to return rasters larger than a few tens of megabytes
+("image size is too big") and ``reduceToVectors(bestEffort=True)`` silently
+coarsens the polygons of big areas. Here a large AOI is cut into tiles,
+each tile is processed (with a buffer so the focal mean and the connected
+pixel filter see the same neighbourhood as without tiling) on a pool of
+workers, and the tile cores are stitched back into one raster, written to
+a GeoTIFF tile by tile as they finish, and one set of polygons, merging
+polygons split by tile seams.
+
+The page only falls back to tiling when Earth Engine refuses a single
+download for its size (see is_size_limit); start_tiled_export then runs
+the tiled analysis on a background thread and reports its progress into a
+dict the page keeps in st.session_state.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio import features, warp, windows
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from shapely.geometry import box, mapping, shape
+
+from flood.exports import package, stream_to_file
+from flood.extent import EarthEngine
+from flood.extent_local import LocalEngine, LocalRaster, as_geometry, reduce_to_vectors
+
+KM_PER_DEG = 111.32
+# Parts of the Earth Engine errors of a download over its size limit
+SIZE_LIMIT_ERRORS = (
+    "must be less than or equal to",
+    "too large",
+    "too big",
+)
+
+Tile = namedtuple("Tile", ["core", "region"])
+TiledResult = namedtuple("TiledResult", ["flood_vectors", "flood_raster"])
+
+
+def split_aoi(aoi, tile_size_km=25, overlap_m=500):
+    """
+    Cut an AOI into square tiles with buffered processing regions.
+
+    Inputs:
+        aoi (shapely geometry): Area of interest in EPSG:4326.
+        tile_size_km (float): Side of the tile cores.
+        overlap_m (float): Buffer added around each core. Must be at least
+            the smoothing radius so edge pixels are smoothed as they would
+            be without tiling.
+
+    Returns:
+        list of Tile: core is the tile box (cores do not overlap), region is
+        the buffered box intersected with the AOI.
+    """
+    west, south, east, north = aoi.bounds
+    lat = (south + north) / 2
+    step_y = tile_size_km / KM_PER_DEG
+    step_x = step_y / np.cos(np.radians(lat))
+    pad_y = overlap_m / 1000 / KM_PER_DEG
+    pad_x = pad_y / np.cos(np.radians(lat))
+    tiles = []
+    for x in np.arange(west, east, step_x):
+        for y in np.arange(south, north, step_y):
+            core = box(x, y, min(x + step_x, east), min(y + step_y, north))
+            if not core.intersects(aoi):
+                continue
+            region = box(
+                core.bounds[0] - pad_x,
+                core.bounds[1] - pad_y,
+                core.bounds[2] + pad_x,
+                core.bounds[3] + pad_y,
+            ).intersection(aoi)
+            tiles.append(Tile(core, region))
+    return tiles
+
+
+def is_size_limit(error):
+    """Return whether an ee.EEException is the download size limit."""
+    message = str(error).lower()
+    return any(text in message for text in SIZE_LIMIT_ERRORS)
+
+
+def _download_raster(image, region, scale):
+    """Download an ee.Image over region as a LocalRaster."""
+    url = image.unmask(0).toByte().getDownloadURL(
+        {
+            "region": mapping(region),
+            "scale": scale,
+            "crs": "EPSG:4326",
+            "format": "GEO_TIFF",
+        }
+    )
+    # The GeoTIFF is streamed to disk, only its pixels are kept in memory
+    directory = tempfile.mkdtemp(prefix="flood_tile_")
+    try:
+        path = stream_to_file(url, os.path.join(directory, "tile.tif"))
+        with rasterio.open(path) as src:
+            data = src.read(1)
+            return LocalRaster(
+                np.ma.masked_equal(data, 0), src.transform, src.crs
+            )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _crop(raster, core):
+    """Mask the pixels of raster outside the tile core."""
+    geometry = warp.transform_geom("EPSG:4326", raster.crs, mapping(core))
+    outside = features.geometry_mask(
+        [geometry], out_shape=raster.shape, transform=raster.transform
+    )
+    return raster.with_data(
+        np.ma.array(
+            raster.data, mask=np.ma.getmaskarray(raster.data) | outside
+        )
+    )
+
+
+def process_tile(engine, tile, dates, params, scale=10):
+    """
+    Derive the flood extent of one tile and crop it to the tile core.
+
+    Runs in a worker; must stay a module-level function so it can be
+    pickled for process pools.
+
+    Returns:
+        (LocalRaster, list of shapely polygons)
+    """
+    if isinstance(engine, EarthEngine):
+        import ee
+
+        # Planar, like the shapely tiles; keeps holes and multipolygons
+        region = ee.Geometry(mapping(tile.region), None, False)
+    else:
+        region = tile.region
+    vectors, rasters, _, _ = engine.derive_flood_extents(
+        region, *dates, **params
+    )
+    if isinstance(engine, EarthEngine):
+        # Polygonise locally from the full-resolution raster instead of
+        # reduceToVectors(bestEffort=True)
+        rasters = _download_raster(rasters, tile.region, scale)
+        vectors = reduce_to_vectors(rasters)
+    rasters = _crop(rasters, tile.core)
+    polygons = []
+    for feature in vectors["features"]:
+        clipped = shape(feature["geometry"]).intersection(tile.core)
+        if not clipped.is_empty:
+            polygons.extend(
+                p
+                for p in getattr(clipped, "geoms", [clipped])
+                if p.geom_type == "Polygon"
+            )
+    return rasters, polygons
+
+
+class RasterMosaic:
+    """
+    EPSG:4326 GeoTIFF over an AOI that tile rasters are written into.
+
+    The file gets the resolution of the first tile added. Each tile is
+    reprojected into its own window of the grid and combined with the
+    pixels already there (the maximum, so the edge pixels shared by two
+    tiles stay flooded), and only that window is held in memory: memory is
+    bounded by the tile size, whatever the size of the AOI.
+
+    Inputs:
+        path (str): GeoTIFF to write.
+        aoi (shapely geometry): Area covered, in EPSG:4326.
+    """
+
+    def __init__(self, path, aoi):
+        self.path = path
+        self.aoi = aoi
+        self._dst = None
+
+    def _open(self, res):
+        west, south, east, north = self.aoi.bounds
+        self.res = res
+        self.width = int(np.ceil((east - west) / res))
+        self.height = int(np.ceil((north - south) / res))
+        self.transform = from_origin(west, north, res, res)
+        # w+ so windows shared by two tiles can be read back
+        self._dst = rasterio.open(
+            self.path,
+            "w+",
+            driver="GTiff",
+            height=self.height,
+            width=self.width,
+            count=1,
+            dtype="uint8",
+            crs=CRS.from_epsg(4326),
+            transform=self.transform,
+            nodata=0,
+            tiled=True,
+            compress="deflate",
+            BIGTIFF="IF_SAFER",
+        )
+
+    def add(self, raster):
+        """Write a tile raster (LocalRaster) into its window of the grid."""
+        if self._dst is None:
+            self._open(abs(raster.transform.a))
+        west, _, _, north = self.aoi.bounds
+        rows, cols = raster.shape
+        tile_west, tile_south, tile_east, tile_north = warp.transform_bounds(
+            raster.crs,
+            "EPSG:4326",
+            *windows.bounds(windows.Window(0, 0, cols, rows), raster.transform),
+        )
+        # Window of the grid under the tile, whole pixels, clipped to it
+        col_start = max(int(np.floor((tile_west - west) / self.res)), 0)
+        row_start = max(int(np.floor((north - tile_north) / self.res)), 0)
+        col_stop = min(int(np.ceil((tile_east - west) / self.res)), self.width)
+        row_stop = min(int(np.ceil((north - tile_south) / self.res)), self.height)
+        if col_stop <= col_start or row_stop <= row_start:
+            return
+        window = windows.Window(
+            col_start, row_start, col_stop - col_start, row_stop - row_start
+        )
+        tile = np.zeros((row_stop - row_start, col_stop - col_start), np.uint8)
+        warp.reproject(
+            raster.data.filled(0).astype(np.uint8),
+            tile,
+            src_transform=raster.transform,
+            src_crs=raster.crs,
+            dst_transform=windows.transform(window, self.transform),
+            dst_crs="EPSG:4326",
+            src_nodata=0,
+            dst_nodata=0,
+            resampling=Resampling.nearest,
+        )
+        np.maximum(self._dst.read(1, window=window), tile, out=tile)
+        self._dst.write(tile, 1, window=window)
+
+    def close(self):
+        """Finish the file; returns its path, or None if no tile was added."""
+        if self._dst is None:
+            return None
+        self._dst.close()
+        return self.path
+
+
+def read_raster(path):
+    """Read a single-band GeoTIFF written by RasterMosaic as a LocalRaster."""
+    with rasterio.open(path) as src:
+        return LocalRaster(
+            np.ma.masked_equal(src.read(1), 0), src.transform, src.crs
+        )
+
+
+def stitch_polygons(polygons, tiles):
+    """
+    Merge the polygons that were split by tile seams.
+
+    Only polygons touching a seam are dissolved, so separate polygons
+    inside a tile stay separate.
+    """
+    if not polygons:
+        return []
+    seams = shapely.union_all([tile.core.boundary for tile in tiles])
+    polygons = np.asarray(polygons, dtype=object)
+    on_seam = shapely.intersects(polygons, seams)
+    merged = shapely.union_all(polygons[on_seam])
+    merged = list(getattr(merged, "geoms", [merged])) if on_seam.any() else []
+    return list(polygons[~on_seam]) + [p for p in merged if not p.is_empty]
+
+
+def tiled_flood_extents(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold=1.25,
+    polarization="VH",
+    pass_direction="Ascending",
+    engine=None,
+    tile_size_km=25,
+    overlap_m=500,
+    smoothing_radius=50,
+    scale=10,
+    workers=4,
+    on_progress=None,
+    raster_path=None,
+):
+    """
+    Derive flood extents over a large AOI tile by tile.
+
+    Tiles run on a thread pool for Earth Engine (the work is remote) and on
+    a process pool for the local engine (the work is CPU bound).
+
+    Inputs:
+        aoi: Shapely geometry, GeoJSON dict or ring of [lon, lat].
+        before_start_date .. pass_direction: See derive_flood_extents.
+        engine: EarthEngine (default) or LocalEngine.
+        tile_size_km (float): Side of the tile cores.
+        overlap_m (float): Tile buffer, at least smoothing_radius.
+        smoothing_radius (float): Focal mean radius used by the engine.
+        scale (int): Pixel size in metres of Earth Engine downloads.
+        workers (int): Tiles processed concurrently.
+        on_progress (callable): Called as on_progress(done, total) each
+            time a tile is finished.
+        raster_path (str): GeoTIFF the raster is written to as the tiles
+            finish (see RasterMosaic), so it is never held in memory whole.
+            Without it the raster is returned in memory; only for AOIs
+            small enough to fit.
+
+    Returns:
+        TiledResult(flood_vectors (GeoJSON dict), flood_raster (raster_path,
+        or a LocalRaster without it))
+    """
+    if overlap_m < smoothing_radius:
+        raise ValueError(
+            f"overlap_m ({overlap_m}) must be at least the smoothing radius "
+            f"({smoothing_radius})"
+        )
+    engine = engine or EarthEngine()
+    aoi = as_geometry(aoi)
+    tiles = split_aoi(aoi, tile_size_km, overlap_m)
+    dates = (before_start_date, before_end_date, after_start_date, after_end_date)
+    params = {
+        "difference_threshold": difference_threshold,
+        "polarization": polarization,
+        "pass_direction": pass_direction,
+    }
+    pool = (
+        ProcessPoolExecutor(workers)
+        if isinstance(engine, LocalEngine)
+        else ThreadPoolExecutor(workers)
+    )
+    directory = None
+    if raster_path is None:
+        directory = tempfile.mkdtemp(prefix="flood_mosaic_")
+    mosaic = RasterMosaic(
+        raster_path or os.path.join(directory, "mosaic.tif"), aoi
+    )
+    polygons = []
+    try:
+        with pool:
+            pending = {
+                pool.submit(process_tile, engine, tile, dates, params, scale)
+                for tile in tiles
+            }
+            while pending:
+                done, pending = wait(pending, return_when="FIRST_COMPLETED")
+                # Each tile is written out as soon as it is finished; its
+                # pixels go with its future, which is not kept
+                for future in done:
+                    raster, tile_polygons = future.result()
+                    mosaic.add(raster)
+                    polygons.extend(tile_polygons)
+                if on_progress is not None:
+                    on_progress(len(tiles) - len(pending), len(tiles))
+        mosaic.close()
+        flood_raster = raster_path or read_raster(mosaic.path)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+    polygons = stitch_polygons(polygons, tiles)
+    flood_vectors = {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "geometry": mapping(p), "properties": {"label": 1}}
+            for p in polygons
+        ],
+    }
+    return TiledResult(flood_vectors, flood_raster)
+
+
+def start_tiled_export(flood_params, raster_path, vector_path, zip_path=None):
+    """
+    Run tiled_flood_extents on a background thread and write its files.
+
+    Inputs:
+        flood_params (dict): Arguments of tiled_flood_extents (the AOI,
+            dates and analysis parameters).
+        raster_path (str): GeoTIFF to write.
+        vector_path (str): GeoJSON to write.
+        zip_path (str): Package both into this zip (see
+            flood.exports.package), or None.
+
+    Returns:
+        dict: Progress, to keep in st.session_state: 'done' and 'total'
+        tiles, 'files' (the written paths) and 'error' once 'finished',
+        and 'updated' (epoch seconds).
+    """
+    progress = {"done": 0, "total": None, "finished": False, "error": None}
+
+    def record(done, total):
+        progress["done"] = done
+        progress["total"] = total
+        progress["updated"] = time.time()
+
+    def run():
+        try:
+            tiled = tiled_flood_extents(
+                **flood_params, on_progress=record, raster_path=raster_path
+            )
+            with open(vector_path, "w") as f:
+                json.dump(tiled.flood_vectors, f)
+            if zip_path is None:
+                progress["files"] = [raster_path, vector_path]
+            else:
+                progress["files"] = [package(raster_path, vector_path, zip_path)]
+        except Exception as error:
+            progress["error"] = str(error)
+        finally:
+            progress["finished"] = True
+            progress["updated"] = time.time()
+
+    threading.Thread(target=run, name="tiled-export", daemon=True).start()
+    return progress
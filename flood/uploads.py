@@ -0,0 +1,89 @@
+"""Uploaded vector files parsed once, in memory.
+
+The upload widgets of the Timelapse and Vector pages used to write every
+upload to a new uuid-named temporary file, never deleted, and parse it
+with gpd.read_file, enabling fiona's KML driver on each call. The same
+file uploaded again, or by another session, was written and parsed again.
+
+Uploads are now keyed by the hash of their bytes and parsed with pyogrio
+(through Arrow) straight from memory; GeoJSON, KML and zipped shapefiles
+are recognised by GDAL from their content. Parsed GeoDataFrames are kept
+in a small process-wide cache. Formats GDAL cannot open from memory are
+spooled to a temporary file that is deleted as soon as it is read.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from flood.cache import TTLCache
+
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "flood_uploads")
+UPLOAD_CACHE_SIZE = 16
+UPLOAD_TTL = 60 * 60
+
+upload_cache = TTLCache(maxsize=UPLOAD_CACHE_SIZE, ttl=UPLOAD_TTL)
+
+
+def upload_key(content, name):
+    """Return the cache key of an upload: hash of its bytes and extension."""
+    extension = os.path.splitext(name)[1].lower()
+    return f"{hashlib.sha256(content).hexdigest()}{extension}"
+
+
+def _read_spooled(content, name):
+    import geopandas as gpd
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    directory = tempfile.mkdtemp(dir=UPLOAD_DIR)
+    try:
+        path = os.path.join(directory, os.path.basename(name))
+        with open(path, "wb") as f:
+            f.write(content)
+        return gpd.read_file(path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def read_vector(content, name):
+    """
+    Parse the bytes of a vector file.
+
+    Inputs:
+        content (bytes): File content.
+        name (str): File name, used when the file has to be spooled.
+
+    Returns:
+        gpd.GeoDataFrame
+    """
+    try:
+        import pyogrio
+    except ImportError:
+        return _read_spooled(content, name)
+    try:
+        import pyarrow  # noqa: F401
+
+        use_arrow = True
+    except ImportError:
+        use_arrow = False
+    try:
+        return pyogrio.read_dataframe(content, use_arrow=use_arrow)
+    except pyogrio.errors.DataSourceError:
+        return _read_spooled(content, name)
+
+
+def read_upload(data):
+    """
+    Return the GeoDataFrame of a Streamlit upload, parsing it once.
+
+    Inputs:
+        data (UploadedFile): Returned by st.file_uploader.
+
+    Returns:
+        gpd.GeoDataFrame: A copy, free to modify.
+    """
+    content = data.getvalue()
+    gdf = upload_cache.get_or_compute(
+        upload_key(content, data.name), lambda: read_vector(content, data.name)
+    )
+    return gdf.copy()
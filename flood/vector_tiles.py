@@ -0,0 +1,453 @@
+"""Mapbox vector tiles for flood polygons and incident buffers.
+
+Embedding thousands of polygons as inline GeoJSON makes the page HTML and
+the browser memory grow with the size of the event. Instead, polygons are
+cut into MVT tiles on demand, simplified to the pixel size of each zoom
+level, cached on disk and served by a small HTTP endpoint running in the
+Streamlit process; the folium map loads only the tiles in view through
+Leaflet.VectorGrid. flood.tile_proxy serves cached basemap tiles from the
+same endpoint.
+
+The endpoint listens on localhost, on an ephemeral port unless
+FLOOD_TILE_PORT is set. When the app is served to other machines, give it
+a fixed FLOOD_TILE_PORT, proxy that port and set FLOOD_TILE_URL to its
+public base URL. Until both are set (see public_endpoint), map_layer
+embeds the polygons as simplified GeoJSON instead: a remote browser could
+not load tiles from localhost, nor http:// tiles on an HTTPS page.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import shapely
+from folium.elements import JSCSSMixin
+from folium.features import GeoJson
+from folium.map import Layer
+from jinja2 import Template
+from shapely.geometry import mapping, shape
+
+from flood.cache import TTLCache
+from flood.cluster import lat_y, lng_x, x_lng, y_lat
+
+CACHE_DIR = "analytics/data2/vector_tiles"
+EXTENT = 4096
+# Tile units of geometry kept around each tile so strokes do not end at
+# the tile edge
+BUFFER = 64
+# Sources kept in memory (one per analysis, year and radius)
+SOURCE_CACHE_SIZE = 32
+SOURCE_TTL = 12 * 60 * 60
+# Cached tiles of a source are deleted this long after it was last
+# registered; at least SOURCE_TTL, so registered sources keep their tiles
+TILE_MAX_AGE = SOURCE_TTL
+# Zoom level whose pixel size embedded GeoJSON is simplified to (about 19 m)
+GEOJSON_ZOOM = 13
+
+VECTORGRID_JS = (
+    "https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/"
+    "Leaflet.VectorGrid.bundled.min.js"
+)
+
+
+def to_world(geometries):
+    """Project EPSG:4326 geometries to Web Mercator [0, 1] coordinates."""
+    return shapely.transform(
+        geometries,
+        lambda coords: np.column_stack(
+            [lng_x(coords[:, 0]), lat_y(coords[:, 1])]
+        ),
+    )
+
+
+class TileSource:
+    """
+    Polygons that can be cut into vector tiles.
+
+    Inputs:
+        geometries: Shapely geometries in EPSG:4326.
+        properties (list of dict): Attributes of each geometry.
+        layer (str): Name of the MVT layer.
+        max_zoom (int): Deepest zoom with its own tiles; the map overzooms
+            beyond it.
+        simplify_px (float): Simplification tolerance in screen pixels.
+    """
+
+    def __init__(
+        self,
+        geometries,
+        properties=None,
+        layer="features",
+        max_zoom=14,
+        simplify_px=0.5,
+    ):
+        geometries = np.asarray(list(geometries), dtype=object)
+        self.geometries = to_world(geometries)
+        self.properties = properties or [{} for _ in range(len(geometries))]
+        self.layer = layer
+        self.max_zoom = max_zoom
+        self.simplify_px = simplify_px
+        self.tree = shapely.STRtree(self.geometries)
+        self._simplified = {}
+        self._lock = threading.Lock()
+        digest = hashlib.sha256(layer.encode())
+        for blob in shapely.to_wkb(geometries):
+            digest.update(blob)
+        digest.update(json.dumps(self.properties, default=str).encode())
+        self.key = digest.hexdigest()[:24]
+
+    @classmethod
+    def from_geojson(cls, feature_collection, layer="features", **kwargs):
+        features = feature_collection["features"]
+        return cls(
+            [shape(feature["geometry"]) for feature in features],
+            [feature.get("properties") or {} for feature in features],
+            layer=layer,
+            **kwargs,
+        )
+
+    @classmethod
+    def from_geoseries(cls, geoseries, layer="features", **kwargs):
+        geoseries = geoseries.to_crs(epsg=4326)
+        return cls(geoseries.values, layer=layer, **kwargs)
+
+    def simplified(self, zoom):
+        """
+        Return the geometries simplified for one zoom level.
+
+        Returns:
+            (array of geometries, boolean array): The simplified geometries
+            and whether each is at least one pixel across at that zoom;
+            smaller ones are left out of the tiles, as they would not be
+            visible.
+        """
+        zoom = min(zoom, self.max_zoom)
+        with self._lock:
+            if zoom not in self._simplified:
+                pixel = 1.0 / (256 * 2**zoom)
+                bounds = shapely.bounds(self.geometries)
+                visible = np.maximum(
+                    bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1]
+                ) >= pixel
+                simplified = np.empty_like(self.geometries)
+                simplified[visible] = shapely.simplify(
+                    self.geometries[visible],
+                    self.simplify_px * pixel,
+                    preserve_topology=True,
+                )
+                self._simplified[zoom] = (simplified, visible)
+            return self._simplified[zoom]
+
+    def tile(self, z, x, y):
+        """
+        Encode one tile.
+
+        Returns:
+            bytes: MVT protobuf, empty if no geometry touches the tile.
+        """
+        import mapbox_vector_tile
+
+        size = 1.0 / 2**z
+        pad = size * BUFFER / EXTENT
+        bounds = (x * size, y * size, (x + 1) * size, (y + 1) * size)
+        query = shapely.box(
+            bounds[0] - pad, bounds[1] - pad, bounds[2] + pad, bounds[3] + pad
+        )
+        simplified, visible = self.simplified(z)
+        hits = self.tree.query(query, predicate="intersects")
+        hits = hits[visible[hits]]
+        if not len(hits):
+            return b""
+        geometries = shapely.clip_by_rect(simplified[hits], *query.bounds)
+        features = [
+            {"geometry": geometry, "properties": self.properties[i]}
+            for i, geometry in zip(hits, geometries)
+            if not geometry.is_empty
+        ]
+        if not features:
+            return b""
+        return mapbox_vector_tile.encode(
+            [{"name": self.layer, "features": features}],
+            default_options={
+                "quantize_bounds": bounds,
+                "extents": EXTENT,
+                "y_coord_down": True,
+            },
+        )
+
+
+class TileCache:
+    """
+    Serve tiles of registered sources, caching the encoded tiles on disk.
+
+    At most max_sources sources are kept, for ttl seconds; tiles of an
+    evicted source are served from disk while they last. The tile directory
+    of a source is deleted max_age seconds after it was last registered.
+
+    Inputs:
+        directory (str): Root of the cache, one sub-directory per source.
+        max_sources (int): Sources kept in memory.
+        ttl (float): Seconds a source stays registered.
+        max_age (float): Seconds the tiles of a source are kept after it
+            was last registered, at least ttl.
+    """
+
+    def __init__(
+        self,
+        directory=CACHE_DIR,
+        max_sources=SOURCE_CACHE_SIZE,
+        ttl=SOURCE_TTL,
+        max_age=TILE_MAX_AGE,
+    ):
+        self.directory = directory
+        self.max_age = max_age
+        self.sources = TTLCache(maxsize=max_sources, ttl=ttl)
+
+    def register(self, source):
+        if source.key not in self.sources:
+            self.sources.set(source.key, source)
+            self._purge()
+        path = os.path.join(self.directory, source.key)
+        os.makedirs(path, exist_ok=True)
+        # Marks when the source was last registered, see _purge
+        os.utime(path)
+        return source.key
+
+    def path(self, key, z, x, y):
+        return os.path.join(self.directory, key, str(z), str(x), f"{y}.pbf")
+
+    def get(self, key, z, x, y):
+        """
+        Return an encoded tile, or None for an unknown source.
+        """
+        path = self.path(key, z, x, y)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        source = self.sources.get(key)
+        if source is None:
+            return None
+        data = source.tile(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{threading.get_ident()}.tmp"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+        return data
+
+    def _purge(self):
+        """Delete the tiles of sources not registered for max_age seconds."""
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = time.time() - self.max_age
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                # Removed by another process in the meantime
+                pass
+
+
+_TILE_PATH = re.compile(r"^/(\w+)/(\d+)/(\d+)/(\d+)\.pbf$")
+# Other tiles served by the same endpoint, registered with add_route
+_routes = []
+
+
+def add_route(pattern, handler):
+    """
+    Serve more paths from the tile endpoint.
+
+    Inputs:
+        pattern (str): Regular expression matched against the request path.
+        handler (callable): Called with the match and the query string;
+            returns (bytes, content type), or None for a 404.
+    """
+    _routes.append((re.compile(pattern), handler))
+
+
+def _vector_tile(match, query):
+    key, z, x, y = match.groups()
+    data = tile_cache.get(key, int(z), int(x), int(y))
+    return None if data is None else (data, "application/x-protobuf")
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    routes = []
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        response = None
+        try:
+            for pattern, handler in self.routes:
+                match = pattern.match(path)
+                if match:
+                    response = handler(match, query)
+                    break
+        except Exception:
+            self.send_error(502)
+            return
+        if response is None:
+            self.send_error(404)
+            return
+        data, content_type = response
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+tile_cache = TileCache()
+add_route(_TILE_PATH.pattern, _vector_tile)
+
+
+def tile_server(host="127.0.0.1", port=None):
+    """Return the tile endpoint of this process, starting it if needed."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            if port is None:
+                port = int(os.environ.get("FLOOD_TILE_PORT", 0))
+            handler = type("TileHandler", (_TileHandler,), {"routes": _routes})
+            _server = ThreadingHTTPServer((host, port), handler)
+            _server.daemon_threads = True
+            threading.Thread(
+                target=_server.serve_forever, name="vector-tiles", daemon=True
+            ).start()
+        return _server
+
+
+def public_endpoint():
+    """Return whether the endpoint has a fixed port and a public base URL."""
+    return bool(
+        os.environ.get("FLOOD_TILE_URL") and os.environ.get("FLOOD_TILE_PORT")
+    )
+
+
+def endpoint_url():
+    """Return the base URL the browser reaches the tile endpoint at."""
+    host, port = tile_server().server_address[:2]
+    base = os.environ.get("FLOOD_TILE_URL") or f"http://{host}:{port}"
+    return base.rstrip("/")
+
+
+def tile_url(source):
+    """
+    Register a source and return its {z}/{x}/{y} URL template.
+    """
+    key = tile_cache.register(source)
+    return f"{endpoint_url()}/{key}/{{z}}/{{x}}/{{y}}.pbf"
+
+
+class VectorTileLayer(JSCSSMixin, Layer):
+    """
+    A folium layer drawing MVT tiles with Leaflet.VectorGrid.
+
+    Inputs:
+        source (TileSource): Polygons to draw.
+        name (str): Name in the layer control.
+        style (dict): Leaflet path options, e.g. {"color": "blue"}.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.vectorGrid.protobuf(
+                {{ this.url|tojson }},
+                {{ this.options|tojson }}
+            ){% if this.show %}.addTo({{ this._parent.get_name() }}){% endif %};
+        {% endmacro %}
+        """
+    )
+
+    default_js = [("leaflet.vectorgrid", VECTORGRID_JS)]
+
+    def __init__(
+        self, source, name=None, style=None, overlay=True, control=True, show=True
+    ):
+        super().__init__(
+            name=name, overlay=overlay, control=control, show=show
+        )
+        self._name = "VectorTileLayer"
+        self.url = tile_url(source)
+        style = {"weight": 1, "fill": True, "fillOpacity": 0.4, **(style or {})}
+        self.options = {
+            "vectorTileLayerStyles": {source.layer: style},
+            "maxNativeZoom": source.max_zoom,
+            "interactive": False,
+        }
+
+
+def to_geojson(source, zoom=GEOJSON_ZOOM):
+    """
+    Return the geometries of a source simplified for a zoom level.
+
+    Geometries smaller than a pixel at that zoom are left out, as in the
+    tiles.
+
+    Returns:
+        dict: GeoJSON FeatureCollection in EPSG:4326.
+    """
+    simplified, visible = source.simplified(zoom)
+    geometries = shapely.transform(
+        simplified[visible],
+        lambda coords: np.column_stack(
+            [x_lng(coords[:, 0]), y_lat(coords[:, 1])]
+        ),
+    )
+    properties = [
+        attributes
+        for attributes, shown in zip(source.properties, visible)
+        if shown
+    ]
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": mapping(geometry),
+                "properties": attributes,
+            }
+            for geometry, attributes in zip(geometries, properties)
+        ],
+    }
+
+
+def map_layer(source, name=None, style=None, zoom=GEOJSON_ZOOM, **kwargs):
+    """
+    Return a folium layer drawing a source, as vector tiles if possible.
+
+    Inputs:
+        source (TileSource): Polygons to draw.
+        name (str), style (dict), **kwargs: See VectorTileLayer.
+        zoom (int): Detail of the GeoJSON used when the tile endpoint is
+            not public_endpoint, see to_geojson.
+
+    Returns:
+        VectorTileLayer, or folium.GeoJson
+    """
+    if public_endpoint():
+        return VectorTileLayer(source, name=name, style=style, **kwargs)
+    style = {"weight": 1, "fill": True, "fillOpacity": 0.4, **(style or {})}
+    return GeoJson(
+        to_geojson(source, zoom),
+        name=name,
+        style_function=lambda feature: style,
+        **kwargs,
+    )
@@ -0,0 +1,102 @@
+"""Year-partitioned index over the incident store.
+
+The store keeps its rows sorted by Year, so every year is a contiguous block
+of rows. The index records where each block starts and stops once, and a year
+(or a range of years) is then answered with a positional slice of the shared
+frame instead of a boolean scan over every row.
+"""
+import numpy as np
+import pandas as pd
+
+
+class YearIndex:
+    """Offsets of each year's block of rows in a Year-sorted frame."""
+
+    def __init__(self, frame, column="Year"):
+        years = frame[column].to_numpy()
+        if len(years) and np.any(years[1:] < years[:-1]):
+            raise ValueError(f"frame must be sorted by '{column}'")
+        self.frame = frame
+        self.years = np.unique(years)
+        # Row offsets: rows of self.years[i] are bounds[i]:bounds[i + 1]
+        self._bounds = np.append(
+            np.searchsorted(years, self.years, side="left"), len(years)
+        )
+        self._slices = {
+            int(year): slice(int(start), int(stop))
+            for year, start, stop in zip(
+                self.years, self._bounds[:-1], self._bounds[1:]
+            )
+        }
+
+    def __contains__(self, year):
+        return int(year) in self._slices
+
+    def __len__(self):
+        return len(self.years)
+
+    @property
+    def first_year(self):
+        return int(self.years[0])
+
+    @property
+    def last_year(self):
+        return int(self.years[-1])
+
+    def counts(self):
+        """Return the number of incidents of each year as a Series."""
+        return pd.Series(
+            np.diff(self._bounds), index=self.years.astype(int), name="count"
+        )
+
+    def slice(self, year):
+        """Return the positional slice of one year (empty if absent)."""
+        return self._slices.get(int(year), slice(0, 0))
+
+    def range_slice(self, first, last):
+        """Return the positional slice covering first <= Year <= last."""
+        start, stop = np.searchsorted(self.years, [first, last + 1])
+        return slice(int(self._bounds[start]), int(self._bounds[stop]))
+
+    def select(self, year):
+        """
+        Return the incidents of a single year.
+
+        Inputs:
+            year (int): Year to select.
+
+        Returns:
+            pd.DataFrame: A slice of the shared frame (treat as read-only).
+        """
+        return self.frame.iloc[self.slice(year)]
+
+    def select_range(self, first, last):
+        """
+        Return the incidents of an inclusive range of years.
+
+        Inputs:
+            first (int): First year of the range.
+            last (int): Last year of the range.
+
+        Returns:
+            pd.DataFrame: A slice of the shared frame (treat as read-only).
+        """
+        return self.frame.iloc[self.range_slice(first, last)]
+
+    def select_years(self, years):
+        """
+        Return the incidents of any set of years.
+
+        Inputs:
+            years (iterable): Years to select, e.g. from a multiselect.
+
+        Returns:
+            pd.DataFrame: Rows of the requested years in Year order.
+        """
+        slices = [self.slice(year) for year in sorted(set(years))]
+        slices = [s for s in slices if s.stop > s.start]
+        if len(slices) == 1:
+            return self.frame.iloc[slices[0]]
+        if not slices:
+            return self.frame.iloc[0:0]
+        return pd.concat([self.frame.iloc[s] for s in slices])
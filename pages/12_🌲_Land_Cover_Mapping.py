@@ -3,6 +3,16 @@ import ee
 import streamlit as st
 import geemap.foliumap as geemap
 
+from flood.costs import (
+    REVISIT_DAYS,
+    describe,
+    images_between,
+    view_estimate,
+    view_scale,
+)
+from flood.ee_layers import tile_layer
+from flood.tile_proxy import proxy_layers
+
 st.set_page_config(layout="wide")
 
 st.sidebar.title("Resources:")
@@ -29,13 +39,11 @@ Map.add_basemap("ESA WorldCover 2020 S2 FCC")
 Map.add_basemap("ESA WorldCover 2020 S2 TCC")
 Map.add_basemap("HYBRID")
 
-esa = ee.ImageCollection("ESA/WorldCover/v100").first()
+ESA_DATASET = "ESA/WorldCover/v100"
 esa_vis = {"bands": ["Map"]}
 
 
-esri = ee.ImageCollection(
-    "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
-).mosaic()
+ESRI_DATASET = "projects/sat-io/open-datasets/landcover/ESRI_Global-LULC_10m"
 esri_vis = {
     "min": 1,
     "max": 10,
@@ -75,13 +83,49 @@ with col2:
     start_date = start.strftime("%Y-%m-%d")
     end_date = end.strftime("%Y-%m-%d")
 
-    region = ee.Geometry.BBox(-179, -89, 179, 89)
-    dw = geemap.dynamic_world(region, start_date, end_date, return_type="hillshade")
+    # Dynamic World is a composite of every Sentinel-2 scene of the dates.
+    # The estimate is only shown: the map id request is cheap and the
+    # composite is rendered by Earth Engine tile by tile as the browser asks
+    # for them, so there is nothing to admit here
+    dynamic_world_cost = view_estimate(
+        latitude,
+        zoom,
+        images_between(start, end, REVISIT_DAYS["sentinel2"]),
+    )
+    scale = view_scale(latitude, zoom)
+    st.caption(
+        f"Dynamic World at {scale:,.0f} m per pixel over "
+        f"{dynamic_world_cost.pixels * scale**2 / 1e6:,.0f} km², estimated "
+        f"cost: {describe(dynamic_world_cost)}."
+    )
+
+    # Tile URLs are cached by dataset, dates and vis params, so moving the
+    # map or switching layers and legends makes no Earth Engine requests
+    def dynamic_world():
+        region = ee.Geometry.BBox(-179, -89, 179, 89)
+        return geemap.dynamic_world(
+            region, start_date, end_date, return_type="hillshade"
+        )
 
     layers = {
-        "Dynamic World": geemap.ee_tile_layer(dw, {}, "Dynamic World Land Cover"),
-        "ESA Land Cover": geemap.ee_tile_layer(esa, esa_vis, "ESA Land Cover"),
-        "ESRI Land Cover": geemap.ee_tile_layer(esri, esri_vis, "ESRI Land Cover"),
+        "Dynamic World": tile_layer(
+            "GOOGLE/DYNAMICWORLD/V1",
+            dynamic_world,
+            "Dynamic World Land Cover",
+            params=(start_date, end_date, "hillshade"),
+        ),
+        "ESA Land Cover": tile_layer(
+            ESA_DATASET,
+            lambda: ee.ImageCollection(ESA_DATASET).first(),
+            "ESA Land Cover",
+            vis=esa_vis,
+        ),
+        "ESRI Land Cover": tile_layer(
+            ESRI_DATASET,
+            lambda: ee.ImageCollection(ESRI_DATASET).mosaic(),
+            "ESRI Land Cover",
+            vis=esri_vis,
+        ),
     }
 
     options = list(layers.keys())
@@ -109,4 +153,5 @@ with col2:
 
 
 with col1:
+    proxy_layers(Map)
     Map.to_streamlit(height=750)
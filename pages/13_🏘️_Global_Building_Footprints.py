@@ -1,8 +1,23 @@
 import ee
 import geemap.foliumap as geemap
-import geopandas as gpd
+import shapely
 import streamlit as st
 
+from flood.cluster import x_lng, y_lat
+from flood.ee_layers import tile_layer
+from flood.footprints import (
+    bounds_zoom,
+    collection_center,
+    collection_id,
+    footprints_near,
+    has_extract,
+    load_regions,
+    region,
+)
+from flood.store import load_incidents
+from flood.tile_proxy import proxy_layers
+from flood.vector_tiles import TileSource, map_layer
+
 st.set_page_config(layout="wide")
 
 
@@ -31,25 +46,21 @@ st.title("Global Building Footprints")
 col1, col2 = st.columns([8, 2])
 
 
-@st.cache_data
-def read_data(url):
-    return gpd.read_file(url)
-
+@st.cache_resource
+def nearby_footprints(year, state, radius_m):
+    incidents = load_incidents(["Year", "State", "Latitude", "Longitude"])
+    selected = incidents[(incidents["Year"] == year)
+                         & (incidents["State"] == state)]
+    footprints = footprints_near(selected["Longitude"], selected["Latitude"],
+                                 radius_m)
+    if footprints.empty:
+        return None
+    return TileSource.from_geoseries(footprints.geometry, layer="footprints")
 
-countries = 'https://github.com/giswqs/geemap/raw/master/examples/data/countries.geojson'
-states = 'https://github.com/giswqs/geemap/raw/master/examples/data/us_states.json'
 
-countries_gdf = read_data(countries)
-states_gdf = read_data(states)
-
-country_names = countries_gdf['NAME'].values.tolist()
-country_names.remove('United States of America')
-country_names.append('USA')
-country_names.sort()
-country_names = [name.replace('.', '').replace(' ', '_')
-                 for name in country_names]
-
-state_names = states_gdf['name'].values.tolist()
+regions = load_regions()
+country_names = [entry["name"] for entry in regions["countries"]]
+state_names = [entry["name"] for entry in regions["states"]]
 
 basemaps = list(geemap.basemaps)
 
@@ -68,36 +79,65 @@ with col2:
         state = st.selectbox('Select a state', state_names,
                              index=state_names.index('Florida'))
         layer_name = state
-
-        try:
-            fc = ee.FeatureCollection(
-                f'projects/sat-io/open-datasets/MSBuildings/US/{state}')
-        except:
-            st.error('No data available for the selected state.')
-
+        selected = region('states', state)
     else:
-        try:
-            fc = ee.FeatureCollection(
-                f'projects/sat-io/open-datasets/MSBuildings/{country}')
-        except:
-            st.error('No data available for the selected country.')
-
+        state = None
         layer_name = country
+        selected = region('countries', country)
+
+    asset = collection_id(country, state)
 
     color = st.color_picker('Select a color', '#FF5500')
 
     style = {'fillColor': '00000000', 'color': color}
 
-    split = st.checkbox("Split-panel map")
+    def footprint_image():
+        return ee.FeatureCollection(asset).style(**style)
 
-    if split:
-        left = geemap.ee_tile_layer(fc.style(**style), {}, 'Left')
-        right = left
-        Map.split_map(left, right)
-    else:
-        Map.addLayer(fc.style(**style), {}, layer_name)
+    split = st.checkbox("Split-panel map")
 
-    Map.centerObject(fc.first(), zoom=16)
+    try:
+        layer = tile_layer(asset, footprint_image, layer_name,
+                           params=(color,))
+        if split:
+            Map.split_map(layer, layer)
+        else:
+            layer.add_to(Map)
+        # Centre on a building; the first lookup of a collection is kept
+        lon, lat = collection_center(asset)
+        Map.set_center(lon, lat, zoom=16)
+    except ee.EEException:
+        st.error(f'No data available for {layer_name}.')
+        lon, lat = selected['centroid']
+        Map.set_center(lon, lat, zoom=bounds_zoom(selected['bounds']))
+
+    if country == 'Malaysia' and has_extract():
+        near_incidents = st.checkbox(
+            "Footprints near flood incidents (local extract)")
+        if near_incidents:
+            incidents = load_incidents(["Year", "State", "Latitude",
+                                        "Longitude"])
+            years = sorted(incidents["Year"].unique().tolist())
+            year = st.selectbox("Year", years, index=len(years) - 1)
+            states = sorted(
+                incidents.loc[incidents["Year"] == year, "State"]
+                .dropna().astype(str).unique().tolist())
+            incident_state = st.selectbox("State", states)
+            radius_m = st.slider("Distance from incidents (m)", 50, 2000,
+                                 250, step=50)
+            source = nearby_footprints(year, incident_state, radius_m)
+            if source is None:
+                st.info("No footprints near the selected incidents.")
+            else:
+                st.caption(f"{len(source.geometries)} footprints")
+                # Buildings stay visible down to zoom 16 when embedded
+                map_layer(source, name="Footprints near incidents",
+                          style={"color": color}, zoom=16).add_to(Map)
+                # Tile geometries are in Web Mercator [0, 1], y down
+                left, top, right, bottom = shapely.total_bounds(
+                    source.geometries)
+                Map.fit_bounds([[y_lat(bottom), x_lng(left)],
+                                [y_lat(top), x_lng(right)]])
 
     with st.expander("Data Sources"):
         st.info(
@@ -109,4 +149,5 @@ with col2:
 
 with col1:
 
+    proxy_layers(Map)
     Map.to_streamlit(height=1000)
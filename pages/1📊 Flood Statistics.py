@@ -1,7 +1,9 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 
+from flood.cube import get_cube
+from flood.store import load_year_index
+
 st.set_page_config(layout="wide")
 
 st.sidebar.title("Resources:")
@@ -30,11 +32,10 @@ st.markdown(
 
 st.info("Scroll down to see some flood statistics! 👇")
 
-data = pd.read_csv("analytics/data2/all_states_all_years_geocoded.csv")
+cube = get_cube()
 
 # get the total incidents per year
-data1 = pd.DataFrame(data[['Year']])
-data1 = data1.groupby(['Year']).value_counts().reset_index(name='Total Incidents')
+data1 = cube.totals(['Year'])
 
 # plotting
 fig1 = px.bar(data1, x="Year", y="Total Incidents", color= "Year", title="Total Flood Incidents in Malaysia (2015- 2021)")
@@ -42,15 +43,10 @@ fig1 = px.bar(data1, x="Year", y="Total Incidents", color= "Year", title="Total
 st.plotly_chart(fig1, use_container_width=True)
 
 # get the total incidents per state
-data2 = pd.DataFrame(data[['Year', 'State']])
-data2 = data2.groupby(['Year', 'State']).value_counts().reset_index(name='Total Incidents')
-data2.head()
-
-button = st.slider("Year", 2015,2022,2015)
+years = load_year_index()
+button = st.slider("Year", years.first_year, years.last_year, years.first_year)
 
-data2 = data2[data2['Year'] == button]
-data2 = pd.DataFrame(data2[['State', 'Total Incidents']])
-data2.head()
+data2 = cube.totals(['State'], Year=button)
 
 # plot
 fig2 = px.bar(data2, x="State", y="Total Incidents", color = "State", title="Flood Incidents by State")
@@ -1,6 +1,12 @@
 import streamlit as st
-import leafmap.foliumap as leafmap
+import folium
 import pandas as pd
+import leafmap.foliumap as leafmap
+from streamlit_folium import st_folium
+
+from flood.cluster import ClusterIndex
+from flood.store import get_store, load_year_index
+from flood.tile_proxy import proxy_layers
 
 st.set_page_config(layout="wide")
 
@@ -22,48 +28,77 @@ st.sidebar.info(
 st.title("Marker Cluster Map")
 st.markdown(
     """
-    To reduce the amount of data we need to fit on the map, we'll use the marker cluster feature 
-    so that each cluster corresponds to flood incidents in a particular area. You can click on the cluster to zoom in and see the individual markers.
+    To reduce the amount of data we need to fit on the map, the flood incidents are clustered on the server
+    so that each cluster corresponds to flood incidents in a particular area. Zoom in on a cluster to see the individual markers.
     """
 )
 
-button = st.slider("Year", 2015,2022,2015)
-data = pd.read_csv('analytics/data2/all_states_all_years_geocoded.csv')
-data[['Year']] = data[['Year']].astype(int)
+years = load_year_index()
+first, last = st.slider("Year", years.first_year, years.last_year, (years.first_year, years.first_year))
+data = years.select_range(first, last)
 data = data[['Year', 'Date','State', 'Region', 'Place', 'Latitude','Longitude']]
 
-if button == 2015:
-    data = data[data['Year'] == 2015]
-elif button == 2016:
-    data = data[data['Year'] == 2016]
-elif button == 2017:
-    data = data[data['Year'] == 2017]
-elif button == 2018:
-    data = data[data['Year'] == 2018]
-elif button == 2019:
-    data = data[data['Year'] == 2019]
-elif button == 2020:
-    data = data[data['Year'] == 2020]
-elif button == 2021:
-    data = data[data['Year'] == 2021]
-else:
-    data = data[data['Year'] == 2022]
+
+# The store digest is part of the cache key, so the index is rebuilt after
+# an ingest or add_columns
+# One index per year range; older ranges and store versions are dropped
+@st.cache_resource(max_entries=16)
+def cluster_index(first, last, digest):
+    data = load_year_index().select_range(first, last)
+    return ClusterIndex(data["Longitude"], data["Latitude"])
+
+
+# The map reports its last viewport through the st_folium component value,
+# so only the clusters on screen at the current zoom are sent to the browser
+view = st.session_state.get("marker_cluster_map") or {}
+zoom = view.get("zoom") or 5
+bounds = view.get("bounds") or {}
+south_west = bounds.get("_southWest") or {"lat": -2.0, "lng": 92.0}
+north_east = bounds.get("_northEast") or {"lat": 10.0, "lng": 124.0}
+center = [
+    (south_west["lat"] + north_east["lat"]) / 2,
+    (south_west["lng"] + north_east["lng"]) / 2,
+]
+bbox = (south_west["lng"], south_west["lat"], north_east["lng"], north_east["lat"])
 
 with st.expander("Source Code (Click to Expand)"):
     with st.echo():
 
-        m = leafmap.Map(center=[4, 108], zoom=5)
-        
-        cities = data
+        m = leafmap.Map(center=center, zoom=zoom)
         regions = 'analytics/data2/countries.geojson'
-
         m.add_geojson(regions, layer_name="Malaysia")
-        m.add_points_from_xy(
-            cities,
-            x="Longitude",
-            y="Latitude",
-            icon_names=['gear', 'map', 'leaf', 'globe'],
-        )
+
+        clusters = cluster_index(first, last, get_store().digest).clusters(bbox, zoom)
+        markers = folium.FeatureGroup(name="Flood incidents")
+        for row in clusters.itertuples():
+            if row.point_id >= 0:
+                incident = data.iloc[row.point_id]
+                folium.Marker(
+                    location=[row.latitude, row.longitude],
+                    popup=folium.Popup(
+                        f"{incident['Place']}, {incident['Region']}, {incident['State']}<br>"
+                        # Rows whose report date could not be parsed are NaT
+                        f"{'Unknown date' if pd.isna(incident['Date']) else incident['Date'].date()}",
+                        max_width=300,
+                    ),
+                ).add_to(markers)
+            else:
+                size = 30 + 10 * min(len(str(row.count)), 4)
+                folium.Marker(
+                    location=[row.latitude, row.longitude],
+                    icon=folium.DivIcon(
+                        icon_size=(size, size),
+                        icon_anchor=(size // 2, size // 2),
+                        html=(
+                            f'<div style="width:{size}px;height:{size}px;line-height:{size}px;'
+                            'border-radius:50%;background:rgba(241,128,23,0.7);'
+                            f'text-align:center;font-weight:bold;">{row.count}</div>'
+                        ),
+                    ),
+                    tooltip=f"{row.count} incidents",
+                ).add_to(markers)
+        markers.add_to(m)
 
 
-m.to_streamlit(height=700)
+proxy_layers(m)
+st_folium(m, key="marker_cluster_map", height=700, width=None, returned_objects=["zoom", "bounds"])
@@ -1,6 +1,12 @@
+import base64
+
+import folium
 import streamlit as st
 import leafmap.foliumap as leafmap
-import pandas as pd
+
+from flood.heatmap import image_bounds, weight_columns, year_heatmap_png
+from flood.store import get_store
+from flood.tile_proxy import proxy_layers
 
 st.set_page_config(layout="wide")
 
@@ -29,42 +35,29 @@ st.markdown(
     """
 )
 
-button = st.slider("Year", 2015,2022,2015)
-data = pd.read_csv('analytics/data2/all_states_all_years_geocoded.csv')
-
-if button == 2015:
-    data = data[data['Year'] == 2015]
-elif button == 2016:
-    data = data[data['Year'] == 2016]
-elif button == 2017:
-    data = data[data['Year'] == 2017]
-elif button == 2018:
-    data = data[data['Year'] == 2018]
-elif button == 2019:
-    data = data[data['Year'] == 2019]
-elif button == 2020:
-    data = data[data['Year'] == 2020]
-elif button == 2021:
-    data = data[data['Year'] == 2021]
-else:
-    data = data[data['Year'] == 2022]
+store = get_store()
+years = store.year_index
+button = st.slider("Year", years.first_year, years.last_year, years.first_year)
+radius = st.slider("Radius (km)", 5, 50, 20, step=5)
+# only offer weights that exist in the incident data
+weights = weight_columns(store)
+weight = weights[st.selectbox("Weight", list(weights))]
 
 with st.expander("Source Code (Click to Expand)"):
     with st.echo():
 
-        filepath = "analytics/data2/Flood Data Updated Geocoded.csv"
         m = leafmap.Map(center=[4, 108], zoom=5)
         regions = 'analytics/data2/countries.geojson'
 
         m.add_geojson(regions, layer_name="Malaysia")
-        m.add_heatmap(
-            data,
-            latitude="Latitude",
-            longitude="Longitude",
+        # the density is rendered on the server and cached per year, radius and weight
+        png = year_heatmap_png(store, (button, button), radius_km=radius, weight=weight)
+        folium.raster_layers.ImageOverlay(
+            image="data:image/png;base64," + base64.b64encode(png).decode(),
+            bounds=image_bounds(),
             name="Heat map",
-            value = "Year", # becomes frequency: some place flood a few times in a year, but also affect by reporting duration (data collection part)
-            radius=20,
-        )
+        ).add_to(m)
 
 
+proxy_layers(m)
 m.to_streamlit(height=700)
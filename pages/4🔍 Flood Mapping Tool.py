@@ -1,19 +1,46 @@
 """Flood extent analysis page for Streamlit app."""
 import datetime as dt
+import json
+import os
 
 import ee
 import folium
 import geemap
 import geemap.foliumap as geemap
-import requests
 import streamlit as st
 import pandas as pd
 import geopandas as gpd
-from folium import GeoJson
 # import streamlit_ext as ste
 from folium.plugins import Draw, Geocoder, MiniMap
 from streamlit_folium import st_folium
 
+from flood.at_risk import FloodExposure, summarise
+from flood.costs import (
+    ADMISSION_TIMEOUT,
+    AdmissionTimeout,
+    admission,
+    describe,
+    flood_estimate,
+)
+from flood.extent import derive_flood_extents
+from flood.extent_cache import (
+    extent_key,
+    flood_extent_cache,
+    summarise_flood_extent,
+)
+from flood.extent_ee import export_flood_data
+from flood.exports import fetch_all, package, spool_dir
+from flood.store import load_year_index
+from flood.tasks import FINISHED_STATES, TaskMonitor, progress_recorder
+from flood.tile_proxy import proxy_layers
+from flood.tiling import is_size_limit, start_tiled_export
+from flood.vector_tiles import (
+    TileSource,
+    VectorTileLayer,
+    map_layer,
+    public_endpoint,
+)
+
 ####################################################
 params = {
     # Title browser tab
@@ -90,6 +117,12 @@ params = {
     "button_text_fontweight": "bold",
     "button_background_color": "#dae7f4",
 }
+# Download button label and MIME type of the exported files, by extension
+EXPORT_LABELS = {
+    ".zip": ("Download Flood Extent", "application/zip"),
+    ".tif": ("Download Raster Extent", "image/tif"),
+    ".geojson": ("Download Vector Extent", "application/geo+json"),
+}
 
 import ee
 import streamlit as st
@@ -121,375 +154,7 @@ def ee_initialize(force_use_service_account: bool = False):
         ee.Initialize(service_account_keys)
     else:
         ee.Initialize()
-    
-    import time
-
-import ee
-
-
-def _check_task_completed(task_id, verbose=False):
-    """
-    Return True if a task export completes successfully, else returns false.
-
-    Inputs:
-        task_id (str): Google Earth Engine task id
-
-    Returns:
-        boolean
-
-    """
-    status = ee.data.getTaskStatus(task_id)[0]
-    if status["state"] in (
-        ee.batch.Task.State.CANCELLED,
-        ee.batch.Task.State.FAILED,
-    ):
-        if "error_message" in status:
-            if verbose:
-                print(status["error_message"])
-        return True
-    elif status["state"] == ee.batch.Task.State.COMPLETED:
-        return True
-    return False
-
-
-def wait_for_tasks(task_ids, timeout=3600, verbose=False):
-    """
-    Wait for tasks to complete, fail, or timeout.
-
-    Wait for all active tasks if task_ids is not provided.
-    Note: Tasks will not be canceled after timeout, and
-    may continue to run.
-    Inputs:
-        task_ids (list):
-        timeout (int):
-
-    Returns:
-        None
-    """
-    start = time.time()
-    elapsed = 0
-    while elapsed < timeout or timeout == 0:
-        elapsed = time.time() - start
-        finished = [_check_task_completed(task) for task in task_ids]
-        if all(finished):
-            if verbose:
-                print(f"Tasks {task_ids} completed after {elapsed}s")
-            return True
-        time.sleep(5)
-    if verbose:
-        print(
-            f"Stopped waiting for {len(task_ids)} tasks \
-            after {timeout} seconds"
-        )
-    return False
-
-
-def export_flood_data(
-    flooded_area_vector,
-    flooded_area_raster,
-    image_before_flood,
-    image_after_flood,
-    region,
-    filename="flood_extents",
-    verbose=False,
-):
-    """
-    Export the results of derive_flood_extents function to Google Drive.
-
-    Inputs:
-        flooded_area_vector (ee.FeatureCollection): Detected flood extents as
-            vector geometries.
-        flooded_area_raster (ee.Image): Detected flood extents as a binary
-            raster.
-        image_before_flood (ee.Image): The 'before' Sentinel-1 image.
-        image_after_flood (ee.Image): The 'after' Sentinel-1 image containing
-            view of the flood waters.
-        region (ee.Geometry.Polygon): Geographic extent of analysis area.
-        filename (str): Desired filename prefix for exported files
-
-    Returns:
-        None
-    """
-    if verbose:
-        print(
-            "Exporting detected flood extents to your Google Drive. \
-            Please wait..."
-        )
-    s1_before_task = ee.batch.Export.image.toDrive(
-        image=image_before_flood,
-        description="export_before_s1_scene",
-        scale=30,
-        region=region,
-        fileNamePrefix=filename + "_s1_before",
-        crs="EPSG:4326",
-        fileFormat="GeoTIFF",
-    )
-
-    s1_after_task = ee.batch.Export.image.toDrive(
-        image=image_after_flood,
-        description="export_flooded_s1_scene",
-        scale=30,
-        region=region,
-        fileNamePrefix=filename + "_s1_after",
-        crs="EPSG:4326",
-        fileFormat="GeoTIFF",
-    )
-
-    raster_task = ee.batch.Export.image.toDrive(
-        image=flooded_area_raster,
-        description="export_flood_extents_raster",
-        scale=30,
-        region=region,
-        fileNamePrefix=filename + "_raster",
-        crs="EPSG:4326",
-        fileFormat="GeoTIFF",
-    )
-
-    vector_task = ee.batch.Export.table.toDrive(
-        collection=flooded_area_vector,
-        description="export_flood_extents_polygons",
-        fileFormat="shp",
-        fileNamePrefix=filename + "_polygons",
-    )
-
-    s1_before_task.start()
-    s1_after_task.start()
-    raster_task.start()
-    vector_task.start()
-
-    if verbose:
-        print("Exporting before Sentinel-1 scene: Task id ", s1_before_task.id)
-        print("Exporting flooded Sentinel-1 scene: Task id ", s1_after_task.id)
-        print("Exporting flood extent geotiff: Task id ", raster_task.id)
-        print("Exporting flood extent shapefile:  Task id ", vector_task.id)
-
-    wait_for_tasks(
-        [s1_before_task.id, s1_after_task.id, raster_task.id, vector_task.id]
-    )
-
-
-def retrieve_image_collection(
-    search_region,
-    start_date,
-    end_date,
-    polarization="VH",
-    pass_direction="Ascending",
-):
-    """
-    Retrieve Sentinel-1 immage collection from Google Earth Engine.
-
-    Inputs:
-        search_region (ee.Geometry.Polygon): Geographic extent of image search.
-        start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
-        end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
-        polarization (str): Synthetic aperture radar polarization mode, e.g.,
-            'VH' or 'VV'. VH is mostly is the preferred polarization for
-            flood mapping.
-        pass_direction (str): Synthetic aperture radar pass direction, either
-            'Ascending' or 'Descending'.
-
-    Returns:
-        collection (ee.ImageCollection): Sentinel-1 images matching the search
-        criteria.
-    """
-    collection = (
-        ee.ImageCollection("COPERNICUS/S1_GRD")
-        .filter(ee.Filter.eq("instrumentMode", "IW"))
-        .filter(
-            ee.Filter.listContains(
-                "transmitterReceiverPolarisation", polarization
-            )
-        )
-        .filter(ee.Filter.eq("orbitProperties_pass", pass_direction.upper()))
-        .filter(ee.Filter.eq("resolution_meters", 10))
-        .filterDate(start_date, end_date)
-        .filterBounds(search_region)
-        .select(polarization)
-    )
-
-    return collection
-
-
-def smooth(image, smoothing_radius=50):
-    """
-    Reduce the radar speckle by smoothing.
-
-    Inputs:
-        image (ee.Image): Input image.
-        smoothing_radius (int): The radius of the kernel to use for focal mean
-            smoothing.
-
-    Returns:
-        smoothed_image (ee.Image): The resulting image after smoothing is
-            applied.
-    """
-    smoothed_image = image.focal_mean(
-        radius=smoothing_radius, kernelType="circle", units="meters"
-    )
-
-    return smoothed_image
-
-
-def mask_permanent_water(image):
-    """
-    Query the JRC Global Surface Water Mapping Layers, v1.3.
-
-    The goal is to determine where perennial water bodies (water > 10
-    months/yr), and mask these areas.
-    Inputs:
-        image (ee.Image): Input image.
-
-    Returns:
-        masked_image (ee.Image): The resulting image after surface water
-        masking is applied.
-    """
-    surface_water = ee.Image("JRC/GSW1_4/GlobalSurfaceWater").select(
-        "seasonality"
-    )
-    surface_water_mask = surface_water.gte(10).updateMask(
-        surface_water.gte(10)
-    )
-
-    # Flooded layer where perennial water bodies(water > 10 mo / yr) is
-    # assigned a 0 value
-    where_surface_water = image.where(surface_water_mask, 0)
-
-    masked_image = image.updateMask(where_surface_water)
-
-    return masked_image
-
-
-def reduce_noise(image):
-    """
-    Reduce noise in the image.
-
-    Compute connectivity of pixels to eliminate those connected to 8 or fewer
-    neighbours.
-    Inputs:
-        image (ee.Image): A binary image.
-
-    Returns:
-        reduced_noise_image (ee.Image): The resulting image after noise
-            reduction is applied.
-    """
-    connections = image.connectedPixelCount()
-    reduced_noise_image = image.updateMask(connections.gte(8))
-
-    return reduced_noise_image
-
-
-def mask_slopes(image):
-    """
-    Mask out areas with more than 5 % slope with a Digital Elevation Model.
-
-    Inputs:
-        image (ee.Image): Input image.
-    Returns:
-         slopes_masked (ee.Image): The resulting image after slope masking is
-            applied.
-    """
-    dem = ee.Image("WWF/HydroSHEDS/03VFDEM")
-    terrain = ee.Algorithms.Terrain(dem)
-    slope = terrain.select("slope")
-    slopes_masked = image.updateMask(slope.lt(5))
-
-    return slopes_masked
-
-
-def derive_flood_extents(
-    aoi,
-    before_start_date,
-    before_end_date,
-    after_start_date,
-    after_end_date,
-    difference_threshold=1.25,
-    polarization="VH",
-    pass_direction="Ascending",
-    export=False,
-    export_filename="flood_extents",
-):
-    """
-    Set start and end dates of a period BEFORE and AFTER a flood.
 
-    These periods need to be long enough for Sentinel-1 to acquire an image.
-
-    Inputs:
-        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
-        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
-        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
-        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
-        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
-        difference_threshold (float): Threshold to be applied on the
-            differenced image (after flood - before flood). It has been chosen
-            by trial and error. In case your flood extent result shows many
-            false-positive or negative signals, consider changing it.
-        export (bool): Flag to export derived flood extents to Google Drive
-        export_filename (str): Desired filename prefix for exported files. Only
-            used if export=True.
-
-    Returns:
-        flood_vectors (ee.FeatureCollection): Detected flood extents as vector
-            geometries.
-        flood_rasters (ee.Image): Detected flood extents as a binary raster.
-        before_filtered (ee.Image): The 'before' Sentinel-1 image.
-        after_filtered (ee.Image): The 'after' Sentinel-1 image containing view
-            of the flood waters.
-    """
-    before_flood_img_col = retrieve_image_collection(
-        search_region=aoi,
-        start_date=before_start_date,
-        end_date=before_end_date,
-        polarization=polarization,
-        pass_direction=pass_direction,
-    )
-    after_flood_img_col = retrieve_image_collection(
-        search_region=aoi,
-        start_date=after_start_date,
-        end_date=after_end_date,
-        polarization=polarization,
-        pass_direction=pass_direction,
-    )
-
-    # Create a mosaic of selected tiles and clip to study area
-    before_mosaic = before_flood_img_col.mosaic().clip(aoi)
-    after_mosaic = after_flood_img_col.mosaic().clip(aoi)
-
-    before_filtered = smooth(before_mosaic)
-    after_filtered = smooth(after_mosaic)
-
-    # Calculate the difference between the before and after images
-    difference = after_filtered.divide(before_filtered)
-
-    # Apply the predefined difference - threshold and create the flood extent
-    # mask
-    difference_binary = difference.gt(difference_threshold)
-    difference_binary_masked = mask_permanent_water(difference_binary)
-    difference_binary_masked_reduced_noise = reduce_noise(
-        difference_binary_masked
-    )
-    flood_rasters = mask_slopes(difference_binary_masked_reduced_noise)
-
-    # Export the extent of detected flood in vector format
-    flood_vectors = flood_rasters.reduceToVectors(
-        scale=10,
-        geometryType="polygon",
-        geometry=aoi,
-        eightConnected=False,
-        bestEffort=True,
-        tileScale=2,
-    )
-
-    if export:
-        export_flood_data(
-            flooded_area_vector=flood_vectors,
-            flooded_area_raster=flood_rasters,
-            image_before_flood=before_filtered,
-            image_after_flood=after_filtered,
-            region=aoi,
-            filename=export_filename,
-        )
-
-    return flood_vectors, flood_rasters, before_filtered, after_filtered
 
 import base64
 import os
@@ -746,6 +411,101 @@ def add_about():
         % (params["about_box_background_color"], contacts_text),
         unsafe_allow_html=True,
     )
+
+
+def add_flood_layers(Map, result, flood_tiles=None):
+    """
+    Add the cached flood extent tile layers to a map.
+
+    Inputs:
+        Map (geemap.Map): Map to add the layers to.
+        result (FloodExtentResult): Output of summarise_flood_extent.
+        flood_tiles (TileSource): Flood polygons as vector tiles; the
+            Earth Engine rendering of the polygons is used without them.
+    Returns:
+        None
+    """
+    Map.add_tile_layer(
+        tiles=result.raster_tile_url,
+        name="Flood extent raster",
+        attribution="Google Earth Engine",
+    )
+    if flood_tiles is None:
+        Map.add_tile_layer(
+            tiles=result.vector_tile_url,
+            name="Flood extent vector",
+            attribution="Google Earth Engine",
+        )
+    else:
+        VectorTileLayer(
+            flood_tiles,
+            name="Flood extent vector",
+            style={"color": "#0000FF", "fillColor": "#0000FF"},
+        ).add_to(Map)
+
+
+def queue_status(placeholder):
+    """
+    Return an on_wait callback of flood.costs.admission for a page.
+
+    Updating the placeholder while the request waits also lets Streamlit
+    stop the script on a rerun, which takes the request out of the queue.
+
+    Inputs:
+        placeholder: st.empty() element the queue position is shown in.
+    Returns:
+        callable
+    """
+
+    def on_wait(position):
+        placeholder.info(
+            f"Queued (position {position}) behind other heavy Earth Engine "
+            "requests..."
+        )
+
+    return on_wait
+
+
+BUSY_MESSAGE = (
+    "Earth Engine is busy with other heavy requests. {} Please try again "
+    "in a few minutes."
+)
+
+
+@st.cache_resource
+def flood_exposure(key, _result):
+    """
+    Flood polygons of an analysis prepared for the at-risk overlay.
+
+    Inputs:
+        key (str): extent_key of the analysis, the cache key.
+        _result (FloodExtentResult): The analysis (not hashed).
+    Returns:
+        FloodExposure
+    """
+    if _result.vector_geojson is None:
+        return FloodExposure([])
+    return FloodExposure.from_geojson(_result.vector_geojson)
+
+
+@st.cache_resource
+def buffer_tiles(key, year, radius_m, _exposure):
+    """
+    Buffers around the incidents of a year, as vector tiles.
+
+    Inputs:
+        key (str): extent_key of the analysis whose projection is used.
+        year (int): Incident year.
+        radius_m (float): Buffer radius in metres.
+        _exposure (FloodExposure): Projection of the analysis (not hashed).
+    Returns:
+        TileSource
+    """
+    cities = load_year_index().select(year)
+    return TileSource(
+        _exposure.buffers(cities.Longitude, cities.Latitude, radius_m),
+        layer="buffers",
+    )
 #####################################################
 
 # Page configuration
@@ -826,6 +586,7 @@ with col1:
         # Add minimap to map
         MiniMap().add_to(Map)
         # Export map to Streamlit
+        proxy_layers(Map)
         output = st_folium(Map, width=800, height=600)
 with col2:
     # Add collapsable container for image dates
@@ -880,14 +641,25 @@ with col2:
             ["Ascending", "Descending"],
             on_change=callback,
         )
-    # Button for computation
-    submitted = st.button("Compute flood extent")
     # Introduce date validation
     check_dates = before_start < before_end <= after_start < after_end
     # Introduce drawing validation (a polygon needs to exist)
     check_drawing = (
         output["all_drawings"] != [] and output["all_drawings"] is not None
     )
+    # Show the cost of the analysis before it is submitted
+    flood_cost = None
+    if check_dates and check_drawing:
+        flood_cost = flood_estimate(
+            output["all_drawings"][-1]["geometry"]["coordinates"][0],
+            before_start,
+            before_end,
+            after_start,
+            after_end,
+        )
+        st.caption(f"Estimated cost: {describe(flood_cost)}.")
+    # Button for computation
+    submitted = st.button("Compute flood extent")
 # What happens when button is clicked on?
 if submitted:
     with col2:
@@ -910,8 +682,8 @@ if submitted:
                 (
                     detected_flood_vector,
                     detected_flood_raster,
-                    _,
-                    _,
+                    before_filtered,
+                    after_filtered,
                 ) = derive_flood_extents(
                     aoi=ee_geom_region,
                     before_start_date=str(before_start),
@@ -923,26 +695,39 @@ if submitted:
                     pass_direction=pass_direction,
                     export=False,
                 )
-                # Create output map
-                Map2 = geemap.Map(
-                    # basemap="HYBRID",
-                    plugin_Draw=False,
-                    Draw_export=False,
-                    locate_control=False,
-                    plugin_LatLngPopup=False,
+                # Evaluate the graph on Earth Engine, or reuse the result of
+                # an identical earlier analysis (from any session)
+                key = extent_key(
+                    coords,
+                    before_start,
+                    before_end,
+                    after_start,
+                    after_end,
+                    add_slider,
+                    "VH",
+                    pass_direction,
                 )
+
+                queued = st.empty()
+
+                def compute():
+                    # Heavy analyses wait for the other heavy requests
+                    with admission.admit(
+                        flood_cost, ADMISSION_TIMEOUT, queue_status(queued)
+                    ):
+                        queued.empty()
+                        return summarise_flood_extent(
+                            detected_flood_vector,
+                            detected_flood_raster,
+                            ee_geom_region,
+                            coords,
+                        )
+
                 try:
-                    # Add flood vector layer to map
-                    Map2.add_layer(
-                        ee_object=detected_flood_raster,
-                        name="Flood extent raster",
-                    )
-                    Map2.add_layer(
-                        ee_object=detected_flood_vector,
-                        name="Flood extent vector",
-                    )
-                    # Center map on flood raster
-                    Map2.centerObject(detected_flood_raster)
+                    result = flood_extent_cache.get_or_compute(key, compute)
+                except AdmissionTimeout as error:
+                    queued.empty()
+                    st.error(BUSY_MESSAGE.format(error))
                 except ee.EEException:
                     # If error contains the sentence below, it means that
                     # an image could not be properly generated
@@ -959,11 +744,42 @@ if submitted:
                         """
                     )
                 else:
+                    # Create output map
+                    Map2 = geemap.Map(
+                        # basemap="HYBRID",
+                        plugin_Draw=False,
+                        Draw_export=False,
+                        locate_control=False,
+                        plugin_LatLngPopup=False,
+                    )
+                    # Flood polygons are drawn from vector tiles when
+                    # Earth Engine could return them and browsers can reach
+                    # the tile endpoint; Earth Engine renders them otherwise
+                    flood_tiles = (
+                        None
+                        if result.vector_geojson is None
+                        or not public_endpoint()
+                        else TileSource.from_geojson(
+                            result.vector_geojson, layer="flood"
+                        )
+                    )
+                    add_flood_layers(Map2, result, flood_tiles)
+                    # Center map on the analysis area
+                    Map2.fit_bounds(result.bounds)
                     # If computation was succesfull, save outputs for
                     # output map
                     st.success("Computation complete")
+                    if result.flooded_area_km2 is not None:
+                        st.metric(
+                            "Detected flood extent",
+                            f"{result.flooded_area_km2:,.1f} km²",
+                        )
                     st.session_state.output_created = True
                     st.session_state.Map2 = Map2
+                    st.session_state.flood_extent = result
+                    st.session_state.flood_tiles = flood_tiles
+                    st.session_state.flood_key = key
+                    st.session_state.flood_cost = flood_cost
                     st.session_state.detected_flood_raster = (
                         detected_flood_raster
                     )
@@ -971,117 +787,233 @@ if submitted:
                         detected_flood_vector
                     )
                     st.session_state.ee_geom_region = ee_geom_region
+                    st.session_state.before_filtered = before_filtered
+                    st.session_state.after_filtered = after_filtered
+                    st.session_state.flood_params = dict(
+                        aoi=coords,
+                        before_start_date=str(before_start),
+                        before_end_date=str(before_end),
+                        after_start_date=str(after_start),
+                        after_end_date=str(after_end),
+                        difference_threshold=add_slider,
+                        polarization="VH",
+                        pass_direction=pass_direction,
+                    )
 # If computation was successful, create output map in bottom panel
 if st.session_state.output_created:
     with row2:
         # Add collapsable container for output map
         with st.expander("Output map", expanded=True):
             # Export Map2 to streamlit
+            proxy_layers(st.session_state.Map2)
             st.session_state.Map2.to_streamlit()
+            package_zip = st.checkbox(
+                "Package as Cloud-Optimised GeoTIFF + FlatGeobuf (zip)"
+            )
             # Create button to export to file
             submitted2 = st.button("Export to file")
             # What happens if button is clicked on?
             if submitted2:
                 # Add output for computation
                 with st.spinner("Computing... Please wait..."):
+                    filename = "flood_extent"
+                    timestamp = dt.datetime.now().strftime("%Y-%m-%d_%H-%M")
+                    # Downloads are streamed to a spool directory on disk
+                    # rather than held in memory
+                    directory = spool_dir()
+                    raster_path = os.path.join(
+                        directory, f"{filename}_raster_{timestamp}.tif"
+                    )
+                    vector_path = os.path.join(
+                        directory, f"{filename}_vector_{timestamp}.geojson"
+                    )
+                    zip_path = (
+                        os.path.join(directory, f"{filename}_{timestamp}.zip")
+                        if package_zip
+                        else None
+                    )
+                    queued = st.empty()
                     try:
-                        # Get download url for raster data
-                        raster = st.session_state.detected_flood_raster
-                        url_r = raster.getDownloadUrl(
-                            {
-                                "region": st.session_state.ee_geom_region,
-                                "scale": 30,
-                                "format": "GEO_TIFF",
-                            }
-                        )
-                    except Exception:
-                        st.error(
-                            """
-                            The image size is too big for the image to
-                            be exported to file. Select a smaller area
-                            of interest (side <~ 150km) and repeat the
-                            analysis.
-                            """
-                        )
+                        with admission.admit(
+                            st.session_state.flood_cost,
+                            ADMISSION_TIMEOUT,
+                            queue_status(queued),
+                        ):
+                            queued.empty()
+                            try:
+                                # Get download url for raster data
+                                raster = st.session_state.detected_flood_raster
+                                url_r = raster.getDownloadUrl(
+                                    {
+                                        "region": st.session_state.ee_geom_region,
+                                        "scale": 30,
+                                        "format": "GEO_TIFF",
+                                    }
+                                )
+                            except ee.EEException as error:
+                                if not is_size_limit(error):
+                                    raise
+                                # The area is too big for a single download:
+                                # run the analysis again tile by tile at full
+                                # resolution on a background thread; progress
+                                # shows up on the next rerun
+                                st.session_state.export_files = []
+                                st.session_state.tiled_export = start_tiled_export(
+                                    st.session_state.flood_params,
+                                    raster_path,
+                                    vector_path,
+                                    zip_path,
+                                )
+                            else:
+                                # Get download url for vector data
+                                vector = st.session_state.detected_flood_vector
+                                url_v = vector.getDownloadUrl("GEOJSON")
+                                fetch_all(
+                                    {
+                                        os.path.basename(raster_path): url_r,
+                                        os.path.basename(vector_path): url_v,
+                                    },
+                                    directory,
+                                )
+                                st.session_state.tiled_export = None
+                                if package_zip:
+                                    package(raster_path, vector_path, zip_path)
+                                    st.session_state.export_files = [zip_path]
+                                else:
+                                    st.session_state.export_files = [
+                                        raster_path,
+                                        vector_path,
+                                    ]
+                                # Output for computation complete
+                                st.success("Computation complete")
+                    except AdmissionTimeout as error:
+                        queued.empty()
+                        st.error(BUSY_MESSAGE.format(error))
+            # Tiled exports run in the background
+            tiled_export = st.session_state.get("tiled_export")
+            if tiled_export:
+                if tiled_export["finished"]:
+                    if tiled_export["error"]:
+                        st.error(f"Tiled export failed: {tiled_export['error']}")
                     else:
-                        response_r = requests.get(url_r)
-                        # Get download url for raster data
-                        vector = st.session_state.detected_flood_vector
-                        url_v = vector.getDownloadUrl("GEOJSON")
-                        response_v = requests.get(url_v)
-                        filename = "flood_extent"
-                        timestamp = dt.datetime.now().strftime(
-                            "%Y-%m-%d_%H-%M"
-                        )
-                        # with row2:
-                            # Create download buttons for raster and vector
-                            # data
-                            # with open("flood_extent.tif", "wb"):
-                                # ste.download_button(
-                                    # label="Download Raster Extent",
-                                    # data=response_r.content,
-                                    # file_name=(
-                                        # f"{filename}"
-                                        # "_raster_"
-                                        # f"{timestamp}"
-                                       #  ".tif"
-                                    # )# ,
-                                    # mime="image/tif",
-                                # )
-                            # with open("flood_extent.geojson", "wb"):
-                                # ste.download_button(
-                                    # label="Download Vector Extent",
-                                    # data=response_v.content,
-                                    # file_name=(
-                                        # f"{filename}"
-                                        # "_vector_"
-                                        # f"{timestamp}"
-                                       #  ".geojson"
-                                    # )# ,
-                                    # mime="text/json",
-                                # )
-                        # Output for computation complete
+                        st.session_state.export_files = tiled_export["files"]
                         st.success("Computation complete")
+                    st.session_state.tiled_export = None
+                else:
+                    done, total = tiled_export["done"], tiled_export["total"]
+                    st.progress(done / total if total else 0.0)
+                    st.caption(
+                        "The area is too big for a single download; it is "
+                        f"exported tile by tile ({done}/{total or '?'} tiles)"
+                    )
+                    st.button("Refresh export status")
+            # Create download buttons for raster and vector data, served
+            # from the spooled files. A download button reads its whole
+            # file on every rerun, so it is only built for the file asked
+            # for, until that file is downloaded
+            for path in st.session_state.get("export_files", []):
+                if not os.path.exists(path):
+                    continue
+                label, mime = EXPORT_LABELS[os.path.splitext(path)[1]]
+                size = os.path.getsize(path) / 1e6
+                prepared = st.session_state.get("prepared_export") == path
+                if not prepared and not st.button(
+                    f"Prepare: {label} ({size:,.1f} MB)", key=f"prepare {path}"
+                ):
+                    continue
+                st.session_state.prepared_export = path
+                with open(path, "rb") as f:
+                    if st.download_button(
+                        label=label,
+                        data=f,
+                        file_name=os.path.basename(path),
+                        mime=mime,
+                        key=f"download {path}",
+                    ):
+                        st.session_state.prepared_export = None
+            # Drive exports run as Earth Engine tasks, followed on a
+            # background thread; progress shows up on the next rerun
+            if st.button("Export to Google Drive"):
+                task_ids = export_flood_data(
+                    flooded_area_vector=st.session_state.detected_flood_vector,
+                    flooded_area_raster=st.session_state.detected_flood_raster,
+                    image_before_flood=st.session_state.before_filtered,
+                    image_after_flood=st.session_state.after_filtered,
+                    region=st.session_state.ee_geom_region,
+                    wait=False,
+                )
+                st.session_state.export_progress = {"task_ids": task_ids}
+                TaskMonitor(
+                    task_ids,
+                    on_progress=progress_recorder(
+                        st.session_state.export_progress
+                    ),
+                ).start()
+            progress = st.session_state.get("export_progress")
+            if progress:
+                states = progress.get("states", {})
+                finished = sum(
+                    state in FINISHED_STATES for state in states.values()
+                )
+                st.progress(finished / len(progress["task_ids"]))
+                st.caption(
+                    ", ".join(f"{task}: {state}" for task, state in states.items())
+                    or "Export tasks submitted"
+                )
+                for error in progress.get("errors", {}).values():
+                    st.error(error)
+                if progress.get("error"):
+                    st.warning(
+                        f"Could not get the export status: {progress['error']}"
+                    )
+                if progress.get("finished"):
+                    st.success("Export to Google Drive complete")
+                else:
+                    st.button("Refresh export status")
 
 with st.expander("Further Analysis", expanded=False):
     if st.session_state.output_created:
         m = geemap.Map(center=(4, 108), zoom=4)
-        cities = pd.read_csv("analytics/data2/all_states_all_years_geocoded.csv")
-        cities = cities[['Name', 'Latitude', 'Longitude', 'Year']]
-        
-        button = st.slider("Year", 2015,2022,2015)
-        
-        if button == 2015:
-            cities = cities[cities['Year'] == 2015]
-        elif button == 2016:
-            cities = cities[cities['Year'] == 2016]
-        elif button == 2017:
-            cities = cities[cities['Year'] == 2017]
-        elif button == 2018:
-            cities = cities[cities['Year'] == 2018]
-        elif button == 2019:
-            cities = cities[cities['Year'] == 2019]
-        elif button == 2020:
-            cities = cities[cities['Year'] == 2020]
-        elif button == 2021:
-            cities = cities[cities['Year'] == 2021]
-        else:
-            cities = cities[cities['Year'] == 2022]
+        years = load_year_index()
+        button = st.slider("Year", years.first_year, years.last_year, years.first_year)
+        cities = years.select(button)[['Name', 'State', 'Region', 'Latitude', 'Longitude', 'Year']]
         
         slider = st.slider(
-            label="Select Radius Size: Deafult 0.001",
-            min_value=0.001,
-            max_value=0.01,
-            value=0.001,
-            step=0.001,
+            label="Select Radius Size (m): Default 500",
+            min_value=100,
+            max_value=5000,
+            value=500,
+            step=100,
         ) # to run this need a new loop 
         
         def getData(slider):
             return slider
         
-        data = gpd.GeoDataFrame(cities, geometry = gpd.points_from_xy(cities.Longitude, cities.Latitude), crs = "EPSG:4326")
-        two_mile_buffer = data.geometry.buffer(getData(slider))
-        st.write("Radius Size = ", getData(slider))
+        st.write("Radius Size = ", getData(slider), "m")
+        
+        # Intersect incident buffers (in metres) with the flood polygons
+        exposure = flood_exposure(
+            st.session_state.flood_key, st.session_state.flood_extent
+        )
+        if st.session_state.flood_extent.vector_geojson is None:
+            st.warning(
+                "The flood extent has too many polygons to assess the "
+                "incidents at risk; select a smaller area."
+            )
+        else:
+            assessed = exposure.assess(cities, getData(slider))
+            summary = summarise(assessed)
+            st.metric(
+                "Incidents at risk",
+                f"{int(assessed['At Risk'].sum()):,} of {len(assessed):,}",
+            )
+            st.dataframe(summary)
+            st.download_button(
+                label="Download Incidents At Risk",
+                data=assessed.to_csv(index=False),
+                file_name=f"incidents_at_risk_{button}_{getData(slider)}m.csv",
+                mime="text/csv",
+            )
         
         m.add_points_from_xy(
             cities, 
@@ -1100,19 +1032,21 @@ with st.expander("Further Analysis", expanded=False):
         # )
         
         # add layer code section
-        m.add_geojson(GeoJson(two_mile_buffer.geometry.to_crs(epsg=4326)).data, fill_colors=['blue'], layer_name = "Asset At Risk")
+        # Buffers are served as vector tiles instead of inline GeoJSON
+        # when the tile endpoint is public
+        map_layer(
+            buffer_tiles(
+                st.session_state.flood_key, button, getData(slider), exposure
+            ),
+            name="Asset At Risk",
+            style={"color": "blue", "fillColor": "blue"},
+        ).add_to(m)
         ############################
         
-        detected_flood_raster = st.session_state.detected_flood_raster
-        detected_flood_vector = st.session_state.detected_flood_vector
-        m.add_layer(
-            ee_object=detected_flood_raster,
-            name="Flood extent raster",
-        )
-        m.add_layer(
-            ee_object=detected_flood_vector,
-            name="Flood extent vector",
+        add_flood_layers(
+            m, st.session_state.flood_extent, st.session_state.flood_tiles
         )
+        proxy_layers(m)
         m.to_streamlit(height = 700)
     else:
         st.error("Error: No output created yet.")
\ No newline at end of file
@@ -1,8 +1,8 @@
 import ee
 import os
+import time
 import warnings
 import datetime
-import fiona
 import geopandas as gpd
 import folium
 import streamlit as st
@@ -11,6 +11,25 @@ import geemap.foliumap as geemap
 from datetime import date
 from shapely.geometry import Polygon
 
+from flood.costs import (
+    REVISIT_DAYS,
+    describe,
+    images_per_frame,
+    timelapse_estimate,
+)
+from flood.renders import (
+    FAILED,
+    OUT_GIF,
+    QUEUED,
+    ROI,
+    RUNNING,
+    render_queue,
+    roi_geojson,
+)
+from flood.roi import fit_dimensions, frame_count, prepare_roi, thumbnail_size
+from flood.tile_proxy import proxy_layers
+from flood.uploads import read_upload
+
 st.set_page_config(layout="wide")
 warnings.filterwarnings("ignore")
 
@@ -206,28 +225,124 @@ ocean_rois = {
 }
 
 
-@st.cache_data
-def uploaded_file_to_gdf(data):
-    import tempfile
-    import os
-    import uuid
+# Seconds between two looks at a running render job
+POLL_INTERVAL = 2
+# Minutes between two GOES scans, i.e. timelapse frames
+GOES_SCAN_MINUTES = {"full_disk": 10, "conus": 5, "mesoscale": 1}
+
+
+def submit_timelapse(form, function, args=(), kwargs=None, reduce=False, cost=None):
+    """Queue a render of the current ROI and remember it for the form."""
+    key = render_queue.submit(
+        function,
+        args,
+        kwargs,
+        roi=st.session_state.get("roi_geojson"),
+        reduce=reduce,
+        cost=cost,
+    )
+    st.session_state.setdefault("timelapse_jobs", {})[form] = key
+    return key
 
-    _, file_extension = os.path.splitext(data.name)
-    file_id = str(uuid.uuid4())
-    file_path = os.path.join(tempfile.gettempdir(), f"{file_id}{file_extension}")
 
-    with open(file_path, "wb") as file:
-        file.write(data.getbuffer())
+def forget_timelapse(form):
+    st.session_state.get("timelapse_jobs", {}).pop(form, None)
 
-    if file_path.lower().endswith(".kml"):
-        fiona.drvsupport.supported_drivers["KML"] = "rw"
-        gdf = gpd.read_file(file_path, driver="KML")
-    else:
-        gdf = gpd.read_file(file_path)
 
+def use_roi(gdf):
+    """
+    Repair and simplify an ROI and make it the one of the renders.
+
+    Returns:
+        gpd.GeoDataFrame: The ROI sent to Earth Engine.
+    """
+    gdf, report = prepare_roi(gdf)
+    st.session_state["roi"] = geemap.gdf_to_ee(gdf, geodesic=False)
+    st.session_state["roi_geojson"] = roi_geojson(gdf)
+    st.session_state["roi_bounds"] = tuple(gdf.total_bounds)
+    if report.repaired:
+        st.caption(f"{report.repaired} invalid ROI geometries were repaired.")
+    if report.simplified_vertices < report.vertices:
+        st.caption(
+            f"ROI simplified from {report.vertices:,} to "
+            f"{report.simplified_vertices:,} vertices for Earth Engine."
+        )
     return gdf
 
 
+def plan_timelapse(form, empty_text, frames, images=1, dimensions=768):
+    """
+    Estimate the cost of a render, and fit its output size to it.
+
+    Inputs:
+        frames (int): See flood.roi.frame_count.
+        images (int): Source images per frame, see flood.costs.images_per_frame.
+
+    Returns:
+        (int, CostEstimate): Longest side of the timelapse in pixels, None
+        when the render would time out even downscaled, and its estimate.
+    """
+    bounds = st.session_state.get("roi_bounds")
+    if bounds is None:
+        return dimensions, None
+    width, height = thumbnail_size(bounds, dimensions)
+    fitted = fit_dimensions(bounds, frames, dimensions)
+    if fitted is None:
+        forget_timelapse(form)
+        empty_text.error(
+            f"This timelapse would render {frames:,} frames of {width}x{height} "
+            f"pixels ({width * height * frames / 1e6:,.0f} million pixels), "
+            "too much for Earth Engine even at a lower resolution. Shorten "
+            "the date range, lower the temporal frequency or use a smaller ROI."
+        )
+        return None, None
+    if fitted < dimensions:
+        st.info(
+            f"{frames:,} frames of {width}x{height} pixels is too much for "
+            f"Earth Engine; the timelapse is rendered at {fitted} pixels instead."
+        )
+    cost = timelapse_estimate(bounds, fitted, frames, images)
+    st.caption(f"Estimated cost: {describe(cost)}.")
+    return fitted, cost
+
+
+def show_timelapse(form, empty_text, empty_image, empty_video, error):
+    """
+    Wait for the render job of a form and show its GIF and MP4.
+
+    The job keeps running in the background if the page is left, and is
+    shown when the session comes back.
+
+    Returns:
+        RenderStatus or None when the form has no job.
+    """
+    key = st.session_state.get("timelapse_jobs", {}).get(form)
+    if key is None:
+        return None
+    status = render_queue.status(key)
+    while status is not None and status.state in (QUEUED, RUNNING):
+        empty_text.text(
+            f"Computing... Please wait... ({status.state}, "
+            f"{status.elapsed:.0f} s)"
+        )
+        time.sleep(POLL_INTERVAL)
+        status = render_queue.status(key)
+    if status is None:
+        return None
+    if status.state == FAILED:
+        empty_text.error(error)
+        return status
+    empty_text.text("Right click the GIF to save it to your computer👇")
+    empty_image.image(status.gif)
+    if status.mp4 and empty_video is not None:
+        with empty_video:
+            st.text("Right click the MP4 to save it to your computer👇")
+            st.video(status.mp4)
+    elif status.notice and empty_video is not None:
+        empty_video.info(status.notice)
+    return status
+
+
 def app():
 
     today = date.today()
@@ -620,7 +735,7 @@ def app():
                     index=[0], crs=crs, geometry=[ocean_rois[sample_roi]]
                 )
             try:
-                st.session_state["roi"] = geemap.gdf_to_ee(gdf, geodesic=False)
+                gdf = use_roi(gdf)
             except Exception as e:
                 st.error(e)
                 st.error("Please draw another ROI and try again.")
@@ -628,15 +743,16 @@ def app():
             m.add_gdf(gdf, "ROI")
 
         elif data:
-            gdf = uploaded_file_to_gdf(data)
+            gdf = read_upload(data)
             try:
-                st.session_state["roi"] = geemap.gdf_to_ee(gdf, geodesic=False)
+                gdf = use_roi(gdf)
                 m.add_gdf(gdf, "ROI")
             except Exception as e:
                 st.error(e)
                 st.error("Please draw another ROI and try again.")
                 return
 
+        proxy_layers(m)
         m.to_streamlit(height=600)
 
     with row1_col2:
@@ -658,11 +774,6 @@ def app():
 
             with st.form("submit_landsat_form"):
 
-                roi = None
-                if st.session_state.get("roi") is not None:
-                    roi = st.session_state.get("roi")
-                out_gif = geemap.temp_file_path(".gif")
-
                 title = st.text_input(
                     "Enter a title to show on the timelapse: ", timelapse_title
                 )
@@ -730,6 +841,7 @@ def app():
                 if submitted:
 
                     if sample_roi == "Uploaded GeoJSON" and data is None:
+                        forget_timelapse("landsat")
                         empty_text.warning(
                             "Steps to create a timelapse: Draw a rectangle on the map -> Export it as a GeoJSON -> Upload it back to the app -> Click the Submit button. Alternatively, you can select a sample ROI from the dropdown list."
                         )
@@ -743,45 +855,35 @@ def app():
                         end_date = str(months[1]).zfill(2) + "-30"
                         bands = RGB.split("/")
 
-                        try:
-                            if collection == "Landsat TM-ETM-OLI Surface Reflectance":
-                                out_gif = geemap.landsat_timelapse(
-                                    roi=roi,
-                                    out_gif=out_gif,
-                                    start_year=start_year,
-                                    end_year=end_year,
-                                    start_date=start_date,
-                                    end_date=end_date,
-                                    bands=bands,
-                                    apply_fmask=apply_fmask,
-                                    frames_per_second=speed,
-                                    # dimensions=dimensions,
-                                    dimensions=768,
-                                    overlay_data=overlay_data,
-                                    overlay_color=overlay_color,
-                                    overlay_width=overlay_width,
-                                    overlay_opacity=overlay_opacity,
-                                    frequency=frequency,
-                                    date_format=None,
-                                    title=title,
-                                    title_xy=("2%", "90%"),
-                                    add_text=True,
-                                    text_xy=("2%", "2%"),
-                                    text_sequence=None,
-                                    font_type=font_type,
-                                    font_size=font_size,
-                                    font_color=font_color,
-                                    add_progress_bar=True,
-                                    progress_bar_color=progress_bar_color,
-                                    progress_bar_height=5,
-                                    loop=0,
-                                    mp4=mp4,
-                                    fading=fading,
-                                )
-                            elif collection == "Sentinel-2 MSI Surface Reflectance":
-                                out_gif = geemap.sentinel2_timelapse(
-                                    roi=roi,
-                                    out_gif=out_gif,
+                        if collection == "Landsat TM-ETM-OLI Surface Reflectance":
+                            function = "landsat_timelapse"
+                            revisit = REVISIT_DAYS["landsat"]
+                        else:
+                            function = "sentinel2_timelapse"
+                            revisit = REVISIT_DAYS["sentinel2"]
+                        # Yearly frames only composite the selected months
+                        season = (months[1] - months[0] + 1) / 12
+                        dimensions, cost = plan_timelapse(
+                            "landsat",
+                            empty_text,
+                            frame_count(
+                                f"{start_year}-{start_date}",
+                                f"{end_year}-{months[1]:02d}-28",
+                                frequency,
+                            ),
+                            images_per_frame(
+                                frequency,
+                                revisit,
+                                season if frequency == "year" else 1.0,
+                            ),
+                        )
+                        if dimensions is not None:
+                            submit_timelapse(
+                                "landsat",
+                                function,
+                                kwargs=dict(
+                                    roi=ROI,
+                                    out_gif=OUT_GIF,
                                     start_year=start_year,
                                     end_year=end_year,
                                     start_date=start_date,
@@ -789,8 +891,7 @@ def app():
                                     bands=bands,
                                     apply_fmask=apply_fmask,
                                     frames_per_second=speed,
-                                    dimensions=768,
-                                    # dimensions=dimensions,
+                                    dimensions=dimensions,
                                     overlay_data=overlay_data,
                                     overlay_color=overlay_color,
                                     overlay_width=overlay_width,
@@ -811,32 +912,17 @@ def app():
                                     loop=0,
                                     mp4=mp4,
                                     fading=fading,
-                                )
-                        except:
-                            empty_text.error(
-                                "An error occurred while computing the timelapse. Your probably requested too much data. Try reducing the ROI or timespan."
+                                ),
+                                cost=cost,
                             )
-                            st.stop()
-
-                        if out_gif is not None and os.path.exists(out_gif):
-
-                            empty_text.text(
-                                "Right click the GIF to save it to your computer👇"
-                            )
-                            empty_image.image(out_gif)
-
-                            out_mp4 = out_gif.replace(".gif", ".mp4")
-                            if mp4 and os.path.exists(out_mp4):
-                                with empty_video:
-                                    st.text(
-                                        "Right click the MP4 to save it to your computer👇"
-                                    )
-                                    st.video(out_gif.replace(".gif", ".mp4"))
 
-                        else:
-                            empty_text.error(
-                                "Something went wrong. You probably requested too much data. Try reducing the ROI or timespan."
-                            )
+                show_timelapse(
+                    "landsat",
+                    empty_text,
+                    empty_image,
+                    empty_video,
+                    "An error occurred while computing the timelapse. Your probably requested too much data. Try reducing the ROI or timespan.",
+                )
 
         elif collection == "Geostationary Operational Environmental Satellites (GOES)":
 
@@ -844,11 +930,6 @@ def app():
 
             with st.form("submit_goes_form"):
 
-                roi = None
-                if st.session_state.get("roi") is not None:
-                    roi = st.session_state.get("roi")
-                out_gif = geemap.temp_file_path(".gif")
-
                 satellite = st.selectbox("Select a satellite:", ["GOES-17", "GOES-16"])
                 earliest_date = datetime.date(2017, 7, 10)
                 latest_date = datetime.date.today()
@@ -923,66 +1004,31 @@ def app():
                 submitted = st.form_submit_button("Submit")
                 if submitted:
                     if sample_roi == "Uploaded GeoJSON" and data is None:
+                        forget_timelapse("goes")
+                        forget_timelapse("goes_fire")
                         empty_text.warning(
                             "Steps to create a timelapse: Draw a rectangle on the map -> Export it as a GeoJSON -> Upload it back to the app -> Click the Submit button. Alternatively, you can select a sample ROI from the dropdown list."
                         )
                     else:
                         empty_text.text("Computing... Please wait...")
 
-                        geemap.goes_timelapse(
-                            roi,
-                            out_gif,
-                            start_date=start,
-                            end_date=end,
-                            data=satellite,
-                            scan=scan_type.replace(" ", "_").lower(),
-                            dimensions=768,
-                            framesPerSecond=speed,
-                            date_format="YYYY-MM-dd HH:mm",
-                            xy=("3%", "3%"),
-                            text_sequence=None,
-                            font_type="arial.ttf",
-                            font_size=font_size,
-                            font_color=font_color,
-                            add_progress_bar=add_progress_bar,
-                            progress_bar_color=progress_bar_color,
-                            progress_bar_height=5,
-                            loop=0,
-                            overlay_data=overlay_data,
-                            overlay_color=overlay_color,
-                            overlay_width=overlay_width,
-                            overlay_opacity=overlay_opacity,
-                            mp4=mp4,
-                            fading=fading,
+                        scan = scan_type.replace(" ", "_").lower()
+                        dimensions, cost = plan_timelapse(
+                            "goes",
+                            empty_text,
+                            frame_count(start, end, GOES_SCAN_MINUTES[scan] / 1440),
                         )
-
-                        if out_gif is not None and os.path.exists(out_gif):
-                            empty_text.text(
-                                "Right click the GIF to save it to your computer👇"
-                            )
-                            empty_image.image(out_gif)
-
-                            out_mp4 = out_gif.replace(".gif", ".mp4")
-                            if mp4 and os.path.exists(out_mp4):
-                                with empty_video:
-                                    st.text(
-                                        "Right click the MP4 to save it to your computer👇"
-                                    )
-                                    st.video(out_gif.replace(".gif", ".mp4"))
-
-                            if add_fire:
-                                out_fire_gif = geemap.temp_file_path(".gif")
-                                empty_fire_text.text(
-                                    "Delineating Fire Hotspot... Please wait..."
-                                )
-                                geemap.goes_fire_timelapse(
-                                    out_fire_gif,
+                        if dimensions is not None:
+                            submit_timelapse(
+                                "goes",
+                                "goes_timelapse",
+                                args=[ROI, OUT_GIF],
+                                kwargs=dict(
                                     start_date=start,
                                     end_date=end,
                                     data=satellite,
-                                    scan=scan_type.replace(" ", "_").lower(),
-                                    region=roi,
-                                    dimensions=768,
+                                    scan=scan,
+                                    dimensions=dimensions,
                                     framesPerSecond=speed,
                                     date_format="YYYY-MM-dd HH:mm",
                                     xy=("3%", "3%"),
@@ -994,13 +1040,59 @@ def app():
                                     progress_bar_color=progress_bar_color,
                                     progress_bar_height=5,
                                     loop=0,
-                                )
-                                if os.path.exists(out_fire_gif):
-                                    empty_fire_image.image(out_fire_gif)
-                        else:
-                            empty_text.text(
-                                "Something went wrong, either the ROI is too big or there are no data available for the specified date range. Please try a smaller ROI or different date range."
+                                    overlay_data=overlay_data,
+                                    overlay_color=overlay_color,
+                                    overlay_width=overlay_width,
+                                    overlay_opacity=overlay_opacity,
+                                    mp4=mp4,
+                                    fading=fading,
+                                ),
+                                cost=cost,
                             )
+                            if add_fire:
+                                submit_timelapse(
+                                    "goes_fire",
+                                    "goes_fire_timelapse",
+                                    args=[OUT_GIF],
+                                    kwargs=dict(
+                                        start_date=start,
+                                        end_date=end,
+                                        data=satellite,
+                                        scan=scan,
+                                        region=ROI,
+                                        dimensions=dimensions,
+                                        framesPerSecond=speed,
+                                        date_format="YYYY-MM-dd HH:mm",
+                                        xy=("3%", "3%"),
+                                        text_sequence=None,
+                                        font_type="arial.ttf",
+                                        font_size=font_size,
+                                        font_color=font_color,
+                                        add_progress_bar=add_progress_bar,
+                                        progress_bar_color=progress_bar_color,
+                                        progress_bar_height=5,
+                                        loop=0,
+                                    ),
+                                    cost=cost,
+                                )
+                            else:
+                                forget_timelapse("goes_fire")
+
+                status = show_timelapse(
+                    "goes",
+                    empty_text,
+                    empty_image,
+                    empty_video,
+                    "Something went wrong, either the ROI is too big or there are no data available for the specified date range. Please try a smaller ROI or different date range.",
+                )
+                if status is not None and status.state != FAILED:
+                    show_timelapse(
+                        "goes_fire",
+                        empty_fire_text,
+                        empty_fire_image,
+                        None,
+                        "Fire hotspots could not be delineated for the specified date range.",
+                    )
 
         elif collection == "MODIS Vegetation Indices (NDVI/EVI) 16-Day Global 1km":
 
@@ -1011,11 +1103,6 @@ def app():
 
             with st.form("submit_modis_form"):
 
-                roi = None
-                if st.session_state.get("roi") is not None:
-                    roi = st.session_state.get("roi")
-                out_gif = geemap.temp_file_path(".gif")
-
                 with st.expander("Customize timelapse"):
 
                     start = st.date_input(
@@ -1051,6 +1138,7 @@ def app():
                 submitted = st.form_submit_button("Submit")
                 if submitted:
                     if sample_roi == "Uploaded GeoJSON" and data is None:
+                        forget_timelapse("modis")
                         empty_text.warning(
                             "Steps to create a timelapse: Draw a rectangle on the map -> Export it as a GeoJSON -> Upload it back to the app -> Click the Submit button. Alternatively, you can select a sample ROI from the dropdown list."
                         )
@@ -1058,37 +1146,44 @@ def app():
 
                         empty_text.text("Computing... Please wait...")
 
-                        geemap.modis_ndvi_timelapse(
-                            roi,
-                            out_gif,
-                            satellite,
-                            band,
-                            start_date,
-                            end_date,
-                            768,
-                            speed,
-                            overlay_data=overlay_data,
-                            overlay_color=overlay_color,
-                            overlay_width=overlay_width,
-                            overlay_opacity=overlay_opacity,
-                            mp4=mp4,
-                            fading=fading,
+                        dimensions, cost = plan_timelapse(
+                            "modis",
+                            empty_text,
+                            frame_count(start_date, end_date, 16),
                         )
+                        if dimensions is not None:
+                            submit_timelapse(
+                                "modis",
+                                "modis_ndvi_timelapse",
+                                args=[
+                                    ROI,
+                                    OUT_GIF,
+                                    satellite,
+                                    band,
+                                    start_date,
+                                    end_date,
+                                    dimensions,
+                                    speed,
+                                ],
+                                kwargs=dict(
+                                    overlay_data=overlay_data,
+                                    overlay_color=overlay_color,
+                                    overlay_width=overlay_width,
+                                    overlay_opacity=overlay_opacity,
+                                    mp4=mp4,
+                                    fading=fading,
+                                ),
+                                reduce=True,
+                                cost=cost,
+                            )
 
-                        geemap.reduce_gif_size(out_gif)
-
-                        empty_text.text(
-                            "Right click the GIF to save it to your computer👇"
-                        )
-                        empty_image.image(out_gif)
-
-                        out_mp4 = out_gif.replace(".gif", ".mp4")
-                        if mp4 and os.path.exists(out_mp4):
-                            with empty_video:
-                                st.text(
-                                    "Right click the MP4 to save it to your computer👇"
-                                )
-                                st.video(out_gif.replace(".gif", ".mp4"))
+                show_timelapse(
+                    "modis",
+                    empty_text,
+                    empty_image,
+                    empty_video,
+                    "Something went wrong. You probably requested too much data. Try reducing the ROI or timespan.",
+                )
 
         elif collection == "Any Earth Engine ImageCollection":
 
@@ -1154,73 +1249,73 @@ def app():
                 empty_video = st.container()
                 empty_fire_image = st.empty()
 
-                roi = None
-                if st.session_state.get("roi") is not None:
-                    roi = st.session_state.get("roi")
-                out_gif = geemap.temp_file_path(".gif")
-
                 submitted = st.form_submit_button("Submit")
                 if submitted:
 
                     if sample_roi == "Uploaded GeoJSON" and data is None:
+                        forget_timelapse("ts")
                         empty_text.warning(
                             "Steps to create a timelapse: Draw a rectangle on the map -> Export it as a GeoJSON -> Upload it back to the app -> Click the Submit button. Alternatively, you can select a sample ROI from the dropdown list."
                         )
                     else:
 
                         empty_text.text("Computing... Please wait...")
-                        try:
-                            geemap.create_timelapse(
-                                st.session_state.get("ee_asset_id"),
-                                start_date=start_date.strftime("%Y-%m-%d"),
-                                end_date=end_date.strftime("%Y-%m-%d"),
-                                region=roi,
-                                frequency=frequency,
-                                reducer=reducer,
-                                date_format=data_format,
-                                out_gif=out_gif,
-                                bands=st.session_state.get("bands"),
-                                palette=st.session_state.get("palette"),
-                                vis_params=st.session_state.get("vis_params"),
-                                dimensions=768,
-                                frames_per_second=speed,
-                                crs="EPSG:3857",
-                                overlay_data=overlay_data,
-                                overlay_color=overlay_color,
-                                overlay_width=overlay_width,
-                                overlay_opacity=overlay_opacity,
-                                title=title,
-                                title_xy=("2%", "90%"),
-                                add_text=True,
-                                text_xy=("2%", "2%"),
-                                text_sequence=None,
-                                font_type=font_type,
-                                font_size=font_size,
-                                font_color=font_color,
-                                add_progress_bar=add_progress_bar,
-                                progress_bar_color=progress_bar_color,
-                                progress_bar_height=5,
-                                loop=0,
-                                mp4=mp4,
-                                fading=fading,
-                            )
-                        except:
-                            empty_text.error(
-                                "An error occurred while computing the timelapse. You probably requested too much data. Try reducing the ROI or timespan."
-                            )
-
-                        empty_text.text(
-                            "Right click the GIF to save it to your computer👇"
+                        # The revisit of an arbitrary collection is unknown;
+                        # assume that of Landsat
+                        dimensions, cost = plan_timelapse(
+                            "ts",
+                            empty_text,
+                            frame_count(start_date, end_date, frequency),
+                            images_per_frame(frequency, REVISIT_DAYS["landsat"]),
                         )
-                        empty_image.image(out_gif)
+                        if dimensions is not None:
+                            submit_timelapse(
+                                "ts",
+                                "create_timelapse",
+                                args=[st.session_state.get("ee_asset_id")],
+                                kwargs=dict(
+                                    start_date=start_date.strftime("%Y-%m-%d"),
+                                    end_date=end_date.strftime("%Y-%m-%d"),
+                                    region=ROI,
+                                    frequency=frequency,
+                                    reducer=reducer,
+                                    date_format=data_format,
+                                    out_gif=OUT_GIF,
+                                    bands=st.session_state.get("bands"),
+                                    palette=st.session_state.get("palette"),
+                                    vis_params=st.session_state.get("vis_params"),
+                                    dimensions=dimensions,
+                                    frames_per_second=speed,
+                                    crs="EPSG:3857",
+                                    overlay_data=overlay_data,
+                                    overlay_color=overlay_color,
+                                    overlay_width=overlay_width,
+                                    overlay_opacity=overlay_opacity,
+                                    title=title,
+                                    title_xy=("2%", "90%"),
+                                    add_text=True,
+                                    text_xy=("2%", "2%"),
+                                    text_sequence=None,
+                                    font_type=font_type,
+                                    font_size=font_size,
+                                    font_color=font_color,
+                                    add_progress_bar=add_progress_bar,
+                                    progress_bar_color=progress_bar_color,
+                                    progress_bar_height=5,
+                                    loop=0,
+                                    mp4=mp4,
+                                    fading=fading,
+                                ),
+                                cost=cost,
+                            )
 
-                        out_mp4 = out_gif.replace(".gif", ".mp4")
-                        if mp4 and os.path.exists(out_mp4):
-                            with empty_video:
-                                st.text(
-                                    "Right click the MP4 to save it to your computer👇"
-                                )
-                                st.video(out_gif.replace(".gif", ".mp4"))
+                show_timelapse(
+                    "ts",
+                    empty_text,
+                    empty_image,
+                    empty_video,
+                    "An error occurred while computing the timelapse. You probably requested too much data. Try reducing the ROI or timespan.",
+                )
 
         elif collection in [
             "MODIS Gap filled Land Surface Temperature Daily",
@@ -1282,61 +1377,68 @@ def app():
                 empty_image = st.empty()
                 empty_video = st.container()
 
-                roi = None
-                if st.session_state.get("roi") is not None:
-                    roi = st.session_state.get("roi")
-                out_gif = geemap.temp_file_path(".gif")
-
                 submitted = st.form_submit_button("Submit")
                 if submitted:
 
                     if sample_roi == "Uploaded GeoJSON" and data is None:
+                        forget_timelapse("lst")
                         empty_text.warning(
                             "Steps to create a timelapse: Draw a rectangle on the map -> Export it as a GeoJSON -> Upload it back to the app -> Click the Submit button. Alternatively, you can select a sample ROI from the dropdown list."
                         )
                     else:
 
                         empty_text.text("Computing... Please wait...")
-                        try:
+                        dimensions, cost = plan_timelapse(
+                            "lst",
+                            empty_text,
+                            frame_count(start_date, end_date, frequency),
+                            images_per_frame(frequency, REVISIT_DAYS["modis"]),
+                        )
+                        if dimensions is not None:
+                            options = dict(
+                                start_date=start_date.strftime("%Y-%m-%d"),
+                                end_date=end_date.strftime("%Y-%m-%d"),
+                                region=ROI,
+                                frequency=frequency,
+                                reducer=reducer,
+                                date_format=None,
+                                out_gif=OUT_GIF,
+                                palette=st.session_state.get("palette"),
+                                dimensions=dimensions,
+                                frames_per_second=speed,
+                                crs="EPSG:3857",
+                                overlay_data=overlay_data,
+                                overlay_color=overlay_color,
+                                overlay_width=overlay_width,
+                                overlay_opacity=overlay_opacity,
+                                title=title,
+                                title_xy=("2%", "90%"),
+                                add_text=True,
+                                text_xy=("2%", "2%"),
+                                text_sequence=None,
+                                font_type=font_type,
+                                font_size=font_size,
+                                font_color=font_color,
+                                add_progress_bar=add_progress_bar,
+                                progress_bar_color=progress_bar_color,
+                                progress_bar_height=5,
+                                add_colorbar=add_colorbar,
+                                colorbar_label=colorbar_label,
+                                loop=0,
+                                mp4=mp4,
+                                fading=fading,
+                            )
                             if (
                                 collection
                                 == "MODIS Gap filled Land Surface Temperature Daily"
                             ):
-                                out_gif = geemap.create_timelapse(
-                                    st.session_state.get("ee_asset_id"),
-                                    start_date=start_date.strftime("%Y-%m-%d"),
-                                    end_date=end_date.strftime("%Y-%m-%d"),
-                                    region=roi,
-                                    bands=None,
-                                    frequency=frequency,
-                                    reducer=reducer,
-                                    date_format=None,
-                                    out_gif=out_gif,
-                                    palette=st.session_state.get("palette"),
-                                    vis_params=None,
-                                    dimensions=768,
-                                    frames_per_second=speed,
-                                    crs="EPSG:3857",
-                                    overlay_data=overlay_data,
-                                    overlay_color=overlay_color,
-                                    overlay_width=overlay_width,
-                                    overlay_opacity=overlay_opacity,
-                                    title=title,
-                                    title_xy=("2%", "90%"),
-                                    add_text=True,
-                                    text_xy=("2%", "2%"),
-                                    text_sequence=None,
-                                    font_type=font_type,
-                                    font_size=font_size,
-                                    font_color=font_color,
-                                    add_progress_bar=add_progress_bar,
-                                    progress_bar_color=progress_bar_color,
-                                    progress_bar_height=5,
-                                    add_colorbar=add_colorbar,
-                                    colorbar_label=colorbar_label,
-                                    loop=0,
-                                    mp4=mp4,
-                                    fading=fading,
+                                submit_timelapse(
+                                    "lst",
+                                    "create_timelapse",
+                                    args=[st.session_state.get("ee_asset_id")],
+                                    kwargs=dict(options, bands=None, vis_params=None),
+                                    reduce=True,
+                                    cost=cost,
                                 )
                             elif collection == "MODIS Ocean Color SMI":
                                 if vis_params.startswith("{") and vis_params.endswith(
@@ -1345,68 +1447,26 @@ def app():
                                     vis_params = eval(vis_params)
                                 else:
                                     vis_params = None
-                                out_gif = geemap.modis_ocean_color_timelapse(
-                                    st.session_state.get("ee_asset_id"),
-                                    start_date=start_date.strftime("%Y-%m-%d"),
-                                    end_date=end_date.strftime("%Y-%m-%d"),
-                                    region=roi,
-                                    bands=st.session_state["band"],
-                                    frequency=frequency,
-                                    reducer=reducer,
-                                    date_format=None,
-                                    out_gif=out_gif,
-                                    palette=st.session_state.get("palette"),
-                                    vis_params=vis_params,
-                                    dimensions=768,
-                                    frames_per_second=speed,
-                                    crs="EPSG:3857",
-                                    overlay_data=overlay_data,
-                                    overlay_color=overlay_color,
-                                    overlay_width=overlay_width,
-                                    overlay_opacity=overlay_opacity,
-                                    title=title,
-                                    title_xy=("2%", "90%"),
-                                    add_text=True,
-                                    text_xy=("2%", "2%"),
-                                    text_sequence=None,
-                                    font_type=font_type,
-                                    font_size=font_size,
-                                    font_color=font_color,
-                                    add_progress_bar=add_progress_bar,
-                                    progress_bar_color=progress_bar_color,
-                                    progress_bar_height=5,
-                                    add_colorbar=add_colorbar,
-                                    colorbar_label=colorbar_label,
-                                    loop=0,
-                                    mp4=mp4,
-                                    fading=fading,
+                                submit_timelapse(
+                                    "lst",
+                                    "modis_ocean_color_timelapse",
+                                    args=[st.session_state.get("ee_asset_id")],
+                                    kwargs=dict(
+                                        options,
+                                        bands=st.session_state["band"],
+                                        vis_params=vis_params,
+                                    ),
+                                    reduce=True,
+                                    cost=cost,
                                 )
-                        except:
-                            empty_text.error(
-                                "Something went wrong. You probably requested too much data. Try reducing the ROI or timespan."
-                            )
-
-                        if out_gif is not None and os.path.exists(out_gif):
-
-                            geemap.reduce_gif_size(out_gif)
 
-                            empty_text.text(
-                                "Right click the GIF to save it to your computer👇"
-                            )
-                            empty_image.image(out_gif)
-
-                            out_mp4 = out_gif.replace(".gif", ".mp4")
-                            if mp4 and os.path.exists(out_mp4):
-                                with empty_video:
-                                    st.text(
-                                        "Right click the MP4 to save it to your computer👇"
-                                    )
-                                    st.video(out_gif.replace(".gif", ".mp4"))
-
-                        else:
-                            st.error(
-                                "Something went wrong. You probably requested too much data. Try reducing the ROI or timespan."
-                            )
+                show_timelapse(
+                    "lst",
+                    empty_text,
+                    empty_image,
+                    empty_video,
+                    "Something went wrong. You probably requested too much data. Try reducing the ROI or timespan.",
+                )
 
         elif collection == "USDA National Agriculture Imagery Program (NAIP)":
 
@@ -1450,76 +1510,63 @@ def app():
                 empty_video = st.container()
                 empty_fire_image = st.empty()
 
-                roi = None
-                if st.session_state.get("roi") is not None:
-                    roi = st.session_state.get("roi")
-                out_gif = geemap.temp_file_path(".gif")
-
                 submitted = st.form_submit_button("Submit")
                 if submitted:
 
                     if sample_roi == "Uploaded GeoJSON" and data is None:
+                        forget_timelapse("naip")
                         empty_text.warning(
                             "Steps to create a timelapse: Draw a rectangle on the map -> Export it as a GeoJSON -> Upload it back to the app -> Click the Submit button. Alternatively, you can select a sample ROI from the dropdown list."
                         )
                     else:
 
                         empty_text.text("Computing... Please wait...")
-                        try:
-                            geemap.naip_timelapse(
-                                roi,
-                                years[0],
-                                years[1],
-                                out_gif,
-                                bands=bands.split("/"),
-                                palette=st.session_state.get("palette"),
-                                vis_params=None,
-                                dimensions=768,
-                                frames_per_second=speed,
-                                crs="EPSG:3857",
-                                overlay_data=overlay_data,
-                                overlay_color=overlay_color,
-                                overlay_width=overlay_width,
-                                overlay_opacity=overlay_opacity,
-                                title=title,
-                                title_xy=("2%", "90%"),
-                                add_text=True,
-                                text_xy=("2%", "2%"),
-                                text_sequence=None,
-                                font_type=font_type,
-                                font_size=font_size,
-                                font_color=font_color,
-                                add_progress_bar=add_progress_bar,
-                                progress_bar_color=progress_bar_color,
-                                progress_bar_height=5,
-                                loop=0,
-                                mp4=mp4,
-                                fading=fading,
-                            )
-                        except:
-                            empty_text.error(
-                                "Something went wrong. You either requested too much data or the ROI is outside the U.S."
-                            )
-
-                        if out_gif is not None and os.path.exists(out_gif):
-
-                            empty_text.text(
-                                "Right click the GIF to save it to your computer👇"
+                        dimensions, cost = plan_timelapse(
+                            "naip",
+                            empty_text,
+                            frame_count(f"{years[0]}-01-01", f"{years[1]}-12-31", "year"),
+                        )
+                        if dimensions is not None:
+                            submit_timelapse(
+                                "naip",
+                                "naip_timelapse",
+                                args=[ROI, years[0], years[1], OUT_GIF],
+                                kwargs=dict(
+                                    bands=bands.split("/"),
+                                    palette=st.session_state.get("palette"),
+                                    vis_params=None,
+                                    dimensions=dimensions,
+                                    frames_per_second=speed,
+                                    crs="EPSG:3857",
+                                    overlay_data=overlay_data,
+                                    overlay_color=overlay_color,
+                                    overlay_width=overlay_width,
+                                    overlay_opacity=overlay_opacity,
+                                    title=title,
+                                    title_xy=("2%", "90%"),
+                                    add_text=True,
+                                    text_xy=("2%", "2%"),
+                                    text_sequence=None,
+                                    font_type=font_type,
+                                    font_size=font_size,
+                                    font_color=font_color,
+                                    add_progress_bar=add_progress_bar,
+                                    progress_bar_color=progress_bar_color,
+                                    progress_bar_height=5,
+                                    loop=0,
+                                    mp4=mp4,
+                                    fading=fading,
+                                ),
+                                cost=cost,
                             )
-                            empty_image.image(out_gif)
 
-                            out_mp4 = out_gif.replace(".gif", ".mp4")
-                            if mp4 and os.path.exists(out_mp4):
-                                with empty_video:
-                                    st.text(
-                                        "Right click the MP4 to save it to your computer👇"
-                                    )
-                                    st.video(out_gif.replace(".gif", ".mp4"))
-
-                        else:
-                            st.error(
-                                "Something went wrong. You either requested too much data or the ROI is outside the U.S."
-                            )
+                show_timelapse(
+                    "naip",
+                    empty_text,
+                    empty_image,
+                    empty_video,
+                    "Something went wrong. You either requested too much data or the ROI is outside the U.S.",
+                )
 
 
 try:
@@ -2,6 +2,8 @@ import streamlit as st
 import leafmap.foliumap as leafmap
 from PIL import Image
 
+from flood.tile_proxy import proxy_layers
+
 st.set_page_config(layout="wide")
 
 st.sidebar.title("Resources:")
@@ -93,6 +95,7 @@ overview of the map powered by OpenStreetMap.
 
 m = leafmap.Map(minimap_control=True)
 m.add_basemap("OpenTopoMap")
+proxy_layers(m)
 m.to_streamlit(height=500)
 
 st.markdown(
@@ -0,0 +1,53 @@
+"""Re-ingesting a workbook whose incidents are already in the store."""
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from flood.geocode import GazetteerBackend, GeocodeCache
+from flood.ingest import ingest
+from flood.store import date_key, get_store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, "analytics", "data2")
+WORKBOOK = os.path.join(DATA, "all_states_all_years_v2.xlsx")
+GAZETTEER = os.path.join(DATA, "all_states_all_years_geocoded_v2.csv")
+CSV = os.path.join(DATA, "all_states_all_years_geocoded.csv")
+KEY = ["Year", "State", "Region", "Place", "DateKey"]
+
+
+def incident_keys(frame):
+    keys = frame[["Year"]].astype(int)
+    for column in ["State", "Region", "Place"]:
+        keys[column] = frame[column].astype("string").str.strip()
+    keys["DateKey"] = date_key(frame["Date"])
+    return keys[KEY]
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "data2" / os.path.basename(CSV)
+    path.parent.mkdir()
+    shutil.copy(CSV, path)
+    return str(path)
+
+
+def test_reingest_v2_workbook_appends_no_duplicates(csv_path, tmp_path):
+    before = incident_keys(get_store(csv_path).frame)
+    backend = GazetteerBackend(pd.read_csv(GAZETTEER))
+    cache = GeocodeCache(str(tmp_path / "geocode.sqlite"))
+    try:
+        first = ingest(WORKBOOK, backend, cache, csv_path=csv_path)
+        # Rows that were not located leave the workbook to be read again
+        second = ingest(WORKBOOK, backend, cache, csv_path=csv_path)
+    finally:
+        cache.close()
+
+    # Only incidents missing from the store are appended: none of them is
+    # a stored incident with its day and month swapped ('3/1' vs '1-Mar')
+    after = incident_keys(get_store(csv_path).frame)
+    assert len(after) == len(before) + first["appended"]
+    assert len(after.merge(before.drop_duplicates(), on=KEY)) == len(before)
+    assert first["appended"] < 10
+    assert second["appended"] == 0